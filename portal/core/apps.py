@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+        from .metrics import install_query_timer
+
+        connection_created.connect(install_query_timer)
+        post_migrate.connect(signals.fill_section_paths, sender=self)
@@ -0,0 +1,123 @@
+"""
+Indice en memoria de los nombres de archivo de cada seccion raiz, para
+responder el autocompletado del buscador sin ir a la base de datos.
+
+Cada worker arma el indice de una seccion la primera vez que se pide y lo
+mantiene al dia con el contador de version del subarbol
+(Section.subtree_version): si solo se agregaron archivos se insertan los
+nuevos, si no, se vuelve a armar. Los indices armados no se modifican
+(se reemplazan), asi las busquedas no necesitan un lock; armarlos si,
+uno por seccion.
+"""
+from bisect import bisect_left, insort
+from threading import Lock
+
+from .caching import get_versions
+from .models import Archive, Section
+from .utils import normalize_name
+
+
+def word_starts(name: str) -> list[int]:
+    """
+    Posiciones donde empieza cada palabra del nombre, asi se encuentra
+    "informe anual.pdf" buscando "anual".
+    """
+    return [
+        i for i, c in enumerate(name)
+        if c.isalnum() and (i == 0 or not name[i - 1].isalnum())
+    ]
+
+
+class NameIndex:
+    """
+    Arreglo ordenado de (sufijo normalizado, fullname, id) con una entrada
+    por palabra de cada nombre. Una busqueda por prefijo es una busqueda
+    binaria y un recorrido de las entradas contiguas.
+    """
+
+    def __init__(self, rows):
+        self.entries = []
+        self.ids = set()
+        self.max_id = 0
+        for row in rows:
+            self.entries.extend(self.row_entries(*row))
+        self.entries.sort()
+
+    def row_entries(self, arch_id: int, fullname: str, search_name: str):
+        self.ids.add(arch_id)
+        self.max_id = max(self.max_id, arch_id)
+        return [(search_name[i:], fullname, arch_id) for i in word_starts(search_name)]
+
+    def extended(self, rows) -> "NameIndex":
+        """
+        Copia del indice con las filas agregadas.
+        """
+        index = NameIndex([])
+        index.entries = list(self.entries)
+        index.ids = set(self.ids)
+        index.max_id = self.max_id
+        for row in rows:
+            for entry in index.row_entries(*row):
+                insort(index.entries, entry)
+        return index
+
+    def search(self, term: str, limit: int) -> list[dict]:
+        norm = normalize_name(term)
+        if not norm:
+            return []
+        results = []
+        seen = set()
+        i = bisect_left(self.entries, (norm,))
+        while i < len(self.entries) and len(results) < limit:
+            key, fullname, arch_id = self.entries[i]
+            if not key.startswith(norm):
+                break
+            if arch_id not in seen:
+                seen.add(arch_id)
+                results.append({"id": arch_id, "fullname": fullname})
+            i += 1
+        return results
+
+
+_indexes: dict[int, tuple[int, NameIndex]] = {}
+# Un lock por seccion: armar el indice de una seccion no demora las
+# busquedas de las demas
+_build_locks: dict[int, Lock] = {}
+_lock = Lock()
+
+
+def subtree_rows(section: Section, **filters):
+    return Archive.objects \
+        .filter(section__path__startswith=section.path, **filters) \
+        .values_list("id", "fullname", "search_name")
+
+
+def get_index(section: Section) -> NameIndex:
+    version_name = Section.subtree_version(section.id)
+    version = get_versions(version_name)[version_name]
+    cached = _indexes.get(section.id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    with _lock:
+        build_lock = _build_locks.setdefault(section.id, Lock())
+    with build_lock:
+        # Otro hilo pudo haberlo armado mientras se esperaba el lock
+        cached = _indexes.get(section.id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        index = cached[1] if cached else None
+        if index is not None:
+            new_rows = list(subtree_rows(section, id__gt=index.max_id))
+            total = Archive.objects \
+                .filter(section__path__startswith=section.path) \
+                .count()
+            if total == len(index.ids) + len(new_rows):
+                index = index.extended(new_rows)
+            else:
+                index = None
+        if index is None:
+            index = NameIndex(subtree_rows(section).iterator())
+        _indexes[section.id] = (version, index)
+        return index
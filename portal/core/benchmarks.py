@@ -0,0 +1,372 @@
+"""
+Benchmarks de los caminos mas usados de la wiki, ver el comando bench_suite.
+
+seed() arma datos sinteticos bajo una seccion raiz propia: un arbol de
+secciones ancho y profundo, muchos archivos (todos comparten dos blobs,
+asi no se escribe un archivo por fila) y permisos repartidos entre
+grupos y usuarios. run_scenario() pide cada vista con el Client de
+Django y mide la latencia, las queries por pedido y el pico de memoria.
+"""
+import hashlib
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable
+
+from django.contrib.auth.models import Group, Permission
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .fake_server import CORPUS_WORDS, synthetic_text
+from .models import (
+    Archive,
+    ArchiveNameTrigram,
+    Blob,
+    GroupSectionPermission,
+    IndexStatus,
+    Section,
+    User,
+    UserArchivePermission,
+    UserSectionPermission,
+)
+from .utils import normalize_name
+
+ROOT_NAME = "bench-root"
+READER_NAME = "bench-reader"
+READER_PERMS = ["view_section", "view_archive", "add_archive", "delete_archive"]
+
+
+@dataclass
+class SeedOptions:
+    depth: int = 4
+    width: int = 6
+    archives: int = 100_000
+    groups: int = 8
+    users: int = 200
+    # Permisos directos del lector sobre archivos sueltos
+    archive_grants: int = 500
+    # Archivos con referencias, cada uno con 'references_each'
+    references: int = 200
+    references_each: int = 5
+    batch_size: int = 5000
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Recibe el numero de pedido y devuelve la respuesta
+    request: Callable[[Client, int], object]
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+    errors: int = 0
+    peak_memory: int = 0
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+
+        return {
+            "requests": len(ordered),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "mean_ms": statistics.fmean(ordered) * 1000,
+            "queries": statistics.fmean(self.queries),
+            "max_queries": max(self.queries),
+            "peak_memory_kb": self.peak_memory / 1024,
+            "errors": self.errors,
+        }
+
+
+def bulk_permissions(model, rows: list, codenames: list[str]):
+    """
+    Asigna los permisos a filas de permisos ya creadas, sin un set() por fila.
+    """
+    perms = list(Permission.objects.filter(codename__in=codenames))
+    through = model.permissions.through
+    column = "{}_id".format(model._meta.model_name)
+    through.objects.bulk_create([
+        through(**{column: row.id, "permission_id": perm.id})
+        for row in rows
+        for perm in perms
+    ])
+
+
+def seed_blob(extension: str) -> Blob:
+    content = "# Bench\n\n{}\n".format(synthetic_text(400)).encode("utf-8")
+    sha = hashlib.sha256(content).hexdigest()
+    name = Blob.storage_name(sha, extension)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+    blob, _ = Blob.objects.get_or_create(
+        sha256=sha,
+        defaults={"file": name, "size": len(content), "uuid": uuid.uuid4().hex}
+    )
+    return blob
+
+
+def seed_sections(root: Section, opts: SeedOptions) -> list[list[Section]]:
+    levels = [[root]]
+    for level in range(opts.depth):
+        children = [
+            Section(name="s{}-{}-{}".format(level + 1, parent.id, i), parent=parent)
+            for parent in levels[-1]
+            for i in range(opts.width)
+        ]
+        Section.objects.bulk_create(children, batch_size=opts.batch_size)
+        for sec in children:
+            sec.path, sec.depth = Section.build_path(sec.parent, sec.pk)
+        Section.objects.bulk_update(children, ["path", "depth"], batch_size=opts.batch_size)
+        levels.append(children)
+    return levels
+
+
+def seed_archives(sections: list[Section], opts: SeedOptions, rng: random.Random):
+    blobs = {".txt": seed_blob(".txt"), ".md": seed_blob(".md")}
+    for start in range(0, opts.archives, opts.batch_size):
+        batch = []
+        for i in range(start, min(start + opts.batch_size, opts.archives)):
+            extension = ".md" if i % 5 == 0 else ".txt"
+            name = "{}-{}-{}".format(rng.choice(CORPUS_WORDS), rng.choice(CORPUS_WORDS), i)
+            blob = blobs[extension]
+            batch.append(Archive(
+                fullname=name + extension,
+                name=name,
+                extension=extension,
+                section=rng.choice(sections),
+                file=blob.file.name,
+                blob=blob,
+                # Cada fila con su documento, como si no hubiera duplicados
+                uuid=uuid.uuid4().hex,
+                search_name=normalize_name(name + extension),
+                index_status=IndexStatus.INDEXED
+            ))
+        Archive.objects.bulk_create(batch)
+        ArchiveNameTrigram.objects.bulk_create(
+            ArchiveNameTrigram.build(batch),
+            batch_size=opts.batch_size
+        )
+    for blob in blobs.values():
+        Blob.objects.filter(pk=blob.pk).update(refcount=blob.archives.count())
+
+
+def seed_permissions(reader: User, levels: list[list[Section]], opts: SeedOptions,
+                     rng: random.Random):
+    root, top = levels[0][0], levels[1]
+    groups = Group.objects.bulk_create([
+        Group(name="bench-group-{}".format(i)) for i in range(opts.groups)
+    ])
+    # Cada seccion de primer nivel, salvo un tercio, es de un grupo
+    granted = top[:max(1, len(top) * 2 // 3)]
+    rows = GroupSectionPermission.objects.bulk_create([
+        GroupSectionPermission(group=groups[i % len(groups)], section=sec)
+        for i, sec in enumerate(granted)
+    ])
+    bulk_permissions(GroupSectionPermission, rows, READER_PERMS)
+    reader.groups.set(groups[:max(1, len(groups) // 2)] + [rows[-1].group])
+
+    # El lector ve la raiz; el resto de los permisos le llega por grupos,
+    # por secciones profundas y por archivos sueltos
+    root_row = UserSectionPermission.objects.create(user=reader, section=root)
+    bulk_permissions(UserSectionPermission, [root_row], ["view_section"])
+    deep = levels[-1]
+    bulk_permissions(
+        UserSectionPermission,
+        UserSectionPermission.objects.bulk_create([
+            UserSectionPermission(user=reader, section=sec)
+            for sec in rng.sample(deep, min(len(deep), 20))
+        ]),
+        READER_PERMS
+    )
+    archive_ids = list(
+        Archive.objects
+            .filter(section__path__startswith=root.path)
+            .values_list("id", flat=True)[:opts.archive_grants * 10]
+    )
+    archive_rows = UserArchivePermission.objects.bulk_create([
+        UserArchivePermission(user=reader, archive_id=archive_id)
+        for archive_id in rng.sample(archive_ids, min(len(archive_ids), opts.archive_grants))
+    ])
+    bulk_permissions(UserArchivePermission, archive_rows, ["view_archive"])
+
+    # Otros usuarios: filas de permisos y membresias que las consultas
+    # tienen que descartar
+    users = User.objects.bulk_create([
+        User(username="bench-user-{}".format(i)) for i in range(opts.users)
+    ])
+    sections = [sec for level in levels[1:] for sec in level]
+    other_rows = UserSectionPermission.objects.bulk_create([
+        UserSectionPermission(user=user, section=sec)
+        for user in users
+        for sec in rng.sample(sections, min(len(sections), 5))
+    ], batch_size=opts.batch_size)
+    bulk_permissions(UserSectionPermission, other_rows, ["view_section", "view_archive"])
+    membership = User.groups.through
+    membership.objects.bulk_create([
+        membership(user_id=user.id, group_id=rng.choice(groups).id)
+        for user in users
+    ], batch_size=opts.batch_size)
+
+
+def seed_references(root: Section, opts: SeedOptions, rng: random.Random):
+    ids = list(
+        Archive.objects
+            .filter(section__path__startswith=root.path)
+            .values_list("id", flat=True)[:max(opts.references * 10, 100)]
+    )
+    through = Archive.references.through
+    rows = {}
+    for from_id in ids[:opts.references]:
+        for to_id in rng.sample(ids, min(len(ids), opts.references_each)):
+            if to_id != from_id:
+                rows[(from_id, to_id)] = through(from_archive_id=from_id, to_archive_id=to_id)
+    through.objects.bulk_create(list(rows.values()))
+
+
+def seed(opts: SeedOptions, *, seed: int | None = None) -> tuple[User, bool]:
+    """
+    Crea los datos si no existen. Devuelve el lector (main_section en la
+    raiz de los datos) y si hubo que crearlos.
+    """
+    reader = User.objects.filter(username=READER_NAME).first()
+    if reader is not None:
+        return reader, False
+    rng = random.Random(seed)
+    with transaction.atomic():
+        root = Section.objects.create(name=ROOT_NAME)
+        levels = seed_sections(root, opts)
+        sections = [sec for level in levels for sec in level]
+        seed_archives(sections, opts, rng)
+        reader = User.objects.create(username=READER_NAME, main_section=root)
+        seed_permissions(reader, levels, opts, rng)
+        seed_references(root, opts, rng)
+    return reader, True
+
+
+def index_corpus(store, reader: User, size: int):
+    """
+    Indexa en el Elasticsearch falso el contenido sintetico de los primeros
+    'size' archivos del arbol.
+    """
+    assert reader.main_section
+    archives = Archive.objects \
+        .filter(section__path__startswith=reader.main_section.path) \
+        .values_list("uuid", "extension", "section_id", "section__path")[:size]
+    for doc_id, extension, section_id, path in archives:
+        tags = Section(id=section_id, path=path).index_tags()
+        tags["external"].update(Archive.objects.filter(uuid=doc_id).grantee_tags())
+        store.index_document(
+            content=synthetic_text(50),
+            tags=tags,
+            extension=extension,
+            doc_id=doc_id
+        )
+
+
+def sample_ids(reader: User, extension: str, size: int = 200) -> list[int]:
+    """
+    Archivos que el lector puede abrir, por permisos propios o heredados
+    de sus secciones.
+    """
+    assert reader.main_section
+    return list(
+        Archive.objects
+            .filter(section__path__startswith=reader.main_section.path, extension=extension)
+            .permitted(reader, "view_archive")
+            .values_list("id", flat=True)[:size]
+    )
+
+
+def build_scenarios(reader: User, rng: random.Random) -> list[Scenario]:
+    root = reader.main_section
+    assert root
+    deep = Section.objects \
+        .filter(path__startswith=root.path) \
+        .permitted(reader, "add_archive") \
+        .order_by("-depth", "id") \
+        .first()
+    assert deep
+    texts = sample_ids(reader, ".txt")
+    markdowns = sample_ids(reader, ".md")
+    referencing = list(
+        Archive.objects
+            .filter(section__path__startswith=root.path, references__isnull=False)
+            .values_list("id", flat=True)
+            .distinct()[:200]
+    )
+
+    def words(count: int) -> str:
+        return " ".join(rng.choice(CORPUS_WORDS) for _ in range(count))
+
+    search_url = reverse("core:search-list")
+    return [
+        Scenario("children", lambda c, i: c.get(reverse("core:children"))),
+        Scenario("section_children", lambda c, i: c.get(
+            reverse("core:section_children", args=[deep.parent_id])
+        )),
+        Scenario("search_name", lambda c, i: c.get(search_url, {
+            "name": "{}-{}".format(rng.choice(CORPUS_WORDS), rng.choice(CORPUS_WORDS))
+        })),
+        Scenario("search_content", lambda c, i: c.get(search_url, {
+            "name": words(2),
+            "by_content": "on"
+        })),
+        Scenario("archive_text", lambda c, i: c.get(
+            reverse("core:archive", args=[rng.choice(texts)])
+        )),
+        Scenario("archive_markdown", lambda c, i: c.get(
+            reverse("core:archive", args=[rng.choice(markdowns)])
+        )),
+        Scenario("references", lambda c, i: c.get(
+            reverse("core:references", args=[rng.choice(referencing)])
+        )),
+        Scenario("create_archive", lambda c, i: c.post(reverse("core:create_archive"), {
+            "root_id": deep.id,
+            "file": SimpleUploadedFile(
+                "bench-{}-{}.txt".format(i, uuid.uuid4().hex[:8]),
+                synthetic_text(100).encode("utf-8")
+            )
+        })),
+    ]
+
+
+def run_scenario(client: Client, scenario: Scenario, *, requests: int, warmup: int,
+                 memory_requests: int, before_request: Callable[[], None]) -> Result:
+    result = Result()
+    for i in range(warmup):
+        scenario.request(client, i)
+    for i in range(requests):
+        before_request()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = scenario.request(client, warmup + i)
+            result.latencies.append(time.perf_counter() - start)
+        result.queries.append(len(queries.captured_queries))
+        if response.status_code >= 400:
+            result.errors += 1
+
+    # Aparte: tracemalloc hace mas lento cada pedido
+    tracemalloc.start()
+    try:
+        for i in range(memory_requests):
+            before_request()
+            tracemalloc.reset_peak()
+            scenario.request(client, warmup + requests + i)
+            result.peak_memory = max(result.peak_memory, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return result
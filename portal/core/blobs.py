@@ -0,0 +1,190 @@
+"""
+Almacenamiento de archivos por contenido.
+
+Cada contenido distinto se guarda una sola vez (Blob, por SHA-256) y los
+Archive apuntan al blob. El blob lleva la cuenta de referencias: el
+archivo y el documento de Elasticsearch se borran al liberar la ultima.
+Como un mismo documento puede pertenecer a varias secciones, sus tags
+de indexado (ver Section.index_tags) listan todas las secciones, y los
+usuarios y grupos con permiso directo sobre alguno de los archivos.
+"""
+import hashlib
+import logging
+import os
+
+import requests
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import rendering
+from .models import Archive, Blob
+from .service import elastic_service
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(file: File) -> str:
+    """
+    SHA-256 del archivo. Las subidas ya lo traen calculado por
+    core/uploads.py, el resto se lee por partes.
+    """
+    digest = getattr(file, "sha256", None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha.update(chunk)
+    file.seek(0)
+    return sha.hexdigest()
+
+
+def acquire_blob(file: File) -> tuple[Blob, bool]:
+    """
+    Devuelve el blob con el contenido del archivo sumandole una referencia,
+    y si fue creado. Solo se escribe en el storage si el contenido es nuevo.
+    """
+    sha256 = hash_file(file)
+    if Blob.objects.filter(sha256=sha256).update(refcount=F("refcount") + 1):
+        return (Blob.objects.get(sha256=sha256), False)
+    return create_blob(file, sha256, refcount=1)
+
+
+def store_blob(file: File) -> tuple[Blob, bool]:
+    """
+    Como acquire_blob pero sin sumar la referencia: la suma add_references
+    en la transaccion que crea los Archive. Un blob nuevo queda sin
+    referencias hasta entonces.
+    """
+    sha256 = hash_file(file)
+    blob = Blob.objects.filter(sha256=sha256).first()
+    if blob:
+        return (blob, False)
+    return create_blob(file, sha256, refcount=0)
+
+
+def create_blob(file: File, sha256: str, refcount: int) -> tuple[Blob, bool]:
+    _, extension = os.path.splitext(str(file.name))
+    stored_name = default_storage.save(Blob.storage_name(sha256, extension[:12]), file)
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(
+                sha256=sha256,
+                file=stored_name,
+                size=file.size,
+                refcount=refcount
+            )
+        return (blob, True)
+    except IntegrityError:
+        # Otra subida del mismo contenido gano la carrera
+        default_storage.delete(stored_name)
+        if refcount:
+            Blob.objects.filter(sha256=sha256).update(refcount=F("refcount") + refcount)
+        return (Blob.objects.get(sha256=sha256), False)
+
+
+def add_references(counts: dict[int, int]):
+    """
+    Suma counts[id] referencias a cada blob. Debe llamarse dentro de la
+    transaccion que crea los Archive que las usan, asi la cuenta no queda
+    adelantada si la transaccion no llega a confirmarse.
+    Lanza Blob.DoesNotExist si algun blob se borro mientras tanto.
+    """
+    found = set(
+        Blob.objects
+            .select_for_update()
+            .filter(pk__in=list(counts))
+            .values_list("pk", flat=True)
+    )
+    missing = set(counts) - found
+    if missing:
+        raise Blob.DoesNotExist("Blobs {} no longer exist".format(sorted(missing)))
+    by_count: dict[int, list[int]] = {}
+    for blob_id, count in counts.items():
+        by_count.setdefault(count, []).append(blob_id)
+    for count, ids in by_count.items():
+        Blob.objects.filter(pk__in=ids).update(refcount=F("refcount") + count)
+
+
+def release_blob(blob_id: int):
+    """
+    Quita una referencia al blob. Con la ultima se borran el archivo y el
+    documento de Elasticsearch; si quedan, se actualizan las secciones del
+    documento.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if not blob:
+            return
+        blob.refcount = max(blob.refcount - 1, 0)
+        last = blob.refcount == 0 and not blob.archives.exists()
+        if last:
+            blob.delete()
+        else:
+            blob.save(update_fields=["refcount"])
+
+    if last:
+        blob.file.delete(save=False)
+        default_storage.delete(rendering.storage_name(blob.sha256))
+        elastic_service.delete_document(index="idx", doc_id=blob.uuid)
+    elif blob.uuid:
+        try:
+            sync_document_tags(blob)
+        except requests.RequestException as exc:
+            # El documento queda con secciones de mas, las busquedas
+            # igual filtran los resultados por permisos en la base
+            err = "Couldn't update sections of document {id}: {exc}"
+            logger.warning(err.format(id=blob.uuid, exc=exc))
+
+
+def index_tags(blob: Blob) -> dict:
+    """
+    Tags de indexado del documento del blob: las secciones de todos los
+    archivos que lo comparten y los permisos asignados a ellos.
+    """
+    archives = Archive.objects.filter(blob=blob)
+    rows = archives \
+        .values_list("section_id", "section__path") \
+        .distinct() \
+        .order_by("section_id")
+    return {
+        "external": {
+            "section_id": [section_id for section_id, _ in rows],
+            "section_path": [path for _, path in rows],
+            **archives.grantee_tags()
+        }
+    }
+
+
+def sync_document_tags(blob: Blob):
+    assert blob.uuid
+    elastic_service.update_document(index="idx", doc_id=blob.uuid, doc=index_tags(blob))
+
+
+def sync_grantees(archive_ids):
+    """
+    Actualiza los documentos de los archivos luego de un cambio en sus
+    permisos asignados directamente, ver ArchiveQuerySet.grantee_tags.
+    """
+    archives = Archive.objects \
+        .filter(pk__in=list(archive_ids)) \
+        .exclude(uuid="") \
+        .select_related("section", "blob")
+    synced = set()
+    for arch in archives:
+        if arch.blob_id in synced:
+            # Documento compartido, ya actualizado
+            continue
+        try:
+            if arch.blob_id and arch.blob.uuid:
+                synced.add(arch.blob_id)
+                sync_document_tags(arch.blob)
+            elif not arch.blob_id:
+                elastic_service.update_document(index="idx", doc_id=arch.uuid, doc=arch.index_tags())
+        except requests.RequestException as exc:
+            # Hasta el proximo cambio el documento no refleja los permisos
+            # directos; los resultados igual se filtran en la base
+            err = "Couldn't update grantees of document {id}: {exc}"
+            logger.warning(err.format(id=arch.uuid, exc=exc))
@@ -0,0 +1,91 @@
+"""
+Cache en dos niveles: una cache local a cada proceso ("local") delante
+de la cache compartida entre workers ("default").
+
+Las entradas no se borran al invalidar: cada clave incluye uno o mas
+contadores de version guardados en la cache compartida, y al cambiar los
+datos se incrementa el contador (ver bump_versions). Las claves viejas
+simplemente dejan de pedirse y expiran, por lo que la cache local nunca
+necesita invalidarse.
+"""
+import time
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_PREFIX = "version:"
+
+_missing = object()
+
+
+def shared_cache():
+    return caches["default"]
+
+
+def local_cache():
+    return caches["local"]
+
+
+def _initial_version() -> int:
+    # Si la cache compartida pierde un contador no puede volver a un valor
+    # ya usado, por eso se inicializa con el tiempo actual.
+    return time.time_ns() // 1000
+
+
+def get_versions(*names: str) -> dict[str, int]:
+    """
+    Obtiene los contadores pedidos con un solo acceso a la cache compartida.
+    """
+    cache = shared_cache()
+    keys = {VERSION_PREFIX + name: name for name in names}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, _initial_version(), timeout=None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def bump_versions(*names: str):
+    cache = shared_cache()
+    for name in names:
+        key = VERSION_PREFIX + name
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, _initial_version(), timeout=None):
+                cache.incr(key)
+
+
+def versioned_key(prefix: str, *parts: Any) -> str:
+    return ":".join([prefix, *(str(p) for p in parts)])
+
+
+def get_cached(key: str, default: Any = None) -> Any:
+    value = local_cache().get(key, _missing)
+    if value is not _missing:
+        return value
+    value = shared_cache().get(key, _missing)
+    if value is _missing:
+        return default
+    local_cache().set(key, value)
+    return value
+
+
+def set_cached(key: str, value: Any, timeout: int | None):
+    shared_cache().set(key, value, timeout)
+    local_cache().set(key, value)
+
+
+def get_or_compute(key: str, compute: Callable[[], Any],
+                   timeout: int | None = None) -> Any:
+    value = get_cached(key, _missing)
+    if value is _missing:
+        value = compute()
+        if timeout is None:
+            timeout = settings.CACHE_DEFAULT_TIMEOUT
+        set_cached(key, value, timeout)
+    return value
@@ -0,0 +1,255 @@
+"""
+Servidores HTTP que imitan la parte de las APIs de Elasticsearch y
+FsCrawler que usan los servicios de core/service.py, sobre los
+documentos en memoria de FakeElasticSearchService (core/fakes.py).
+
+Sirven para pruebas de carga y benchmarks locales sin el stack de
+prod-compose.yml: cada respuesta puede demorarse (latency, jitter) y
+fallar con un 503 (error_rate). Ver el comando run_fake_backends.
+"""
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .fakes import FakeElasticSearchService
+
+SEARCH_PATH = re.compile(r"^/(?P<index>[^/_][^/]*)/_search$")
+DOC_PATH = re.compile(r"^/(?P<index>[^/_][^/]*)/_doc/(?P<doc_id>[^/]+)$")
+UPDATE_PATH = re.compile(r"^/(?P<index>[^/_][^/]*)/_update/(?P<doc_id>[^/]+)$")
+
+# Vocabulario de los documentos sinteticos (run_fake_backends, bench_suite)
+CORPUS_WORDS = (
+    "acta anexo balance contrato convenio decreto expediente factura informe "
+    "inventario licitacion memoria minuta nota orden plan presupuesto proyecto "
+    "reglamento resolucion solicitud anual mensual tecnico legal interno "
+    "obra compra personal sistema red servidor manual norma"
+).split()
+
+
+def synthetic_text(words: int) -> str:
+    return " ".join(random.choices(CORPUS_WORDS, k=words))
+
+
+@dataclass
+class Faults:
+    latency: float = 0
+    jitter: float = 0
+    error_rate: float = 0
+
+    def delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    def fail(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def search_extra(body: dict) -> tuple[str, dict]:
+    """
+    Inversa de ElasticSearchService.search_body: el texto buscado y los
+    parametros 'extra' que armaron la consulta. El rango de fechas se
+    ignora, los documentos en memoria no tienen fechas.
+    """
+    query = body["query"]["bool"]
+    extra: dict = {
+        "from": body.get("from", 0),
+        "size": body.get("size", 10),
+    }
+    for clause in query.get("filter", []):
+        if "term" in clause:
+            extra["extension"] = clause["term"]["file.extension"]
+        elif "prefix" in clause:
+            extra["section_path"] = clause["prefix"]["external.section_path.keyword"]
+        elif "terms" in clause:
+            extra["section_ids"] = clause["terms"]["external.section_id"]
+        elif "bool" in clause:
+            acl = {"section_paths": [], "user_id": None, "group_ids": []}
+            for should in clause["bool"]["should"]:
+                if "prefix" in should:
+                    acl["section_paths"].append(should["prefix"]["external.section_path.keyword"])
+                elif "term" in should:
+                    acl["user_id"] = should["term"]["external.user_id"]
+                else:
+                    acl["group_ids"].extend(should["terms"]["external.group_id"])
+            extra["acl"] = acl
+    return query["must"]["query_string"]["query"], extra
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # La respuesta se escribe en partes: sin esto la conexion persistente
+    # suma la espera de Nagle a cada respuesta
+    disable_nagle_algorithm = True
+    server: "FakeServer"
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        time.sleep(self.server.faults.delay())
+        if self.server.faults.fail():
+            self.respond(503, {"error": "fake failure", "status": 503})
+            return
+        url = urlsplit(self.path)
+        try:
+            status, payload = self.route(url.path, parse_qs(url.query), body)
+        except (KeyError, ValueError) as exc:
+            status, payload = 400, {"error": "bad request: {}".format(exc), "status": 400}
+        self.respond(status, payload)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_DELETE = handle_request
+
+    def route(self, path: str, query: dict, body: bytes) -> tuple[int, dict]:
+        raise NotImplementedError
+
+    def respond(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            # El cliente corto por timeout
+            pass
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ElasticHandler(FakeHandler):
+    def route(self, path: str, query: dict, body: bytes) -> tuple[int, dict]:
+        store = self.server.store
+        if path == "/" and self.command == "GET":
+            return 200, {
+                "name": "fake-elasticsearch",
+                "version": {"number": "8.0.0-fake"},
+                "tagline": "You Know, for Search"
+            }
+
+        match = SEARCH_PATH.match(path)
+        if match and self.command in ("GET", "POST"):
+            request = json.loads(body or b"{}")
+            content, extra = search_extra(request)
+            res = store.search_by_content(index=match["index"], content=content, extra=extra)
+            hits = res["hits"]["hits"]
+            for hit in hits:
+                if request.get("_source") is False:
+                    hit.pop("_source")
+                if "highlight" not in request:
+                    hit.pop("highlight")
+            return 200, {"took": 0, "timed_out": False, **res}
+
+        match = DOC_PATH.match(path)
+        if match and self.command == "DELETE":
+            with store.lock:
+                found = store.documents.pop(match["doc_id"], None) is not None
+            result = "deleted" if found else "not_found"
+            return (200 if found else 404), {"_id": match["doc_id"], "result": result}
+
+        match = UPDATE_PATH.match(path)
+        if match and self.command == "POST":
+            doc_id = match["doc_id"]
+            if doc_id not in store.documents:
+                return 404, {"error": "document_missing_exception", "status": 404}
+            store.update_document(index=match["index"], doc_id=doc_id, doc=json.loads(body)["doc"])
+            return 200, {"_id": doc_id, "result": "updated"}
+
+        return 404, {"error": "no handler for {} {}".format(self.command, path), "status": 404}
+
+
+class FsCrawlerHandler(FakeHandler):
+    def route(self, path: str, query: dict, body: bytes) -> tuple[int, dict]:
+        if path == "/" and self.command == "GET":
+            return 200, {"ok": True, "version": "2.10-fake", "elasticsearch": "8.0.0-fake"}
+
+        if path == "/_document" and self.command in ("POST", "PUT"):
+            parts = self.multipart(body)
+            filename, data = parts["file"]
+            tags = json.loads(parts["tags"][1]) if "tags" in parts else {}
+            content = data.decode("utf-8", errors="ignore")
+            if query.get("simulate", ["false"])[0] == "true":
+                return 200, {"ok": True, "filename": filename, "doc": {"content": content}}
+            doc_id = self.server.store.index_document(
+                content=content,
+                tags=tags,
+                extension=filename.rpartition(".")[2] if "." in filename else ""
+            )
+            url = "{}/{}/_doc/{}".format(self.server.elastic_url, self.server.index, doc_id)
+            return 200, {"ok": True, "filename": filename, "url": url}
+
+        return 404, {"ok": False, "message": "no handler for {} {}".format(self.command, path)}
+
+    def multipart(self, body: bytes) -> dict[str, tuple[str, bytes]]:
+        """
+        Partes del cuerpo multipart/form-data: nombre -> (archivo, datos).
+        """
+        header = "Content-Type: {}\r\n\r\n".format(self.headers["Content-Type"])
+        message = BytesParser(policy=HTTP).parsebytes(header.encode("latin-1") + body)
+        parts = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            parts[name] = (part.get_filename() or "", part.get_payload(decode=True) or b"")
+        return parts
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], handler, *, store: FakeElasticSearchService,
+                 faults: Faults, verbose: bool = False, index: str = "idx",
+                 elastic_url: str = ""):
+        super().__init__(address, handler)
+        self.store = store
+        self.faults = faults
+        self.verbose = verbose
+        # Solo FsCrawler: indice y Elasticsearch de los documentos subidos
+        self.index = index
+        self.elastic_url = elastic_url
+
+
+class FakeBackends:
+    """
+    Elasticsearch y FsCrawler falsos compartiendo los documentos: lo que
+    se sube a FsCrawler se encuentra luego en Elasticsearch. Con el puerto
+    0 se elige uno libre (ver elastic_port y fscrawler_port).
+    """
+
+    def __init__(self, *, host: str = "127.0.0.1", elastic_port: int = 0,
+                 fscrawler_port: int = 0, index: str = "idx",
+                 faults: Faults | None = None, verbose: bool = False):
+        self.store = FakeElasticSearchService()
+        faults = faults or Faults()
+        self.elastic = FakeServer((host, elastic_port), ElasticHandler,
+                                  store=self.store, faults=faults, verbose=verbose)
+        self.fscrawler = FakeServer((host, fscrawler_port), FsCrawlerHandler,
+                                    store=self.store, faults=faults, verbose=verbose,
+                                    index=index,
+                                    elastic_url="http://{}:{}".format(host, self.elastic_port))
+
+    @property
+    def elastic_port(self) -> int:
+        return self.elastic.server_address[1]
+
+    @property
+    def fscrawler_port(self) -> int:
+        return self.fscrawler.server_address[1]
+
+    def start(self):
+        for server in (self.elastic, self.fscrawler):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in (self.elastic, self.fscrawler):
+            server.shutdown()
+            server.server_close()
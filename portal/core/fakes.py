@@ -0,0 +1,120 @@
+"""
+Servicios en memoria que reemplazan a Elasticsearch y FsCrawler en
+desarrollo y pruebas (USE_FAKE_SERVICES, o registry.override).
+No hacen OCR: el contenido de los archivos se toma como texto y la
+busqueda es por palabras, sin analizadores.
+"""
+import os
+import threading
+from typing import Dict
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files import File
+from django.utils.html import escape
+
+from .service import registry
+
+
+class FakeElasticSearchService:
+    degraded = False
+
+    def __init__(self):
+        self.documents: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def test_service(self) -> Dict:
+        return {"tagline": "You Know, for Search", "fake": True}
+
+    def index_document(self, *, content: str, tags: dict | None = None,
+                       extension: str = "", doc_id: str = "") -> str:
+        doc_id = doc_id or uuid4().hex
+        with self.lock:
+            self.documents[doc_id] = {
+                "content": content.casefold(),
+                "extension": extension.lstrip(".").lower(),
+                "external": dict((tags or {}).get("external", {})),
+            }
+        return doc_id
+
+    def matches(self, doc: dict, words: list[str], extra: dict) -> bool:
+        if not all(word in doc["content"] for word in words):
+            return False
+        extension = extra.get("extension")
+        if extension and doc["extension"] != extension:
+            return False
+        paths = doc["external"].get("section_path", [])
+        if isinstance(paths, str):
+            paths = [paths]
+        section_path = extra.get("section_path")
+        if section_path and not any(p.startswith(section_path) for p in paths):
+            return False
+        section_ids = extra.get("section_ids")
+        # Como section_path, una lista para los documentos compartidos
+        doc_section_ids = doc["external"].get("section_id", [])
+        if not isinstance(doc_section_ids, list):
+            doc_section_ids = [doc_section_ids]
+        if section_ids and not set(doc_section_ids) & set(section_ids):
+            return False
+        acl = extra.get("acl")
+        if acl is not None:
+            external = doc["external"]
+            return any(p.startswith(prefix) for p in paths for prefix in acl["section_paths"]) \
+                or acl["user_id"] in external.get("user_id", []) \
+                or bool(set(acl["group_ids"]) & set(external.get("group_id", [])))
+        return True
+
+    def highlight(self, content: str, words: list[str]) -> str:
+        start = max(0, min(content.find(word) for word in words))
+        fragment = escape(content[start:start + settings.SEARCH_HIGHLIGHT_SIZE])
+        for word in words:
+            fragment = fragment.replace(word, "<mark>{}</mark>".format(word))
+        return fragment
+
+    def search_by_content(self, *, index: str, content: str, extra: dict):
+        words = content.casefold().split()
+        with self.lock:
+            hits = [
+                {
+                    "_id": doc_id,
+                    "_index": index,
+                    "_score": 1.0,
+                    "_source": {"external": doc["external"]},
+                    "highlight": {"content": [self.highlight(doc["content"], words)]}
+                }
+                for doc_id, doc in self.documents.items()
+                if self.matches({"id": doc_id, **doc}, words, extra)
+            ]
+        total = len(hits)
+        start = extra.get("from", 0)
+        hits = hits[start:start + extra.get("size", 10)]
+        return {"hits": {"total": {"value": total}, "hits": hits}}
+
+    async def asearch_by_content(self, *, index: str, content: str, extra: dict):
+        return self.search_by_content(index=index, content=content, extra=extra)
+
+    def delete_document(self, *, index: str, doc_id: str):
+        with self.lock:
+            self.documents.pop(doc_id, None)
+
+    def update_document(self, *, index: str, doc_id: str, doc: dict):
+        with self.lock:
+            if doc_id in self.documents:
+                self.documents[doc_id]["external"].update(doc.get("external", {}))
+
+
+class FakeFsCrawlerService:
+    degraded = False
+
+    def test_service(self) -> Dict:
+        return {"ok": True, "fake": True}
+
+    def upload_file(self, *, file: File, tags: dict | None = None) -> str:
+        assert file
+        file.seek(0)
+        content = b"".join(file.chunks()).decode("utf-8", errors="ignore")
+        return registry.get("elasticsearch").index_document(
+            content=content,
+            tags=tags,
+            extension=os.path.splitext(str(file.name))[1]
+        )
@@ -51,6 +51,10 @@ class SearchForm(forms.Form):
         required=True
     )
     by_content = forms.BooleanField(required=False)
+    # Filtros de la busqueda por contenido, ver ElasticSearchService.search_body
+    extension = forms.CharField(widget=forms.HiddenInput, max_length=16, required=False)
+    modified_after = forms.DateField(widget=forms.HiddenInput, required=False)
+    modified_before = forms.DateField(widget=forms.HiddenInput, required=False)
 
 @final
 class MarkdownForm(forms.Form):
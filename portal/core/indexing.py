@@ -0,0 +1,177 @@
+"""
+Indexado asincronico de archivos.
+
+Las vistas guardan el archivo con estado PENDING y encolan un IndexingJob.
+El comando run_indexing_worker toma lotes de trabajos de la base de datos
+y los envia a FsCrawler desde un pool de hilos, reintentando con espera
+exponencial (con jitter) hasta INDEXING_MAX_ATTEMPTS.
+
+Los archivos con el mismo contenido comparten un blob (core/blobs.py) y un
+solo documento: el primero se envia a FsCrawler y el resto solo agrega su
+seccion a los tags del documento.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import blobs
+from .models import Archive, Blob, IndexingJob, IndexStatus, Section
+from .service import elastic_service, fscrawler_service
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(archive: Archive) -> IndexingJob:
+    job, _ = IndexingJob.objects.update_or_create(
+        archive=archive,
+        defaults={"attempts": 0, "run_after": timezone.now(), "locked_until": None}
+    )
+    return job
+
+
+def retry_delay(attempts: int) -> float:
+    base = settings.INDEXING_RETRY_BASE_SECONDS
+    delay = base * (2 ** (attempts - 1))
+    return delay + random.uniform(0, delay)
+
+
+def claim_jobs(limit: int) -> list[IndexingJob]:
+    """
+    Reserva hasta 'limit' trabajos vencidos por INDEXING_LEASE_SECONDS.
+    Si el worker muere, la reserva expira y otro worker los vuelve a tomar.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            IndexingJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(run_after__lte=now)
+                .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+                .select_related("archive__section", "archive__blob")
+                .order_by("run_after")[:limit]
+        )
+        lease = now + timedelta(seconds=settings.INDEXING_LEASE_SECONDS)
+        IndexingJob.objects \
+            .filter(id__in=[job.id for job in jobs]) \
+            .update(locked_until=lease)
+    return jobs
+
+
+def index_archive(archive: Archive) -> str:
+    """
+    Envia el archivo guardado a FsCrawler y devuelve el id del documento.
+    """
+    with archive.file.open("rb") as file:
+        return fscrawler_service.upload_file(
+            file=file,
+            tags=archive.index_tags()
+        )
+
+
+def index_blob(blob: Blob) -> str:
+    """
+    Devuelve el documento del blob, enviandolo a FsCrawler solo si todavia
+    no fue indexado. Si ya lo estaba, actualiza sus secciones.
+    """
+    doc_id = Blob.objects.filter(pk=blob.pk).values_list("uuid", flat=True).first()
+    if doc_id:
+        blobs.sync_document_tags(Blob(pk=blob.pk, uuid=doc_id))
+        return doc_id
+
+    with blob.file.open("rb") as file:
+        doc_id = fscrawler_service.upload_file(file=file, tags=blobs.index_tags(blob))
+    if not doc_id:
+        return ""
+    claimed = Blob.objects.filter(pk=blob.pk, uuid="").update(uuid=doc_id)
+    if claimed:
+        return doc_id
+    # Otro worker indexo el mismo contenido o el blob ya fue liberado
+    elastic_service.delete_document(index="idx", doc_id=doc_id)
+    doc_id = Blob.objects.filter(pk=blob.pk).values_list("uuid", flat=True).first()
+    if doc_id:
+        blobs.sync_document_tags(Blob(pk=blob.pk, uuid=doc_id))
+    return doc_id or ""
+
+
+def process_job(job: IndexingJob) -> bool:
+    try:
+        archive = job.archive
+        try:
+            if archive.blob_id:
+                doc_id = index_blob(archive.blob)
+            else:
+                doc_id = index_archive(archive)
+            if not doc_id:
+                raise RuntimeError("FsCrawler did not index the document")
+        except Exception as exc:
+            fail_job(job, exc)
+            return False
+
+        updated = Archive.objects \
+            .filter(pk=archive.pk) \
+            .update(uuid=doc_id, index_status=IndexStatus.INDEXED)
+        # El documento de un blob lo borra la ultima referencia (blobs.release_blob)
+        if not updated and not archive.blob_id:
+            # El archivo se borro mientras se indexaba
+            elastic_service.delete_document(index="idx", doc_id=doc_id)
+        if updated:
+            # update() no dispara post_save: sin esto las paginas de
+            # resultados en cache (core/search.py) no incluyen al archivo
+            # recien indexado, y el arbol de secciones en cache sigue
+            # mostrandolo pendiente (ver section_item.html)
+            Section.bump_subtrees(archive.section.path)
+        IndexingJob.objects.filter(pk=job.pk).delete()
+        return True
+    finally:
+        # Cada hilo del pool usa su propia conexion
+        close_old_connections()
+
+
+def fail_job(job: IndexingJob, exc: Exception):
+    attempts = job.attempts + 1
+    err = "Indexing archive {id} failed (attempt {attempts}): {exc}"
+    logger.warning(err.format(id=job.archive_id, attempts=attempts, exc=exc))
+    run_after = None
+    if attempts < settings.INDEXING_MAX_ATTEMPTS:
+        run_after = timezone.now() + timedelta(seconds=retry_delay(attempts))
+    else:
+        Archive.objects \
+            .filter(pk=job.archive_id) \
+            .update(index_status=IndexStatus.FAILED)
+        Section.bump_subtrees(job.archive.section.path)
+    IndexingJob.objects.filter(pk=job.pk).update(
+        attempts=attempts,
+        run_after=run_after,
+        locked_until=None,
+        last_error=str(exc)
+    )
+
+
+def run_worker(*, workers: int, batch_size: int, poll_interval: float,
+               once: bool = False, drain: bool = False) -> int:
+    """
+    Procesa lotes de trabajos hasta que se interrumpa. Con once procesa un
+    solo lote y con drain termina cuando no quedan trabajos vencidos.
+    Devuelve la cantidad de archivos indexados.
+    """
+    indexed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            jobs = claim_jobs(batch_size)
+            if jobs:
+                results = list(pool.map(process_job, jobs))
+                indexed += sum(results)
+                msg = "Indexed {ok} of {total} archives"
+                logger.info(msg.format(ok=sum(results), total=len(jobs)))
+            if once or (drain and not jobs):
+                return indexed
+            if not jobs:
+                close_old_connections()
+                time.sleep(poll_interval)
@@ -0,0 +1,249 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Archive, User
+
+PROJECT_DIR = Path(__file__).resolve().parents[3]
+
+# Resultados que devuelve el Elasticsearch falso, una pagina de la busqueda
+STUB_HITS = 10
+
+# Comun a ambos procesos hijos: argumentos y resumen de los tiempos
+COMMON = """
+import json, os, sys, time
+path, cookie, total, concurrency = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+
+def summary(latencies, statuses, elapsed):
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(json.dumps({
+        "requests": total,
+        "rps": total / elapsed,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "errors": sum(1 for s in statuses if not s.startswith("200")),
+    }))
+"""
+
+# Un worker WSGI con 'concurrency' hilos, como gunicorn --threads
+WSGI_CHILD = COMMON + """
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+from wiki.wsgi import application
+
+url = urlsplit(path)
+
+def call(_):
+    environ = {
+        "PATH_INFO": url.path,
+        "QUERY_STRING": url.query,
+        "HTTP_COOKIE": cookie,
+        "wsgi.input": BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    status = []
+    start = time.perf_counter()
+    b"".join(application(environ, lambda s, h, *a: status.append(s)))
+    return time.perf_counter() - start, status[0]
+
+call(0)
+start = time.perf_counter()
+with ThreadPoolExecutor(concurrency) as pool:
+    results = list(pool.map(call, range(total)))
+elapsed = time.perf_counter() - start
+summary([r[0] for r in results], [r[1] for r in results], elapsed)
+"""
+
+# Un worker ASGI: 'concurrency' pedidos a la vez en un solo event loop
+ASGI_CHILD = COMMON + """
+import asyncio
+from urllib.parse import urlsplit
+from wiki.asgi import application
+
+url = urlsplit(path)
+
+async def call():
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    done = asyncio.Event()
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # El cliente sigue conectado hasta recibir la respuesta completa
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(str(message["status"]))
+        elif not message.get("more_body"):
+            done.set()
+
+    start = time.perf_counter()
+    await application(scope, receive, send)
+    return time.perf_counter() - start, status[0]
+
+async def main():
+    await call()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await call()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    summary([r[0] for r in results], [r[1] for r in results], elapsed)
+
+asyncio.run(main())
+"""
+
+
+def stub_handler(hits: list[dict], latency: float):
+    body = json.dumps({
+        "hits": {"total": {"value": len(hits)}, "hits": hits}
+    }).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers y cuerpo se escriben por separado: sin esto la conexion
+        # persistente suma la espera de Nagle a cada respuesta
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares WSGI and ASGI throughput of the search views against a stub "
+        "Elasticsearch that answers after a fixed latency. Each server runs in "
+        "a fresh process: WSGI with a thread pool, ASGI with one event loop. "
+        "Both use the configured ELASTIC_POOL_SIZE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", required=True, help="Username used for the requests")
+        parser.add_argument("--query", default="hello", help="Content search term")
+        parser.add_argument("--path", default="",
+                            help="Path to request instead of the content search")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=8,
+                            help="Threads of the WSGI worker")
+        parser.add_argument("--concurrency", type=int, default=100,
+                            help="In-flight requests in the ASGI worker")
+        parser.add_argument("--latency-ms", type=float, default=100,
+                            help="Response time of the stub Elasticsearch")
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["user"]).first()
+        if user is None:
+            raise CommandError("User {} does not exist".format(options["user"]))
+
+        path = options["path"] or "/wiki/search-list/?name={}&by_content=on".format(options["query"])
+        cookie = "{}={}".format(settings.SESSION_COOKIE_NAME, self.session_key(user))
+
+        # Los archivos indexados de la base, para que la vista encuentre resultados
+        archives = Archive.objects \
+            .exclude(uuid="") \
+            .values_list("uuid", "section__path")[:STUB_HITS]
+        hits = [
+            {"_id": uuid, "_score": 1.0, "_source": {"external": {"section_path": [section_path]}}}
+            for uuid, section_path in archives
+        ]
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            stub_handler(hits, options["latency_ms"] / 1000)
+        )
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            results = {
+                "wsgi": self.run_child(WSGI_CHILD, False, server.server_port, path, cookie,
+                                       options["requests"], options["threads"]),
+                "asgi": self.run_child(ASGI_CHILD, True, server.server_port, path, cookie,
+                                       options["requests"], options["concurrency"]),
+            }
+        finally:
+            server.shutdown()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        msg = "{name}: {rps:.1f} req/s, p50 {p50_ms:.0f} ms, p95 {p95_ms:.0f} ms, {errors} errors"
+        for name, result in results.items():
+            self.stdout.write(msg.format(name=name.upper(), **result))
+
+    def session_key(self, user: User) -> str:
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def run_child(self, code: str, use_async: bool, port: int, path: str,
+                  cookie: str, total: int, concurrency: int) -> dict:
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "wiki.settings")
+        env.update({
+            "ASYNC_VIEWS": "1" if use_async else "0",
+            "USE_FAKE_SERVICES": "0",
+            "ELASTIC_HOST": "127.0.0.1",
+            "ES_PORT": str(port),
+            # Sin la cache de paginas cada pedido espera a Elasticsearch
+            "SEARCH_CACHE_TIMEOUT": "0",
+        })
+        res = subprocess.run(
+            [sys.executable, "-c", code, path, cookie, str(total), str(concurrency)],
+            cwd=PROJECT_DIR,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+        if res.returncode != 0:
+            raise CommandError("Benchmark run failed:\n{}".format(res.stderr))
+        return json.loads(res.stdout.strip().splitlines()[-1])
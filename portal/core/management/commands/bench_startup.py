@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+PROJECT_DIR = Path(__file__).resolve().parents[3]
+
+# Se ejecuta en un proceso nuevo: mide lo mismo que paga cada worker de
+# gunicorn al arrancar, hasta servir su primer pedido.
+CHILD = """
+import json, os, sys, time
+start = time.perf_counter()
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+from wiki.wsgi import application
+booted = time.perf_counter()
+
+environ = {"PATH_INFO": sys.argv[1], "wsgi.input": BytesIO()}
+setup_testing_defaults(environ)
+status = []
+body = b"".join(application(environ, lambda s, h, *a: status.append(s)))
+served = time.perf_counter()
+
+from core.service import registry
+print(json.dumps({
+    "boot_ms": (booted - start) * 1000,
+    "first_request_ms": (served - booted) * 1000,
+    "total_ms": (served - start) * 1000,
+    "status": status[0],
+    "services": sorted(registry.instances),
+    "modules": len(sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures worker startup: time to import the WSGI application and "
+        "serve a first request, in fresh processes. Exits with an error if "
+        "the median exceeds --max-ms, so it can guard against regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--path", default="/login/",
+                            help="Path of the first request")
+        parser.add_argument("--max-ms", type=float, default=0,
+                            help="Fail if the median total time exceeds this value")
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+
+    def handle(self, *args, **options):
+        runs = [self.run_child(options["path"]) for _ in range(options["runs"])]
+        summary = {
+            key: statistics.median(run[key] for run in runs)
+            for key in ("boot_ms", "first_request_ms", "total_ms")
+        }
+        summary["status"] = runs[-1]["status"]
+        summary["services"] = runs[-1]["services"]
+        summary["modules"] = runs[-1]["modules"]
+
+        if options["json"]:
+            self.stdout.write(json.dumps({"runs": runs, "median": summary}, indent=2))
+        else:
+            msg = (
+                "Median of {runs} runs: boot {boot_ms:.0f} ms, first request "
+                "{first_request_ms:.0f} ms, total {total_ms:.0f} ms ({status}); "
+                "{modules} modules loaded, services created: {services}"
+            )
+            self.stdout.write(msg.format(
+                runs=len(runs),
+                **{**summary, "services": ", ".join(summary["services"]) or "none"}
+            ))
+
+        max_ms = options["max_ms"]
+        if max_ms and summary["total_ms"] > max_ms:
+            raise CommandError("Startup took {:.0f} ms, over the {:.0f} ms budget".format(
+                summary["total_ms"], max_ms
+            ))
+
+    def run_child(self, path: str) -> dict:
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "wiki.settings")
+        res = subprocess.run(
+            [sys.executable, "-c", CHILD, path],
+            cwd=PROJECT_DIR,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+        if res.returncode != 0:
+            raise CommandError("Startup run failed:\n{}".format(res.stderr))
+        return json.loads(res.stdout.strip().splitlines()[-1])
@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from core.benchmarks import (
+    SeedOptions,
+    build_scenarios,
+    index_corpus,
+    run_scenario,
+    seed,
+)
+from core.fake_server import FakeBackends, Faults
+from core.fakes import FakeElasticSearchService
+from core.service import ElasticSearchService, registry
+
+PROJECT_DIR = Path(__file__).resolve().parents[3]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds synthetic sections, archives and permissions in a test database and "
+        "measures the main views with the Django test client: p50/p95/p99 latency, "
+        "queries per request and peak memory. Results can be written to JSON and "
+        "compared with a previous run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--depth", type=int, default=4, help="Levels of sections")
+        parser.add_argument("--width", type=int, default=6, help="Children per section")
+        parser.add_argument("--archives", type=int, default=100_000)
+        parser.add_argument("--groups", type=int, default=8)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--corpus", type=int, default=10_000,
+                            help="Archives indexed in the fake Elasticsearch")
+        parser.add_argument("--requests", type=int, default=50, help="Measured requests per view")
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--memory-requests", type=int, default=3,
+                            help="Extra requests traced with tracemalloc")
+        parser.add_argument("--only", nargs="*", default=[], help="Run only these scenarios")
+        parser.add_argument("--cold-cache", action="store_true",
+                            help="Clear the caches before every measured request")
+        parser.add_argument("--http-backends", action="store_true",
+                            help="Search through HTTP against the fake Elasticsearch server")
+        parser.add_argument("--backend-latency-ms", type=float, default=0)
+        parser.add_argument("--keepdb", action="store_true",
+                            help="Keep the test database and its data for the next run")
+        parser.add_argument("--media-root", default=os.path.join(tempfile.gettempdir(), "wiki-bench-media"))
+        parser.add_argument("--seed", type=int, default=1, help="Random seed")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+        parser.add_argument("--max-regression", type=float, default=0,
+                            help="Fail if a p95 grows more than this percentage over --compare")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        verbosity = options["verbosity"]
+        old_config = setup_databases(verbosity, interactive=False, keepdb=options["keepdb"])
+        try:
+            with override_settings(MEDIA_ROOT=options["media_root"]):
+                results, meta = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity, keepdb=options["keepdb"])
+
+        report = {"meta": meta, "scenarios": results}
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write("Results written to {}".format(options["output"]))
+        if baseline is not None:
+            self.compare(baseline["scenarios"], results, options["max_regression"])
+
+    def run(self, options) -> tuple[dict, dict]:
+        opts = SeedOptions(
+            depth=options["depth"],
+            width=options["width"],
+            archives=options["archives"],
+            groups=options["groups"],
+            users=options["users"],
+        )
+        start = time.perf_counter()
+        reader, created = seed(opts, seed=options["seed"])
+        if created:
+            self.stdout.write("Seeded data in {:.1f} s".format(time.perf_counter() - start))
+
+        backends = None
+        if options["http_backends"]:
+            backends = FakeBackends(faults=Faults(latency=options["backend_latency_ms"] / 1000))
+            backends.start()
+            url = "http://127.0.0.1:{}".format(backends.elastic_port)
+            with override_settings(ELASTIC_URL=url, ELASTIC_KEY=""):
+                service = ElasticSearchService()
+            store = backends.store
+        else:
+            service = store = FakeElasticSearchService()
+        index_corpus(store, reader, options["corpus"])
+
+        def clear_caches():
+            if options["cold_cache"]:
+                caches["default"].clear()
+                caches["local"].clear()
+
+        rng = random.Random(options["seed"])
+        client = Client()
+        client.force_login(reader)
+        results = {}
+        try:
+            with registry.override("elasticsearch", service):
+                for scenario in build_scenarios(reader, rng):
+                    if options["only"] and scenario.name not in options["only"]:
+                        continue
+                    result = run_scenario(
+                        client,
+                        scenario,
+                        requests=options["requests"],
+                        warmup=options["warmup"],
+                        memory_requests=options["memory_requests"],
+                        before_request=clear_caches
+                    )
+                    results[scenario.name] = result.summary()
+                    self.stdout.write("  {} done".format(scenario.name))
+        finally:
+            if backends is not None:
+                backends.stop()
+
+        meta = {
+            "commit": self.git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "options": {
+                key: options[key]
+                for key in ("depth", "width", "archives", "groups", "users", "corpus",
+                            "requests", "warmup", "cold_cache", "http_backends",
+                            "backend_latency_ms", "seed")
+            },
+        }
+        return results, meta
+
+    def git_commit(self) -> str:
+        try:
+            res = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=PROJECT_DIR,
+                capture_output=True,
+                text=True
+            )
+        except OSError:
+            return ""
+        return res.stdout.strip()
+
+    def print_results(self, results: dict):
+        row = "{:<18} {:>9} {:>9} {:>9} {:>9} {:>11} {:>7}"
+        self.stdout.write(row.format("view", "p50 ms", "p95 ms", "p99 ms", "queries", "peak KB", "errors"))
+        for name, r in results.items():
+            self.stdout.write(row.format(
+                name,
+                "{:.1f}".format(r["p50_ms"]),
+                "{:.1f}".format(r["p95_ms"]),
+                "{:.1f}".format(r["p99_ms"]),
+                "{:.1f}".format(r["queries"]),
+                "{:.0f}".format(r["peak_memory_kb"]),
+                r["errors"]
+            ))
+
+    def compare(self, baseline: dict, results: dict, max_regression: float):
+        row = "{:<18} {:>16} {:>16} {:>14}"
+        self.stdout.write("")
+        self.stdout.write(row.format("view", "p50 ms", "p95 ms", "queries"))
+        regressions = []
+        for name, r in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0
+            self.stdout.write(row.format(
+                name,
+                "{:.1f} -> {:.1f}".format(base["p50_ms"], r["p50_ms"]),
+                "{:.1f} -> {:.1f}".format(base["p95_ms"], r["p95_ms"]),
+                "{:.1f} -> {:.1f}".format(base["queries"], r["queries"])
+            ))
+            if max_regression and change > max_regression:
+                regressions.append("{} p95 {:+.0f}%".format(name, change))
+        if regressions:
+            raise CommandError("Regressions over {:.0f}%: {}".format(
+                max_regression, ", ".join(regressions)
+            ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Section
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the materialized path of every section matches its "
+        "parent chain. Fails if any section is inconsistent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--show", type=int, default=20,
+                            help="Maximum number of inconsistencies listed")
+
+    def handle(self, *args, **options):
+        expected = Section.expected_paths()
+        errors = []
+        for sec in Section.objects.only("id", "path", "depth").iterator():
+            if sec.id not in expected:
+                errors.append("Section {}: unreachable from a root".format(sec.id))
+                continue
+            path, depth = expected[sec.id]
+            if sec.path != path or sec.depth != depth:
+                err = "Section {id}: path={path!r} depth={depth}, expected {epath!r} {edepth}"
+                errors.append(err.format(
+                    id=sec.id,
+                    path=sec.path,
+                    depth=sec.depth,
+                    epath=path,
+                    edepth=depth
+                ))
+
+        for err in errors[:options["show"]]:
+            self.stderr.write(err)
+        if errors:
+            raise CommandError(
+                "{} inconsistent sections, run rebuild_section_paths".format(len(errors))
+            )
+        self.stdout.write("{} sections checked, index is consistent".format(len(expected)))
@@ -0,0 +1,269 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import Permission
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import indexing
+from core.blobs import add_references, store_blob
+from core.models import (
+    Archive,
+    ArchiveNameTrigram,
+    Blob,
+    IndexingJob,
+    IndexStatus,
+    Section,
+    User,
+    UserArchivePermission,
+    UserSectionPermission,
+)
+from core.utils import normalize_name
+
+SECTION_PERMS = ["delete_section", "view_section", "add_archive"]
+ARCHIVE_PERMS = ["delete_archive", "view_archive"]
+NAME_LENGTH = 256
+
+
+class Command(BaseCommand):
+    help = (
+        "Mirrors a directory tree into sections and archives under an "
+        "existing section. Sections and archives that already exist (same "
+        "name in the same section) are skipped, so an interrupted import can "
+        "be run again. Files whose content is already stored are not copied "
+        "again, they share the existing blob."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory to import")
+        parser.add_argument("--section", type=int, required=True,
+                            help="Id of the section that receives the tree")
+        parser.add_argument("--user", required=True,
+                            help="Username that gets the permissions over the new entities")
+        parser.add_argument("--workers", type=int, default=8,
+                            help="Threads used to hash and copy files into the storage")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--index", action="store_true",
+                            help="Index the imported archives before exiting "
+                                 "instead of leaving them to run_indexing_worker")
+        parser.add_argument("--index-workers", type=int, default=4)
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options["source"])
+        if not os.path.isdir(source):
+            raise CommandError("{} is not a directory".format(source))
+        root = Section.objects.filter(pk=options["section"]).first()
+        if not root:
+            raise CommandError("Section {} does not exist".format(options["section"]))
+        user = User.objects.filter(username=options["user"]).first()
+        if not user:
+            raise CommandError("User {} does not exist".format(options["user"]))
+
+        self.user = user
+        self.batch_size = options["batch_size"]
+        self.workers = options["workers"]
+        self.section_perms = list(Permission.objects.filter(codename__in=SECTION_PERMS))
+        self.archive_perms = list(Permission.objects.filter(codename__in=ARCHIVE_PERMS))
+        self.stats = {"sections": 0, "archives": 0, "skipped": 0, "deduplicated": 0, "bytes": 0}
+        start = time.monotonic()
+
+        sections = self.import_sections(source, root)
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for directory, section in sections.items():
+                self.import_archives(pool, directory, section)
+        for section in sections.values():
+            Section.bump_subtrees(section.path)
+
+        elapsed = time.monotonic() - start
+        self.report(elapsed)
+
+        if options["index"]:
+            start = time.monotonic()
+            indexed = indexing.run_worker(
+                workers=options["index_workers"],
+                batch_size=self.batch_size,
+                poll_interval=0,
+                drain=True
+            )
+            elapsed = time.monotonic() - start
+            msg = "Indexed {n} archives in {t:.1f}s ({rate:.1f} files/s)"
+            self.stdout.write(msg.format(
+                n=indexed,
+                t=elapsed,
+                rate=indexed / elapsed if elapsed else 0
+            ))
+
+    def import_sections(self, source: str, root: Section) -> dict[str, Section]:
+        """
+        Crea las secciones nivel por nivel (un bulk_create por nivel) y
+        devuelve el mapa directorio -> seccion.
+        """
+        sections = {source: root}
+        level = [source]
+        while level:
+            wanted = []
+            for directory in level:
+                for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        wanted.append((directory, entry.path, entry.name[:NAME_LENGTH]))
+
+            parent_ids = {sections[d].id for d, _, _ in wanted}
+            existing = {
+                (sec.parent_id, sec.name): sec
+                for sec in Section.objects.filter(parent_id__in=parent_ids)
+            }
+            missing = [
+                Section(name=name, parent=sections[parent])
+                for parent, _, name in wanted
+                if (sections[parent].id, name) not in existing
+            ]
+            with transaction.atomic():
+                self.create_sections(missing)
+            existing.update({(sec.parent_id, sec.name): sec for sec in missing})
+
+            for parent, path, name in wanted:
+                sections[path] = existing[(sections[parent].id, name)]
+            level = [path for _, path, _ in wanted]
+        return sections
+
+    def create_sections(self, new_sections: list[Section]):
+        if not new_sections:
+            return
+        Section.objects.bulk_create(new_sections, batch_size=self.batch_size)
+        # No todas las bases devuelven los ids de un bulk_create,
+        # las secciones nuevas son las que todavia no tienen camino.
+        created = {
+            (sec.parent_id, sec.name): sec
+            for sec in Section.objects.filter(
+                parent_id__in={sec.parent_id for sec in new_sections},
+                path=""
+            )
+        }
+        for sec in new_sections:
+            sec.pk = created[(sec.parent_id, sec.name)].pk
+            sec.path, sec.depth = Section.build_path(sec.parent, sec.pk)
+        Section.objects.bulk_update(new_sections, ["path", "depth"], batch_size=self.batch_size)
+
+        UserSectionPermission.objects.bulk_create([
+            UserSectionPermission(section=sec, user=self.user) for sec in new_sections
+        ], batch_size=self.batch_size)
+        perms = UserSectionPermission.objects.filter(
+            section__in=new_sections,
+            user=self.user
+        )
+        Through = UserSectionPermission.permissions.through
+        Through.objects.bulk_create([
+            Through(usersectionpermission_id=p.id, permission_id=perm.id)
+            for p in perms
+            for perm in self.section_perms
+        ], batch_size=self.batch_size)
+        self.stats["sections"] += len(new_sections)
+
+    def import_archives(self, pool: ThreadPoolExecutor, directory: str, section: Section):
+        files = sorted(
+            (entry.name, entry.path)
+            for entry in os.scandir(directory)
+            if entry.is_file(follow_symlinks=False)
+        )
+        existing = set(section.archives.values_list("fullname", flat=True))
+        pending = []
+        for name, path in files:
+            if name in existing or len(name) > NAME_LENGTH:
+                self.stats["skipped"] += 1
+                continue
+            pending.append((name, path))
+
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            # Varios archivos por tarea, cada tarea cierra su conexion
+            chunk_size = max(1, len(batch) // (self.workers * 4))
+            chunks = [batch[j:j + chunk_size] for j in range(0, len(batch), chunk_size)]
+            stored = [blob for chunk in pool.map(store_files, chunks) for blob in chunk]
+            with transaction.atomic():
+                self.create_archives(section, batch, stored)
+
+    def create_archives(self, section: Section, batch, stored):
+        archives = []
+        for (fullname, _), (blob, created) in zip(batch, stored):
+            name, extension = os.path.splitext(fullname)
+            archives.append(Archive(
+                section=section,
+                fullname=fullname,
+                name=name,
+                extension=extension,
+                file=blob.file.name,
+                blob=blob,
+                uuid=blob.uuid,
+                search_name=normalize_name(fullname),
+                index_status=IndexStatus.PENDING
+            ))
+            self.stats["bytes"] += blob.size
+            self.stats["deduplicated"] += not created
+        # Las referencias se suman junto con los Archive: si el comando se
+        # interrumpe no quedan blobs con referencias de mas
+        counts: dict[int, int] = {}
+        for arch in archives:
+            counts[arch.blob_id] = counts.get(arch.blob_id, 0) + 1
+        add_references(counts)
+        Archive.objects.bulk_create(archives, batch_size=self.batch_size)
+        # Los nombres de un directorio son unicos, sirven para obtener los ids
+        ids = dict(
+            section.archives
+                .filter(fullname__in=[arch.fullname for arch in archives])
+                .values_list("fullname", "id")
+        )
+        for arch in archives:
+            arch.pk = ids[arch.fullname]
+
+        ArchiveNameTrigram.objects.bulk_create(
+            ArchiveNameTrigram.build(archives),
+            batch_size=self.batch_size
+        )
+        UserArchivePermission.objects.bulk_create([
+            UserArchivePermission(archive=arch, user=self.user) for arch in archives
+        ], batch_size=self.batch_size)
+        perms = UserArchivePermission.objects.filter(archive__in=archives, user=self.user)
+        Through = UserArchivePermission.permissions.through
+        Through.objects.bulk_create([
+            Through(userarchivepermission_id=p.id, permission_id=perm.id)
+            for p in perms
+            for perm in self.archive_perms
+        ], batch_size=self.batch_size)
+        IndexingJob.objects.bulk_create(
+            [IndexingJob(archive=arch) for arch in archives],
+            batch_size=self.batch_size
+        )
+        self.stats["archives"] += len(archives)
+
+    def report(self, elapsed: float):
+        stats = self.stats
+        msg = (
+            "Imported {sections} sections and {archives} archives "
+            "({skipped} skipped, {deduplicated} deduplicated) in {elapsed:.1f}s: "
+            "{files_rate:.1f} files/s, {mb_rate:.1f} MB/s"
+        )
+        self.stdout.write(msg.format(
+            elapsed=elapsed,
+            files_rate=stats["archives"] / elapsed if elapsed else 0,
+            mb_rate=stats["bytes"] / (1024 * 1024) / elapsed if elapsed else 0,
+            **stats
+        ))
+
+
+def store_files(items: list[tuple[str, str]]) -> list[tuple[Blob, bool]]:
+    """
+    Guarda el contenido de los archivos como blobs, o encuentra los
+    existentes, sin sumar referencias (ver create_archives). Se ejecuta
+    en el pool de hilos.
+    """
+    try:
+        stored = []
+        for fullname, path in items:
+            with open(path, "rb") as src:
+                stored.append(store_blob(File(src, name=fullname)))
+        return stored
+    finally:
+        # Cada hilo abre su propia conexion
+        connection.close()
@@ -0,0 +1,67 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import indexing
+from core.blobs import acquire_blob
+from core.models import Archive, Blob
+from core.service import elastic_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves archives stored before content deduplication into shared "
+        "blobs. Duplicated files and Elasticsearch documents are removed "
+        "and the archives are queued so the remaining document lists all "
+        "their sections."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        stats = {"migrated": 0, "deduplicated": 0, "missing": 0}
+        last_id = 0
+        while True:
+            batch = list(
+                Archive.objects
+                    .filter(id__gt=last_id, blob__isnull=True)
+                    .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            for arch in batch:
+                if not default_storage.exists(arch.file.name):
+                    self.stderr.write("Archive {} has no file {}".format(arch.id, arch.file.name))
+                    stats["missing"] += 1
+                    continue
+                created = self.migrate(arch)
+                stats["migrated"] += 1
+                stats["deduplicated"] += not created
+            last_id = batch[-1].id
+
+        msg = "Migrated {migrated} archives ({deduplicated} deduplicated, {missing} missing files)"
+        self.stdout.write(msg.format(**stats))
+
+    def migrate(self, arch: Archive) -> bool:
+        old_name, old_uuid = arch.file.name, arch.uuid
+        with transaction.atomic():
+            with default_storage.open(old_name, "rb") as src:
+                blob, created = acquire_blob(File(src, name=arch.fullname))
+            if old_uuid and not blob.uuid:
+                # El documento ya indexado pasa a ser el del blob
+                Blob.objects.filter(pk=blob.pk, uuid="").update(uuid=old_uuid)
+                blob.refresh_from_db(fields=["uuid"])
+            arch.blob = blob
+            arch.file = blob.file.name
+            arch.uuid = blob.uuid
+            arch.save(update_fields=["blob", "file", "uuid"])
+            indexing.enqueue(arch)
+
+        if old_uuid and old_uuid != blob.uuid:
+            elastic_service.delete_document(index="idx", doc_id=old_uuid)
+        if old_name != blob.file.name:
+            default_storage.delete(old_name)
+        return created
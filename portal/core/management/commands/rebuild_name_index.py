@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Archive, ArchiveNameTrigram
+from core.utils import normalize_name
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the normalized names and the trigram index used by the name search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Archive.objects
+                    .filter(id__gt=last_id)
+                    .only("id", "fullname", "search_name")
+                    .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            for arch in batch:
+                arch.search_name = normalize_name(arch.fullname)
+            with transaction.atomic():
+                Archive.objects.bulk_update(batch, ["search_name"])
+                ArchiveNameTrigram.objects.filter(archive__in=batch).delete()
+                ArchiveNameTrigram.objects.bulk_create(
+                    ArchiveNameTrigram.build(batch),
+                    batch_size=batch_size
+                )
+            total += len(batch)
+            last_id = batch[-1].id
+        self.stdout.write("Indexed {} archives".format(total))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Section
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialized path (path/depth) of every section."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        updated, total = Section.rebuild_paths(batch_size=options["batch_size"])
+        self.stdout.write("Updated {} of {} sections".format(updated, total))
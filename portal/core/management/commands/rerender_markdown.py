@@ -0,0 +1,68 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.models import Archive
+from core.rendering import RENDERED_DIR, rendered_html, rendered_name, renderer_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders every markdown archive with the current MARKDOWN_EXTENSIONS "
+        "so no page is rendered on its first view. Archives sharing the same "
+        "content are rendered once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--purge", action="store_true",
+                            help="Delete HTML rendered by previous renderer versions")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        seen = set()
+        rendered = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Archive.objects
+                    .filter(id__gt=last_id, extension=".md")
+                    .select_related("blob")
+                    .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            for arch in batch:
+                name = rendered_name(arch)
+                if name in seen:
+                    continue
+                seen.add(name)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                try:
+                    rendered_html(arch)
+                except (OSError, UnicodeDecodeError) as exc:
+                    self.stderr.write("Archive {} could not be rendered: {}".format(arch.id, exc))
+                    continue
+                rendered += 1
+            last_id = batch[-1].id
+
+        msg = "Rendered {} markdown documents (renderer {})"
+        self.stdout.write(msg.format(rendered, renderer_version()))
+        if options["purge"]:
+            self.purge()
+
+    def purge(self):
+        if not default_storage.exists(RENDERED_DIR):
+            return
+        versions, _ = default_storage.listdir(RENDERED_DIR)
+        for version in versions:
+            if version != renderer_version():
+                self.delete_tree("{}/{}".format(RENDERED_DIR, version))
+                self.stdout.write("Deleted renderer {}".format(version))
+
+    def delete_tree(self, path: str):
+        dirs, files = default_storage.listdir(path)
+        for name in files:
+            default_storage.delete("{}/{}".format(path, name))
+        for name in dirs:
+            self.delete_tree("{}/{}".format(path, name))
@@ -0,0 +1,98 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.fake_server import FakeBackends, Faults, synthetic_text
+from core.models import Archive, Section
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs in-memory stand-ins for the Elasticsearch and FsCrawler APIs used by "
+        "core/service.py, with configurable latency, error rate and corpus size. "
+        "Point ELASTIC_HOST/ES_PORT and FSCRAWLER_HOST/FSCRAWLER_PORT at them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--es-port", type=int, default=9200)
+        parser.add_argument("--fscrawler-port", type=int, default=8080)
+        parser.add_argument("--index", default="idx", help="Index named in FsCrawler responses")
+        parser.add_argument("--latency-ms", type=float, default=0,
+                            help="Minimum response time")
+        parser.add_argument("--jitter-ms", type=float, default=0,
+                            help="Random extra response time, up to this value")
+        parser.add_argument("--error-rate", type=float, default=0,
+                            help="Fraction of requests answered with a 503")
+        parser.add_argument("--corpus", type=int, default=0,
+                            help="Synthetic documents spread over the existing sections")
+        parser.add_argument("--words", type=int, default=200,
+                            help="Words per synthetic document")
+        parser.add_argument("--load-archives", action="store_true",
+                            help="Index the content of the archives that already have a uuid")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed")
+        parser.add_argument("--verbose", action="store_true", help="Log every request")
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        backends = FakeBackends(
+            host=options["host"],
+            elastic_port=options["es_port"],
+            fscrawler_port=options["fscrawler_port"],
+            index=options["index"],
+            faults=Faults(
+                latency=options["latency_ms"] / 1000,
+                jitter=options["jitter_ms"] / 1000,
+                error_rate=options["error_rate"]
+            ),
+            verbose=options["verbose"]
+        )
+        if options["load_archives"]:
+            self.load_archives(backends)
+        if options["corpus"]:
+            self.generate_corpus(backends, options["corpus"], options["words"])
+
+        backends.start()
+        msg = "Fake Elasticsearch on {host}:{es}, fake FsCrawler on {host}:{fsc} ({docs} documents)"
+        self.stdout.write(msg.format(
+            host=options["host"],
+            es=backends.elastic_port,
+            fsc=backends.fscrawler_port,
+            docs=len(backends.store.documents)
+        ))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            backends.stop()
+
+    def load_archives(self, backends: FakeBackends):
+        archives = Archive.objects \
+            .exclude(uuid="") \
+            .select_related("section") \
+            .only("uuid", "file", "extension", "section__id", "section__path")
+        for arch in archives.iterator():
+            try:
+                with arch.file.open("rb") as file:
+                    content = file.read().decode("utf-8", errors="ignore")
+            except OSError:
+                content = ""
+            backends.store.index_document(
+                content=content,
+                tags=arch.index_tags(),
+                extension=arch.extension,
+                doc_id=arch.uuid
+            )
+
+    def generate_corpus(self, backends: FakeBackends, size: int, words: int):
+        sections = list(Section.objects.only("id", "path")) or [None]
+        for _ in range(size):
+            section = random.choice(sections)
+            backends.store.index_document(
+                content=synthetic_text(words),
+                tags=section.index_tags() if section else {"external": {"section_path": "/"}},
+                extension="pdf"
+            )
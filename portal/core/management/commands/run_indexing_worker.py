@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from core.indexing import run_worker
+
+
+class Command(BaseCommand):
+    help = "Sends pending archives to FsCrawler from a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument("--once", action="store_true",
+                            help="Process one batch and exit")
+
+    def handle(self, *args, **options):
+        run_worker(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            once=options["once"]
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from core.blobs import sync_grantees
+from core.models import Archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Updates the users and groups with a direct view_archive grant stored "
+        "in each indexed document. Documents indexed before the grants were "
+        "stored only match through section grants until this runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Archive.objects
+                    .filter(id__gt=last_id)
+                    .exclude(uuid="")
+                    .order_by("id")
+                    .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            sync_grantees(ids)
+            total += len(ids)
+            last_id = ids[-1]
+        self.stdout.write("Synced {} archives".format(total))
@@ -0,0 +1,282 @@
+"""
+Metricas por request: consultas y tiempo de base de datos, tiempo de
+las llamadas a Elasticsearch y FsCrawler (core/transport.py) y tiempo
+de renderizado de templates (TimedTemplates).
+
+MetricsMiddleware junta las metricas de cada request en un RequestMetrics
+guardado en una ContextVar, asi tambien se cuentan las consultas que las
+vistas async hacen con sync_to_async. Con SERVER_TIMING se devuelven en
+el header Server-Timing; con METRICS_ENABLED se acumulan por vista y
+MetricsView las expone en el formato de texto de Prometheus. Cada proceso
+acumula las suyas: con varios workers cada uno informa sus requests.
+
+Las vistas declaran cuantas consultas pueden hacer con el atributo
+query_budget, un numero o un dict por metodo HTTP. Una vista que lo
+supera registra un warning, o lanza QueryBudgetExceeded con
+QUERY_BUDGET_STRICT (activo en los tests, ver core/test_runner.py).
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+logger = logging.getLogger(__name__)
+
+# Limites (segundos) del histograma de duracion de los requests
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class RequestMetrics:
+    start: float = field(default_factory=time.perf_counter)
+    duration: float = 0
+    queries: int = 0
+    db_time: float = 0
+    http_calls: int = 0
+    http_time: float = 0
+    template_time: float = 0
+
+    def server_timing(self) -> str:
+        metrics = [
+            ("db", self.db_time, "{} queries".format(self.queries)),
+            ("http", self.http_time, "{} external calls".format(self.http_calls)),
+            ("tpl", self.template_time, "templates"),
+            ("total", self.duration, ""),
+        ]
+        return ", ".join(
+            '{};dur={:.1f}{}'.format(name, seconds * 1000, ';desc="{}"'.format(desc) if desc else "")
+            for name, seconds, desc in metrics
+        )
+
+
+current_metrics: ContextVar[RequestMetrics | None] = ContextVar("request_metrics", default=None)
+
+
+def record_http(seconds: float):
+    """
+    Suma una llamada a un servicio externo al request en curso.
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.http_calls += 1
+        metrics.http_time += seconds
+
+
+def query_timer(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    Receptor de connection_created: cada conexion, de cualquier hilo,
+    mide sus consultas. La lista de wrappers sobrevive a las reconexiones.
+    """
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics = current_metrics.get()
+            if metrics is not None:
+                metrics.template_time += time.perf_counter() - start
+
+
+class TimedTemplates(DjangoTemplates):
+    """
+    DjangoTemplates que mide el renderizado de cada template pedido al
+    backend (TemplateResponse, render, render_to_string); los include
+    quedan dentro del tiempo del template que los incluye.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class ViewMetrics:
+    """
+    Metricas acumuladas por vista desde que arranco el proceso.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests: dict[tuple[str, str, int], int] = defaultdict(int)
+            self.buckets: dict[str, list[int]] = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.totals: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, view: str, method: str, status: int, metrics: RequestMetrics,
+                over_budget: bool = False):
+        with self.lock:
+            self.requests[(view, method, status)] += 1
+            buckets = self.buckets[view]
+            for i, limit in enumerate(DURATION_BUCKETS):
+                if metrics.duration <= limit:
+                    buckets[i] += 1
+            totals = self.totals[view]
+            totals["count"] += 1
+            totals["duration"] += metrics.duration
+            totals["queries"] += metrics.queries
+            totals["db_time"] += metrics.db_time
+            totals["http_calls"] += metrics.http_calls
+            totals["http_time"] += metrics.http_time
+            totals["template_time"] += metrics.template_time
+            totals["over_budget"] += over_budget
+
+    def render(self) -> str:
+        """
+        Formato de texto de Prometheus (version 0.0.4).
+        """
+        with self.lock:
+            requests = dict(self.requests)
+            buckets = {view: list(counts) for view, counts in self.buckets.items()}
+            totals = {view: dict(values) for view, values in self.totals.items()}
+
+        lines = []
+
+        def header(name: str, kind: str, description: str):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+        header("wiki_requests_total", "counter", "Requests by view, method and status.")
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append("wiki_requests_total{{{}}} {}".format(
+                labels(view=view, method=method, status=status), count
+            ))
+
+        name = "wiki_request_duration_seconds"
+        header(name, "histogram", "Time spent in the middleware chain and the view.")
+        for view in sorted(totals):
+            for limit, count in zip(DURATION_BUCKETS, buckets[view]):
+                lines.append("{}_bucket{{{}}} {}".format(name, labels(view=view, le=limit), count))
+            count = int(totals[view]["count"])
+            lines.append("{}_bucket{{{}}} {}".format(name, labels(view=view, le="+Inf"), count))
+            lines.append("{}_sum{{{}}} {}".format(name, labels(view=view), totals[view]["duration"]))
+            lines.append("{}_count{{{}}} {}".format(name, labels(view=view), count))
+
+        counters = [
+            ("wiki_db_queries_total", "queries", "Database queries."),
+            ("wiki_db_seconds_total", "db_time", "Time spent in database queries."),
+            ("wiki_external_requests_total", "http_calls", "Calls to Elasticsearch and FsCrawler."),
+            ("wiki_external_seconds_total", "http_time", "Time spent waiting for Elasticsearch and FsCrawler."),
+            ("wiki_template_seconds_total", "template_time", "Time spent rendering templates."),
+            ("wiki_query_budget_exceeded_total", "over_budget", "Requests over the query budget of the view."),
+        ]
+        for name, key, description in counters:
+            header(name, "counter", description)
+            for view in sorted(totals):
+                lines.append("{}{{{}}} {}".format(name, labels(view=view), totals[view][key]))
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join('{}="{}"'.format(key, escape(value)) for key, value in values.items())
+
+
+view_metrics = ViewMetrics()
+
+
+def view_name(request: HttpRequest) -> str:
+    match = request.resolver_match
+    # Sin la ruta, para no crear una serie por cada URL inexistente
+    return match.view_name if match is not None else "unresolved"
+
+
+def query_budget(request: HttpRequest) -> int | None:
+    match = request.resolver_match
+    if match is None:
+        return None
+    view = getattr(match.func, "view_class", match.func)
+    budget = getattr(view, "query_budget", None)
+    if isinstance(budget, dict):
+        return budget.get(request.method)
+    return budget
+
+
+class MetricsMiddleware:
+    """
+    Va primero en MIDDLEWARE, asi cuenta tambien las consultas de las
+    sesiones y la autenticacion. Las respuestas en streaming se miden
+    hasta que la vista las devuelve, no hasta enviar el ultimo byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    def finish(self, request: HttpRequest, response: HttpResponse, metrics: RequestMetrics):
+        metrics.duration = time.perf_counter() - metrics.start
+        view = view_name(request)
+        budget = query_budget(request)
+        over_budget = budget is not None and metrics.queries > budget
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing()
+        if settings.METRICS_ENABLED:
+            view_metrics.observe(view, request.method or "", response.status_code, metrics, over_budget)
+        if over_budget:
+            msg = "{} made {} queries, over its query budget of {}".format(view, metrics.queries, budget)
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(msg)
+            logger.warning(msg)
@@ -1,12 +1,18 @@
 from django.core.files import File
-from django.db import models
-from typing import Dict, final, Iterator
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, F, Max, OuterRef, Q, Value, When
+from django.db.models.functions import Concat, Left, Length, Substr
+from typing import Dict, final
 from django.contrib.auth.models import AbstractUser, Group, Permission
-from itertools import chain
 
+import hashlib
 import os
 
-from django.db.models.query import RawQuerySet
+from django.conf import settings
+from django.utils import timezone
+from django.db.models.query import QuerySet
+from .caching import bump_versions, get_or_compute, get_versions, versioned_key
+from .utils import normalize_name, trigrams
 
 @final
 class User(AbstractUser):
@@ -20,35 +26,237 @@ class PermissionHolder:
     """
     Abstraccion encargada de gestionar los permisos por grupos y usuarios.
     """
+    # Nombre usado en las claves de la cache de permisos ("section", "archive")
+    permission_scope = ""
 
-    def user_permissions(self, user: User):
+    @staticmethod
+    def permission_version(scope: str, obj_id: int) -> str:
+        return "perm:{}:{}".format(scope, obj_id)
+
+    @staticmethod
+    def membership_version(user_id: int) -> str:
+        return "groups:user:{}".format(user_id)
+
+    @staticmethod
+    def acl_version() -> str:
+        """
+        Cambia con cualquier permiso o grupo, para lo cacheado que depende
+        de los permisos de muchos objetos a la vez (ver core/search.py).
+        """
+        return "acl"
+
+    def permission_path(self) -> str:
+        """
+        Camino de la seccion cuyos permisos hereda el objeto.
+        """
         raise NotImplementedError
 
-    def group_permissions(self, user: User):
+    def own_grants(self, user: User) -> Q:
         """
-        Obtiene todos los permisos del usuario segun los grupos en los que esta.
+        Permisos (Permission) asignados al objeto mismo, al usuario o a
+        alguno de sus grupos.
         """
         raise NotImplementedError
-    
-    def all_permissions(self, user: User) -> list[Permission]:
-        assert user
-        a = self.user_permissions(user)
-        b = self.group_permissions(user)
-        return list(chain(a,b))
+
+    def effective_permissions(self, user: User) -> frozenset[str]:
+        """
+        Codenames de los permisos del usuario sobre el objeto: los asignados
+        al objeto y los asignados en la seccion que lo contiene o en alguno
+        de sus ancestros, la misma regla que PermittedQuerySet.permitted.
+        El resultado se guarda en cache por (usuario, tipo, id, camino) y se
+        invalida al cambiar los permisos del objeto o de sus secciones
+        ancestro, o los grupos del usuario (ver core/signals.py).
+        """
+        assert user and self.permission_scope
+        path = self.permission_path()
+        section_ids = Section.path_ids(path)
+        names = list(dict.fromkeys([
+            PermissionHolder.permission_version(self.permission_scope, self.pk),
+            *(PermissionHolder.permission_version("section", i) for i in section_ids),
+            PermissionHolder.membership_version(user.pk),
+        ]))
+        versions = get_versions(*names)
+        # El camino puede ser largo, la clave usa su hash y el de las versiones
+        stamp = ":".join([path, *(str(versions[name]) for name in names)])
+        key = versioned_key(
+            "perms",
+            self.permission_scope,
+            self.pk,
+            user.pk,
+            hashlib.sha1(stamp.encode("utf-8")).hexdigest()
+        )
+        inherited = Q(
+            id__in=UserSectionPermission.objects
+                .filter(user=user, section_id__in=section_ids)
+                .values("permissions")
+        ) | Q(
+            id__in=GroupSectionPermission.objects
+                .filter(group__user=user, section_id__in=section_ids)
+                .values("permissions")
+        )
+        return get_or_compute(
+            key,
+            lambda: frozenset(
+                Permission.objects
+                    .filter(self.own_grants(user) | inherited)
+                    .values_list("codename", flat=True)
+            ),
+            settings.PERMISSION_CACHE_TIMEOUT
+        )
 
     def find_permission(self, user: User, *perm_strs: str) -> bool:
         """
         perm_strs es una tupla que contienen los codenames de los permisos.
+        Los permisos de las secciones se heredan, ver effective_permissions.
         """
-        word_counter = {p:0 for p in perm_strs}
-        for perm in self.all_permissions(user):
-            codename = perm.codename 
-            if codename in word_counter:
-                word_counter[codename] += 1
-        return all(val > 0 for val in word_counter.values())
+        codenames = self.effective_permissions(user)
+        return all(p in codenames for p in perm_strs)
+
+    @classmethod
+    def permitted_ids(cls, user: User, codename: str, ids) -> set[int]:
+        """
+        Version masiva de find_permission: de los ids recibidos, devuelve
+        aquellos sobre los que el usuario tiene el permiso, con una sola
+        query (ver PermittedQuerySet.permitted).
+        """
+        assert user and codename
+        qs = cls.objects.filter(id__in=list(ids)).permitted(user, codename)
+        return set(qs.values_list("id", flat=True))
+
+
+class PermittedQuerySet(models.QuerySet):
+    """
+    QuerySet de entidades con permisos (Section, Archive).
+    permitted(user, codename) filtra las filas sobre las que el usuario tiene
+    el permiso, ya sea asignado a el o a alguno de sus grupos.
+    Los permisos de una seccion se heredan a todo su subarbol: alcanza con
+    que el permiso este en alguna seccion ancestro (comparando caminos).
+    """
+    # Camino de la seccion que contiene a cada fila
+    section_path_field = "path"
+
+    def direct_grants(self, user: User, codename: str) -> Q:
+        raise NotImplementedError
+
+    def section_grants(self, user: User, codename: str) -> Q:
+        """
+        Secciones en las que el permiso fue asignado explicitamente.
+        """
+        return Q(
+            id__in=UserSectionPermission.objects
+                .filter(user=user, permissions__codename=codename)
+                .values("section_id")
+        ) | Q(
+            id__in=GroupSectionPermission.objects
+                .filter(group__user=user, permissions__codename=codename)
+                .values("section_id")
+        )
+
+    def inherited_grants(self, user: User, codename: str) -> Exists:
+        return Exists(
+            Section.objects
+                .filter(self.section_grants(user, codename))
+                .filter(path=Left(OuterRef(self.section_path_field), Length("path")))
+        )
+
+    def permitted(self, user: User, codename: str, *, inherit: bool = True):
+        assert user and codename
+        cond = self.direct_grants(user, codename)
+        if inherit:
+            cond |= self.inherited_grants(user, codename)
+        return self.filter(cond)
+
+
+class SectionQuerySet(PermittedQuerySet):
+    def direct_grants(self, user: User, codename: str) -> Q:
+        return self.section_grants(user, codename)
+
+
+class ArchiveQuerySet(PermittedQuerySet):
+    section_path_field = "section__path"
+
+    def matching_name(self, term: str):
+        """
+        Busqueda por nombre de archivo (prefijo o parte del nombre, sin
+        acentos ni mayusculas) usando el indice de trigramas: los candidatos
+        son los archivos que tienen todos los trigramas del termino, y sobre
+        ellos se confirma la coincidencia.
+        Ordena primero las coincidencias exactas, luego los prefijos y luego
+        los nombres mas cortos.
+        """
+        norm = normalize_name(term)
+        grams = trigrams(norm)
+        qs = self
+        if grams:
+            candidates = ArchiveNameTrigram.objects \
+                .filter(trigram__in=grams) \
+                .values("archive_id") \
+                .annotate(hits=Count("trigram")) \
+                .filter(hits=len(grams)) \
+                .values("archive_id")
+            qs = qs.filter(id__in=candidates)
+        return qs.filter(search_name__contains=norm) \
+            .annotate(rank=Case(
+                When(search_name=norm, then=Value(0)),
+                When(search_name__startswith=norm, then=Value(1)),
+                default=Value(2)
+            )) \
+            .order_by("rank", Length("search_name"), "search_name", "id")
+
+    def acl(self, user: User, codename: str) -> dict:
+        """
+        Resumen de permitted() para filtrar fuera de la base de datos
+        (en Elasticsearch): caminos de las secciones con el permiso, y el
+        usuario y sus grupos para compararlos con los permisos asignados
+        directamente que se indexan con cada documento (ver grantee_tags).
+        """
+        assert codename == "view_archive"
+        section_paths = Section.objects \
+            .filter(self.section_grants(user, codename)) \
+            .values_list("path", flat=True)
+        return {
+            "section_paths": list(section_paths),
+            "user_id": user.pk,
+            "group_ids": list(user.groups.values_list("id", flat=True))
+        }
+
+    def grantee_tags(self) -> dict:
+        """
+        Usuarios y grupos con view_archive asignado directamente a alguno
+        de los archivos del queryset. Se indexan con el documento para que
+        la busqueda por contenido filtre por ellos sin enviar la lista
+        de archivos permitidos (ver acl).
+        """
+        users = UserArchivePermission.objects \
+            .filter(archive__in=self, permissions__codename="view_archive") \
+            .values_list("user_id", flat=True) \
+            .distinct() \
+            .order_by("user_id")
+        groups = GroupArchivePermission.objects \
+            .filter(archive__in=self, permissions__codename="view_archive") \
+            .values_list("group_id", flat=True) \
+            .distinct() \
+            .order_by("group_id")
+        return {
+            "user_id": list(users),
+            "group_id": list(groups)
+        }
+
+    def direct_grants(self, user: User, codename: str) -> Q:
+        return Q(
+            id__in=UserArchivePermission.objects
+                .filter(user=user, permissions__codename=codename)
+                .values("archive_id")
+        ) | Q(
+            id__in=GroupArchivePermission.objects
+                .filter(group__user=user, permissions__codename=codename)
+                .values("archive_id")
+        )
 
 @final
 class Section(models.Model, PermissionHolder):
+    permission_scope = "section"
+    objects = SectionQuerySet.as_manager()
     name = models.CharField(max_length=256, null=False)
     description = models.CharField(max_length=256, default="")
     parent = models.ForeignKey(
@@ -57,10 +265,184 @@ class Section(models.Model, PermissionHolder):
             null=True,
             related_name="children"
             )
+    # Camino materializado: ids de los ancestros (incluida la seccion)
+    # separados por "/", por ejemplo "/1/5/12/". El largo maximo limita la
+    # profundidad del arbol (ver build_path); 760 caracteres es lo que
+    # entra en un indice de MariaDB con utf8mb4.
+    path = models.CharField(max_length=760, default="", db_index=True)
+    depth = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    def permission_path(self) -> str:
+        return self.path
+
+    def own_grants(self, user: User) -> Q:
+        # Los permisos de la seccion estan en su camino (permission_path)
+        return Q()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Padre guardado, para detectar los cambios de padre en save()
+        if "parent_id" in field_names:
+            instance._saved_parent_id = values[field_names.index("parent_id")]
+        return instance
+
+    @staticmethod
+    def check_path_length(length: int):
+        if length > Section._meta.get_field("path").max_length:
+            raise ValueError("The section tree is too deep")
+
+    @staticmethod
+    def build_path(parent: "Section | None", pk: int) -> tuple[str, int]:
+        if not parent:
+            return ("/{}/".format(pk), 0)
+        assert parent.path
+        path = "{}{}/".format(parent.path, pk)
+        Section.check_path_length(len(path))
+        return (path, parent.depth + 1)
+
+    def save(self, *args, **kwargs):
+        """
+        El camino depende del id, por lo que se completa luego del INSERT.
+        Un cambio de padre (desde el ORM o el admin) se hace con move_to,
+        que reescribe el camino de todo el subarbol.
+        """
+        creating = self._state.adding
+        update_fields = kwargs.get("update_fields")
+        moved = not creating \
+            and hasattr(self, "_saved_parent_id") \
+            and self.parent_id != self._saved_parent_id \
+            and (update_fields is None or {"parent", "parent_id"} & set(update_fields))
+        with transaction.atomic():
+            if moved:
+                self.move_to(self.parent)
+            super().save(*args, **kwargs)
+            if creating and not self.path:
+                self.path, self.depth = Section.build_path(self.parent, self.pk)
+                Section.objects.filter(pk=self.pk) \
+                        .update(path=self.path, depth=self.depth)
+        self._saved_parent_id = self.parent_id
+
+    @staticmethod
+    def path_ids(path: str) -> list[int]:
+        return [int(i) for i in path.strip("/").split("/") if i]
+
+    @property
+    def ancestor_ids(self) -> list[int]:
+        """
+        Ids de los ancestros, desde la raiz hasta la seccion actual (incluida).
+        """
+        return Section.path_ids(self.path)
+
+    @staticmethod
+    def subtree_version(section_id: int) -> str:
+        return "subtree:{}".format(section_id)
+
+    @staticmethod
+    def bump_subtrees(path: str):
+        """
+        Invalida lo cacheado para los subarboles que contienen al camino,
+        es decir, el de la seccion y el de cada uno de sus ancestros.
+        Se llama al agregar o quitar secciones y archivos (ver core/signals.py).
+        """
+        bump_versions(*(Section.subtree_version(i) for i in Section.path_ids(path)))
+
+    def is_descendant_of(self, section: "Section") -> bool:
+        """
+        Verdadero si la seccion esta dentro del subarbol de 'section'
+        (incluyendo a la misma seccion).
+        """
+        assert self.path and section.path
+        return self.path.startswith(section.path)
+
+    def index_tags(self) -> dict:
+        """
+        Campos que se indexan en Elasticsearch junto a cada archivo de la
+        seccion, para filtrar las busquedas por contenido por subarbol
+        y por permisos.
+        """
+        assert self.path
+        return {
+            "external": {
+                "section_id": self.id,
+                "section_path": self.path
+            }
+        }
+
+    @transaction.atomic
+    def move_to(self, new_parent: "Section | None"):
+        """
+        Cambia el padre de la seccion y reescribe el camino de todo el
+        subarbol con un solo UPDATE.
+        Los documentos ya indexados conservan el camino anterior
+        (ver index_tags) hasta que se vuelvan a indexar.
+        """
+        if new_parent and new_parent.is_descendant_of(self):
+            raise ValueError("A section can't be moved inside its own subtree")
+        old_path = self.path
+        new_path, new_depth = Section.build_path(new_parent, self.pk)
+        longest = Section.objects \
+            .filter(path__startswith=old_path) \
+            .aggregate(longest=Max(Length("path")))["longest"]
+        Section.check_path_length(longest + len(new_path) - len(old_path))
+        Section.objects.filter(path__startswith=old_path).update(
+            path=Concat(
+                Value(new_path),
+                Substr("path", len(old_path) + 1),
+                output_field=models.CharField()
+            ),
+            depth=F("depth") + (new_depth - self.depth)
+        )
+        Section.objects.filter(pk=self.pk).update(parent=new_parent)
+        Section.bump_subtrees(old_path)
+        Section.bump_subtrees(new_path)
+        self.parent = new_parent
+        self.path = new_path
+        self.depth = new_depth
+        self._saved_parent_id = self.parent_id
+
+    @classmethod
+    def expected_paths(cls) -> dict[int, tuple[str, int]]:
+        """
+        Recalcula en memoria el camino de cada seccion recorriendo el arbol
+        a partir de las raices. Las secciones que no son alcanzables
+        (por ejemplo, ciclos) no aparecen en el resultado.
+        """
+        children = {}
+        for secid, parentid in cls.objects.values_list("id", "parent_id"):
+            children.setdefault(parentid, []).append(secid)
+        paths = {}
+        pending = [(secid, "/", -1) for secid in children.get(None, [])]
+        while pending:
+            secid, parent_path, parent_depth = pending.pop()
+            path = "{}{}/".format(parent_path, secid)
+            paths[secid] = (path, parent_depth + 1)
+            for child in children.get(secid, []):
+                pending.append((child, path, parent_depth + 1))
+        return paths
+
+    @classmethod
+    def rebuild_paths(cls, batch_size: int = 1000) -> tuple[int, int]:
+        """
+        Corrige el camino y la profundidad de las secciones que no
+        coinciden con su cadena de padres. Devuelve (corregidas, total).
+        """
+        expected = cls.expected_paths()
+        stale = []
+        for sec in cls.objects.only("id", "path", "depth").iterator():
+            if sec.id not in expected:
+                continue
+            path, depth = expected[sec.id]
+            if sec.path != path or sec.depth != depth:
+                sec.path = path
+                sec.depth = depth
+                stale.append(sec)
+        cls.objects.bulk_update(stale, ["path", "depth"], batch_size=batch_size)
+        return (len(stale), len(expected))
+
     def create_child(self, *, name: str, user:User, perms: list[str]):
         """
         Crea un hijo y asigna los permisos enviados en formatos string.
@@ -76,65 +458,73 @@ class Section(models.Model, PermissionHolder):
         return new_section
         
 
-    def all_children(self, user: User) -> RawQuerySet:
-        """
-        Ejecuta una query recursiva.
-        Utiliza la union de un elemento ancla (o anchor, para este caso es la
-        seccion actual) y se ubica como el SELECT **antes** del UNION ALL.
-        Y una vista, que desde ahora, tendra la logica para la recursion y
-        contiene aquellas secciones tales que su padre pertenece a la 
-        vista 'ancestors' (que en un principio, solo posee el ancla).
-        Esta ultima vista, es el SELECT **luego** del UNION ALL.
-
-        Este metodo puede tener problemas con versiones
-        de bases de datos que no permitan usar RECURSIVE.
-        """
-        assert user
-        return Section.objects.raw(
-            """
-            WITH RECURSIVE ancestors AS (
-                SELECT *
-                FROM core_section s 
-                WHERE s.id = %s
-                UNION ALL
-                SELECT cs.*
-                FROM core_section cs, ancestors a 
-                WHERE cs.parent_id = a.id
-            ) SELECT * FROM ancestors;
-            """, [self.id])
-
-    def all_children_map(self, user: User) -> tuple[dict,dict]:
-        """
-        Obtiene todas las secciones hijas del elemento actual.
-        DjangoORM permite realizar una precarga utilizando un 
-        join con .prefetch_related(<nombre_entidad>). 
-        Esto ejecuta una segunda query y permite no realizar
-        una llamada a la base de datos por cada archivo utilizado.
-
-        Para este caso, se traen los archivos disponibles para
-        cada seccion.
-
-        la idea de este metodo es armar dos mapas:
-            - treemap, con pares (<id_seccion_padre>, [secciones_hijas])
-            - archivesmap, con pares (<id_seccion_padre>, [archivos_hijos])
-        """
-        assert user
+    def all_children(self, user: User) -> QuerySet["Section"]:
+        """
+        Obtiene el subarbol de la seccion (incluida ella misma).
+        En lugar de una query recursiva, se usa el camino materializado:
+        toda seccion del subarbol tiene un camino que comienza con el 
+        camino de la seccion actual, lo que se resuelve con un LIKE 'prefijo%'
+        sobre un indice.
+        """
+        assert user and self.path
+        return Section.objects.filter(path__startswith=self.path)
+
+    def children_map(self, user: User, *, depth: int = 1, offset: int = 0,
+                     limit: int | None = None) -> tuple[dict, dict, bool]:
+        """
+        Arma dos mapas: (<id_seccion_padre>, [secciones_hijas]) y
+        (<id_seccion_padre>, [archivos_hijos]), por niveles. Trae los hijos
+        directos de la seccion (paginados con offset/limit) y, si depth > 1,
+        los niveles siguientes de esos hijos.
+        A cada seccion se le agrega el atributo 'remaining' con la cantidad
+        de niveles precargados debajo de ella, si es 0 su contenido se pide
+        recien al expandirla.
+        El tercer valor indica si quedan hijos directos por paginar.
+        """
+        assert user and self.path and depth > 0
+        fields = ("id", "name", "parent_id", "path", "depth")
+        end = None if limit is None else offset + limit + 1
+        children = list(
+            Section.objects.filter(parent_id=self.id)
+                .only(*fields)
+                .order_by("name", "id")[offset:end]
+        )
+        archives = list(
+            Archive.objects.filter(section_id=self.id)
+                .only("id", "fullname", "section_id", "index_status")
+                .order_by("fullname", "id")[offset:end]
+        )
+        has_more = limit is not None and \
+            (len(children) > limit or len(archives) > limit)
+        children = children[:limit]
+        archives = archives[:limit]
+
+        max_depth = self.depth + depth
+        sections = list(children)
+        if depth > 1 and children:
+            subtrees = Q()
+            for child in children:
+                subtrees |= Q(path__startswith=child.path)
+            sections += Section.objects \
+                .filter(subtrees, depth__gt=self.depth + 1, depth__lte=max_depth) \
+                .only(*fields) \
+                .order_by("name", "id")
+
         treemap = {}
-        archivesmap = {}
-        qs = self.all_children(user)
-
-        qs.prefetch_related("archives")
-        for sec in self.all_children(user):
-            parentid = sec.parent_id
-            secid = sec.id
-            if parentid not in treemap:
-                treemap[parentid] = []
-            treemap[parentid].append(sec)
-            if secid not in archivesmap and sec.archives.all():
-                archivesmap[secid] = []
-            for arch in sec.archives.all():
-                archivesmap[sec.id].append(arch)
-        return (treemap, archivesmap)
+        for sec in sections:
+            sec.remaining = max_depth - sec.depth
+            treemap.setdefault(sec.parent_id, []).append(sec)
+
+        archivesmap = {self.id: archives} if archives else {}
+        expanded = [sec.id for sec in sections if sec.remaining > 0]
+        if expanded:
+            deeper_archives = Archive.objects \
+                .filter(section_id__in=expanded) \
+                .only("id", "fullname", "section_id", "index_status") \
+                .order_by("fullname", "id")
+            for arch in deeper_archives:
+                archivesmap.setdefault(arch.section_id, []).append(arch)
+        return (treemap, archivesmap, has_more)
 
     def create_child_archive(self, *, file: File, user:User, perms: list[str], fields: Dict[str, str | int]) -> "Archive":
         """
@@ -142,40 +532,63 @@ class Section(models.Model, PermissionHolder):
         accesos para el usuario que lo creo.
         No se toca nada de grupos, la intencion es que un administrador
         agregue los permisos a un archivo de manera grupal.
+        El contenido se guarda deduplicado, ver core/blobs.py.
         """
         assert file and user and perms
+        from .blobs import acquire_blob
+
         fullname = str(file.name)
         filename, extension = os.path.splitext(fullname)
-        arch = self.archives.create(
-                fullname = file.name,
-                name = filename,
-                extension = extension,
-                file = file,
-                **fields
-            )
-        perm_entities = Permission.objects.filter(codename__in=perms)
-        uap = arch.userarchivepermission_set.create(user=user)
-        uap.permissions.set(perm_entities)
+        with transaction.atomic():
+            blob, _ = acquire_blob(file)
+            arch = self.archives.create(
+                    fullname = file.name,
+                    name = filename,
+                    extension = extension,
+                    file = blob.file.name,
+                    blob = blob,
+                    uuid = blob.uuid,
+                    search_name = normalize_name(fullname),
+                    **fields
+                )
+            ArchiveNameTrigram.objects.bulk_create(ArchiveNameTrigram.build([arch]))
+            perm_entities = Permission.objects.filter(codename__in=perms)
+            uap = arch.userarchivepermission_set.create(user=user)
+            uap.permissions.set(perm_entities)
         return arch
 
-    def group_permissions(self, user: User) -> Iterator[Permission]:
-        assert user
-        groups_perms = self.groupsectionpermission_set \
-                .filter(group__in=user.groups.all())
-        for gp in groups_perms:
-            for perm in gp.permissions.all():
-                yield perm
-
-    def user_permissions(self, user: User) -> Iterator[Permission]:
-        assert user
-        user_perms = self.usersectionpermission_set \
-                .filter(user=user) 
-        for up in user_perms:
-            for perm in up.permissions.all():
-                yield perm
+class IndexStatus(models.TextChoices):
+    PENDING = "pending"
+    INDEXED = "indexed"
+    FAILED = "failed"
+
+@final
+class Blob(models.Model):
+    """
+    Contenido de un archivo, guardado una sola vez por SHA-256 y compartido
+    por todos los Archive con el mismo contenido. Se indexa una sola vez en
+    Elasticsearch (uuid) y se borra al liberar la ultima referencia,
+    ver core/blobs.py.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="blobs", null=False)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    uuid = models.CharField(max_length=36, default="")
+
+    @staticmethod
+    def storage_name(sha256: str, extension: str) -> str:
+        """
+        Ubicacion del contenido en el storage: blobs/ab/cd/abcd....pdf
+        Dos niveles de directorios evitan carpetas con demasiados archivos.
+        """
+        assert len(sha256) == 64
+        return "blobs/{}/{}/{}{}".format(sha256[:2], sha256[2:4], sha256, extension.lower())
 
 @final
 class Archive(models.Model, PermissionHolder):
+    permission_scope = "archive"
+    objects = ArchiveQuerySet.as_manager()
     fullname = models.CharField(max_length=256, null=False)
     name = models.CharField(max_length=256, null=False)
     description = models.CharField(max_length=256, default = "")
@@ -190,21 +603,98 @@ class Archive(models.Model, PermissionHolder):
         related_name="archives"
     )
     file = models.FileField(upload_to="uploads/%Y/%m/%d", null=False)
+    # Contenido compartido; file apunta al archivo del blob.
+    # Los archivos anteriores a los blobs no tienen uno, ver migrate_archive_blobs
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        null=True,
+        related_name="archives"
+    )
     uuid = models.CharField(max_length=36, default="")
+    # fullname normalizado, ver utils.normalize_name y ArchiveNameTrigram
+    search_name = models.CharField(max_length=256, default="", db_index=True)
+    # Estado del indexado en Elasticsearch, ver core/indexing.py
+    index_status = models.CharField(
+        max_length=8,
+        choices=IndexStatus.choices,
+        default=IndexStatus.PENDING
+    )
+
+    def permission_path(self) -> str:
+        return self.section.path
+
+    def index_tags(self) -> dict:
+        """
+        Tags de indexado de un archivo sin blob: los de su seccion y los
+        permisos asignados al archivo. Los de un blob los arma
+        blobs.index_tags.
+        """
+        tags = self.section.index_tags()
+        tags["external"].update(Archive.objects.filter(pk=self.pk).grantee_tags())
+        return tags
+
+    def own_grants(self, user: User) -> Q:
+        return Q(
+            id__in=self.userarchivepermission_set
+                .filter(user=user)
+                .values("permissions")
+        ) | Q(
+            id__in=self.grouparchivepermission_set
+                .filter(group__user=user)
+                .values("permissions")
+        )
+
+@final
+class IndexingJob(models.Model):
+    """
+    Cola (en la base de datos) de archivos pendientes de indexar mediante
+    FsCrawler. Las filas se borran al indexar correctamente; si se agotan
+    los reintentos quedan con run_after nulo y el archivo como FAILED.
+    """
+    archive = models.OneToOneField(
+        Archive,
+        on_delete=models.CASCADE,
+        related_name="indexing_job"
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(null=True, default=timezone.now, db_index=True)
+    locked_until = models.DateTimeField(null=True)
+    last_error = models.TextField(default="")
+
+@final
+class ArchiveNameTrigram(models.Model):
+    """
+    Indice de trigramas del nombre normalizado de cada archivo.
+    Permite buscar por una parte del nombre sin recorrer toda la tabla
+    de archivos (un LIKE '%termino%' no puede usar indices).
+    """
+    archive = models.ForeignKey(
+        Archive,
+        on_delete=models.CASCADE,
+        related_name="name_trigrams"
+    )
+    trigram = models.CharField(max_length=3)
 
-    def group_permissions(self, user: User) -> Iterator[Permission]:
-        assert user
-        groups_perms = self.grouparchivepermission_set.filter(group__in=user.groups.all())
-        for gp in groups_perms:
-            for perm in gp.permissions.all():
-                yield perm
-
-    def user_permissions(self, user: User) -> Iterator[Permission]:
-        assert user
-        user_perms = self.userarchivepermission_set.filter(user=user) 
-        for gp in user_perms:
-            for perm in gp.permissions.all():
-                yield perm
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["trigram", "archive"],
+                name="unique_archive_trigram"
+            )
+        ]
+
+    @staticmethod
+    def build(archives) -> list["ArchiveNameTrigram"]:
+        """
+        Filas del indice para los archivos recibidos (con search_name ya
+        calculado), listas para un bulk_create.
+        """
+        return [
+            ArchiveNameTrigram(archive_id=arch.id, trigram=gram)
+            for arch in archives
+            for gram in trigrams(arch.search_name)
+        ]
 
 class SectionPermission(models.Model):
     section = models.ForeignKey(Section, on_delete=models.CASCADE, default=None)
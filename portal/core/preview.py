@@ -0,0 +1,103 @@
+"""
+Vista previa de archivos de texto por ventanas de bytes.
+
+Cada pedido lee a lo sumo TEXT_PREVIEW_SIZE bytes desde un offset, por lo
+que la memoria y el tamano de la respuesta no dependen del tamano del
+archivo. La codificacion se detecta con la primera ventana y se mantiene
+en las siguientes.
+"""
+import codecs
+from dataclasses import dataclass
+from typing import IO
+
+from charset_normalizer import from_bytes
+from django.conf import settings
+
+DEFAULT_ENCODING = "utf-8"
+# Muestra usada para detectar la codificacion
+DETECTION_SIZE = 16 * 1024
+
+
+@dataclass
+class PreviewWindow:
+    content: str
+    encoding: str
+    # Offset de la siguiente ventana, None al llegar al final
+    next_offset: int | None
+    binary: bool = False
+
+
+# Con el orden de bytes explicito las ventanas siguientes (sin BOM) se
+# decodifican igual que la primera
+BOMS = [
+    (codecs.BOM_UTF8, "utf_8"),
+    (codecs.BOM_UTF16_LE, "utf_16_le"),
+    (codecs.BOM_UTF16_BE, "utf_16_be"),
+]
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    BOM, luego UTF-8 y recien despues charset_normalizer, limitado a
+    TEXT_PREVIEW_ENCODINGS: en muestras cortas suele confundir cp1252
+    con codificaciones parecidas.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder(DEFAULT_ENCODING)().decode(sample, final=False)
+        return DEFAULT_ENCODING
+    except UnicodeDecodeError:
+        pass
+    match = from_bytes(sample, cp_isolation=settings.TEXT_PREVIEW_ENCODINGS or None).best()
+    if match is None:
+        return DEFAULT_ENCODING
+    return match.encoding
+
+
+def valid_encoding(name: str) -> str | None:
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def read_window(fileobj: IO, offset: int, size: int, encoding: str | None = None) -> PreviewWindow:
+    """
+    Lee y decodifica una ventana de hasta 'size' bytes desde 'offset'.
+    Si la ventana no llega al final del archivo, termina en el ultimo salto
+    de linea y nunca corta un caracter multibyte; la siguiente empieza
+    donde termino esta.
+    """
+    fileobj.seek(offset)
+    data = fileobj.read(size)
+    at_end = not fileobj.read(1)
+
+    if encoding is None:
+        sample = data[:DETECTION_SIZE]
+        if b"\x00" in sample and not sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return PreviewWindow("", "", None, binary=True)
+        encoding = detect_encoding(sample)
+
+    if not at_end:
+        newline = data.rfind(b"\n")
+        if newline > 0:
+            data = data[:newline + 1]
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    content = decoder.decode(data, final=at_end)
+    # Bytes de un caracter incompleto: quedan para la siguiente ventana
+    pending, _ = decoder.getstate()
+    consumed = len(data) - len(pending)
+    if consumed == 0 and data:
+        # Ventana mas chica que un caracter: se reemplaza para avanzar
+        content = decoder.decode(b"", final=True)
+        consumed = len(data)
+    if offset == 0:
+        content = content.removeprefix("\ufeff")
+    return PreviewWindow(
+        content=content,
+        encoding=encoding,
+        next_offset=None if at_end else offset + consumed
+    )
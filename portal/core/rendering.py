@@ -0,0 +1,95 @@
+"""
+HTML de los archivos markdown, renderizado una sola vez.
+
+El HTML se guarda en el storage bajo rendered/<version>/, con el hash del
+contenido (el del blob) como nombre, y los documentos chicos ademas en la
+cache local de cada proceso. La version del renderizador depende de la
+version de Markdown y de MARKDOWN_EXTENSIONS: al cambiarlas, todo se
+vuelve a renderizar al pedirse o con el comando rerender_markdown.
+"""
+import hashlib
+import json
+from functools import cache
+
+import markdown as markdown_tool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .caching import local_cache, versioned_key
+from .models import Archive
+
+RENDERED_DIR = "rendered"
+
+
+@cache
+def renderer_version() -> str:
+    config = [
+        markdown_tool.__version__,
+        settings.MARKDOWN_EXTENSIONS,
+        settings.MARKDOWN_EXTENSION_CONFIGS,
+    ]
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def render_markdown(text: str) -> str:
+    return markdown_tool.markdown(
+        text,
+        extensions=settings.MARKDOWN_EXTENSIONS,
+        extension_configs=settings.MARKDOWN_EXTENSION_CONFIGS
+    )
+
+
+def content_key(archive: Archive) -> str:
+    # Los archivos anteriores a los blobs no cambian de contenido
+    if archive.blob_id:
+        return archive.blob.sha256
+    return "archive-{}".format(archive.id)
+
+
+def storage_name(key: str) -> str:
+    return "{}/{}/{}/{}.html".format(RENDERED_DIR, renderer_version(), key[:2], key)
+
+
+def rendered_name(archive: Archive) -> str:
+    return storage_name(content_key(archive))
+
+
+def store_rendered(archive: Archive, text: str) -> str:
+    """
+    Renderiza el texto del archivo y lo guarda. Devuelve el HTML.
+    """
+    html = render_markdown(text)
+    name = rendered_name(archive)
+    if not default_storage.exists(name):
+        stored = default_storage.save(name, ContentFile(html.encode("utf-8")))
+        if stored != name:
+            # Otro proceso lo guardo primero
+            default_storage.delete(stored)
+    cache_html(name, html)
+    return html
+
+
+def rendered_html(archive: Archive) -> str:
+    """
+    HTML del archivo markdown. Solo se renderiza si todavia no esta
+    guardado para la version actual.
+    """
+    name = rendered_name(archive)
+    key = versioned_key("markdown", name)
+    html = local_cache().get(key)
+    if html is not None:
+        return html
+    if default_storage.exists(name):
+        with default_storage.open(name, "rb") as file:
+            html = file.read().decode("utf-8")
+        cache_html(name, html)
+        return html
+    with archive.file.open("rb") as file:
+        text = file.read().decode("utf-8")
+    return store_rendered(archive, text)
+
+
+def cache_html(name: str, html: str):
+    if len(html) <= settings.MARKDOWN_LOCAL_CACHE_MAX_SIZE:
+        local_cache().set(versioned_key("markdown", name), html)
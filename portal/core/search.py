@@ -0,0 +1,186 @@
+"""
+Busqueda por contenido paginada en Elasticsearch.
+
+Cada pagina del ListView pide a Elasticsearch solo sus resultados
+(from/size) y luego trae los archivos de esos resultados de la base de
+datos, en el orden de relevancia. La cantidad total la informa
+Elasticsearch, asi que Paginator no necesita todos los resultados.
+
+Las paginas ya mostradas se guardan en cache (CachedPage) por usuario,
+seccion principal, busqueda y pagina, ver results_key.
+"""
+import hashlib
+import json
+from collections.abc import Sequence
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Page
+
+from .caching import get_versions, versioned_key
+from .models import Archive, PermissionHolder, Section, User
+from .service import elastic_service
+
+
+class ElasticResults(Sequence):
+    """
+    Secuencia perezosa para Paginator: count() y cada slice hacen una
+    busqueda con from/size. prefetch() adelanta la pagina que se va a
+    mostrar, asi count() no necesita una busqueda aparte.
+
+    Los permisos se filtran en Elasticsearch (extra["acl"]) y de nuevo
+    en 'queryset'. Un documento compartido por varios archivos (ver
+    core/blobs.py) aparece una vez por cada archivo visible, por lo que
+    una pagina puede tener algun resultado de mas.
+    """
+
+    def __init__(self, queryset, *, content: str, extra: dict, index: str = "idx"):
+        self.queryset = queryset
+        self.content = content
+        self.extra = extra
+        self.index = index
+        self.total: int | None = None
+        # offset -> (size pedido, archivos)
+        self.windows: dict[int, tuple[int, list[Archive]]] = {}
+
+    def search(self, offset: int, limit: int) -> list[Archive]:
+        cached = self.windows.get(offset)
+        # La ultima pagina se pide mas corta que la adelantada por prefetch
+        if cached is not None and cached[0] >= limit:
+            return cached[1]
+        res = elastic_service.search_by_content(
+            index=self.index,
+            content=self.content,
+            extra=self.search_extra(offset, limit)
+        )
+        return self.store(offset, limit, res)
+
+    def search_extra(self, offset: int, limit: int) -> dict:
+        return {
+            **self.extra,
+            "from": offset,
+            "size": limit,
+            "source": False,
+            "highlight": True
+        }
+
+    def store(self, offset: int, limit: int, res: dict) -> list[Archive]:
+        self.total = res["hits"]["total"]["value"]
+        window = self.archives(res["hits"]["hits"])
+        self.windows[offset] = (limit, window)
+        return window
+
+    def archives(self, hits: list[dict]) -> list[Archive]:
+        uuids = [h["_id"] for h in hits]
+        if not uuids:
+            return []
+        by_uuid: dict[str, list[Archive]] = {}
+        for arch in self.queryset.filter(uuid__in=uuids):
+            by_uuid.setdefault(arch.uuid, []).append(arch)
+        results = []
+        for hit in hits:
+            fragments = hit.get("highlight", {}).get("content", [])
+            for arch in by_uuid.get(hit["_id"], []):
+                arch.highlight = fragments[0] if fragments else ""
+                results.append(arch)
+        return results
+
+    def prefetch(self, page: int, page_size: int):
+        """
+        Lanza requests.RequestException si Elasticsearch no responde.
+        """
+        self.search((page - 1) * page_size, page_size)
+
+    async def aprefetch(self, page: int, page_size: int):
+        """
+        Version async de prefetch: espera a Elasticsearch sin ocupar un
+        hilo, y solo la consulta de los archivos pasa por sync_to_async.
+        """
+        offset = (page - 1) * page_size
+        res = await elastic_service.asearch_by_content(
+            index=self.index,
+            content=self.content,
+            extra=self.search_extra(offset, page_size)
+        )
+        await sync_to_async(self.store)(offset, page_size, res)
+
+    def count(self) -> int:
+        if self.total is None:
+            self.search(0, 0)
+        assert self.total is not None
+        # Elasticsearch no pagina mas alla de index.max_result_window
+        return min(self.total, settings.SEARCH_MAX_RESULTS)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.count())
+            assert step == 1
+            if stop <= start:
+                return []
+            return self.search(start, stop - start)
+        return self.search(key, 1)[0]
+
+
+class CachedPage(Sequence):
+    """
+    Una pagina de resultados guardada en cache, con el total de
+    resultados para que Paginator arme la misma pagina sin buscar de nuevo.
+    """
+
+    def __init__(self, offset: int, items: list[dict], total: int):
+        self.offset = offset
+        self.items = items
+        self.total = total
+
+    @classmethod
+    def from_page(cls, page: Page) -> "CachedPage":
+        items = [
+            {
+                "id": obj.id,
+                "fullname": obj.fullname,
+                "highlight": getattr(obj, "highlight", "")
+            }
+            for obj in page.object_list
+        ]
+        return cls(page.start_index() - 1 if items else 0, items, page.paginator.count)
+
+    def count(self) -> int:
+        return self.total
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.items if key.start in (None, self.offset) else []
+        return self.items[key - self.offset]
+
+
+def results_key(user: User, root: Section, params: dict, page: str) -> str:
+    """
+    Clave de una pagina de resultados. Cambia al agregar o quitar archivos
+    y secciones del subarbol (Section.bump_subtrees) y con cualquier cambio
+    de permisos o grupos (PermissionHolder.acl_version).
+    """
+    subtree_version = Section.subtree_version(root.id)
+    acl_version = PermissionHolder.acl_version()
+    versions = get_versions(subtree_version, acl_version)
+    search = json.dumps([
+        " ".join(params["name"].casefold().split()),
+        params["by_content"],
+        params.get("extension", ""),
+        str(params.get("modified_after") or ""),
+        str(params.get("modified_before") or ""),
+    ])
+    return versioned_key(
+        "search",
+        user.pk,
+        root.id,
+        versions[subtree_version],
+        versions[acl_version],
+        hashlib.sha1(search.encode("utf-8")).hexdigest(),
+        page
+    )
@@ -1,19 +1,31 @@
-from typing import Dict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, cast
 from django.core.files import File
 import requests
 import json
 import logging
+import os
+import threading
 from django.conf import settings
+from django.utils.module_loading import import_string
+from .streaming import MultipartEncoder
+from .transport import AsyncTransport, Transport
 
 # Hacer una clase para abstraer ambos servicios
 
 class ElasticSearchService:
     def __init__(self):
         logger = logging.getLogger(self.__class__.__name__)
-        session = requests.Session()
+        transport = Transport(
+            "elasticsearch",
+            base_url=settings.ELASTIC_URL,
+            pool_size=settings.ELASTIC_POOL_SIZE,
+            connect_timeout=settings.ELASTIC_CONNECT_TIMEOUT,
+            read_timeout=settings.ELASTIC_READ_TIMEOUT
+        )
+        session = transport.session
         # setup CA/Cert
         # session.verify = "ca/cert/path"
-        session.trust_env = False # False - no proxy; True - use proxy
         api_key = settings.ELASTIC_KEY
         if api_key:
             logger.info("API KEY available, using Bearer header")
@@ -25,18 +37,26 @@ class ElasticSearchService:
             session.auth = ("elastic", password)
 
         self.logger = logger
-        self.session = session
+        self.transport = transport
+        self.atransport = AsyncTransport(transport)
         self.url = settings.ELASTIC_URL
 
+    @property
+    def degraded(self) -> bool:
+        return self.transport.degraded
+
     def test_service(self) -> Dict:
-        res = self.session.get(self.url)
+        res = self.transport.request("GET", "")
         return json.loads(res.content)
 
-    def search_by_content(self, *, index: str, content: str, extra: dict):
-        assert str and content
-        resource = "{index_name}/_search".format(index_name=index)
-        url = "{url}/{resource}".format(url=self.url, resource=resource)
-        headers = { "Content-Type": "application/json" }
+    def search_body(self, *, content: str, extra: dict) -> dict:
+        """
+        Consulta de search_by_content. Claves de 'extra':
+        extension, section_path, section_ids, modified_after y
+        modified_before (fechas), acl (ver ArchiveQuerySet.acl) para
+        filtrar; from, size, source (_source) y highlight para la respuesta.
+        """
+        assert content
         filters = []
         ext = extra.get("extension")
         if ext: 
@@ -46,24 +66,118 @@ class ElasticSearchService:
                 }
             })
 
+        # Subarbol de secciones y permisos, indexados con cada documento
+        # por FsCrawler (ver Section.index_tags)
+        section_path = extra.get("section_path")
+        if section_path:
+            filters.append({
+                "prefix": {
+                    "external.section_path.keyword": section_path
+                }
+            })
+
+        section_ids = extra.get("section_ids")
+        if section_ids:
+            filters.append({
+                "terms": {
+                    "external.section_id": list(section_ids)
+                }
+            })
+
+        modified = {}
+        if extra.get("modified_after"):
+            modified["gte"] = extra["modified_after"].isoformat()
+        if extra.get("modified_before"):
+            modified["lte"] = extra["modified_before"].isoformat()
+        if modified:
+            filters.append({
+                "range": {
+                    "file.last_modified": modified
+                }
+            })
+
+        acl = extra.get("acl")
+        if acl is not None:
+            should = [
+                {"prefix": {"external.section_path.keyword": path}}
+                for path in acl["section_paths"]
+            ]
+            should.append({"term": {"external.user_id": acl["user_id"]}})
+            if acl["group_ids"]:
+                should.append({"terms": {"external.group_id": acl["group_ids"]}})
+            filters.append({
+                "bool": {
+                    "should": should,
+                    "minimum_should_match": 1
+                }
+            })
+
         body = {
             "query": {
-                "query_string": {
-                    "query": content
+                "bool": {
+                    "must": {
+                        "query_string": {
+                            "query": content
+                        }
+                    },
+                    "filter": filters
                 }
             }
         }
-        res = self.session.get(url, data=json.dumps(body), headers=headers)
+        # Paginacion: sin "size" Elasticsearch devuelve solo 10 resultados
+        if "from" in extra:
+            body["from"] = extra["from"]
+        if "size" in extra:
+            body["size"] = extra["size"]
+        if "source" in extra:
+            body["_source"] = extra["source"]
+        if extra.get("highlight"):
+            body["highlight"] = {
+                # Escapa el texto del documento, el fragmento se muestra como html
+                "encoder": "html",
+                "pre_tags": ["<mark>"],
+                "post_tags": ["</mark>"],
+                "fields": {
+                    "content": {
+                        "fragment_size": settings.SEARCH_HIGHLIGHT_SIZE,
+                        "number_of_fragments": 1
+                    }
+                }
+            }
+        return body
+
+    def search_by_content(self, *, index: str, content: str, extra: dict):
+        """
+        Lanza requests.RequestException si Elasticsearch no responde o
+        responde con error.
+        """
+        assert index and content
+        resource = "{index_name}/_search".format(index_name=index)
+        headers = { "Content-Type": "application/json" }
+        body = self.search_body(content=content, extra=extra)
+        res = self.transport.request("GET", resource, data=json.dumps(body), headers=headers)
+        res.raise_for_status()
         return json.loads(res.content)
 
+    async def asearch_by_content(self, *, index: str, content: str, extra: dict):
+        """
+        Igual que search_by_content, sin bloquear el event loop.
+        """
+        assert index and content
+        resource = "{index_name}/_search".format(index_name=index)
+        headers = { "Content-Type": "application/json" }
+        body = self.search_body(content=content, extra=extra)
+        res = await self.atransport.request("GET", resource, content=json.dumps(body), headers=headers)
+        self.atransport.raise_for_status(res)
+        return res.json()
+
     def delete_document(self, *, index: str, doc_id: str):
         assert index
         if not doc_id:
             return
         try:
             resource = "{index_name}/_doc/{doc_id}".format(index_name=index, doc_id=doc_id)
-            url = "{url}/{resource}".format(url=self.url, resource=resource)
-            r = self.session.delete(url)
+            r = self.transport.request("DELETE", resource)
             res = json.loads(r.content)
             if res["result"] == "not_found":
                 err_str = "Doc ID:{id} not found in elasticsearch"
@@ -73,15 +187,30 @@ class ElasticSearchService:
             self.logger.warning("Elasticsearch service might not be available.")
             self.logger.warning(exc.strerror)
 
-elastic_service = ElasticSearchService()
+    def update_document(self, *, index: str, doc_id: str, doc: dict):
+        """
+        Actualizacion parcial: reemplaza los campos de 'doc' sin volver a
+        indexar el contenido. Lanza requests.RequestException si falla.
+        """
+        assert index and doc_id
+        resource = "{index_name}/_update/{doc_id}".format(index_name=index, doc_id=doc_id)
+        res = self.transport.request("POST", resource, json={"doc": doc})
+        res.raise_for_status()
 
 class FsCrawlerService:
     def __init__(self):
         logger = logging.getLogger(self.__class__.__name__)
-        session = requests.Session()
+        transport = Transport(
+            "fscrawler",
+            base_url=settings.FSCRAWLER_URL,
+            pool_size=settings.FSCRAWLER_POOL_SIZE,
+            connect_timeout=settings.FSCRAWLER_CONNECT_TIMEOUT,
+            # El OCR de archivos grandes puede tardar minutos
+            read_timeout=settings.FSCRAWLER_READ_TIMEOUT
+        )
+        session = transport.session
         # setup CA/Cert
         # session.verify = "ca/cert/path"
-        session.trust_env = False # False - no proxy; True - use proxy
         api_key = settings.FSCRAWLER_KEY
         if api_key:
             logger.info("API KEY found, using Bearer header")
@@ -92,42 +221,62 @@ class FsCrawlerService:
             session.auth = ("", "")
 
         self.logger = logger
-        self.session = session
+        self.transport = transport
         self.url = settings.FSCRAWLER_URL
 
+    @property
+    def degraded(self) -> bool:
+        return self.transport.degraded
+
     def test_service(self) -> Dict:
         try:
-            res = self.session.get(self.url)
+            res = self.transport.request("GET", "")
             return json.loads(res.content)
         except requests.RequestException as re: 
             self.logger.error(re.strerror)
             raise 
 
+    def multipart_body(self, *, file: File, tags: dict | None = None) -> MultipartEncoder:
+        """
+        El archivo se envia por partes desde donde este guardado
+        (MEDIA_ROOT o el archivo temporal de la subida), sin leerlo
+        completo en memoria.
+        """
+        body = MultipartEncoder()
+        file.seek(0)
+        body.add_file("file", os.path.basename(str(file.name)), file)
+        if tags:
+            body.add_bytes(
+                "tags",
+                "tags.json",
+                json.dumps(tags).encode("utf-8"),
+                "application/json"
+            )
+        return body
+
+    def post_multipart(self, resource: str, body: MultipartEncoder) -> requests.Response:
+        headers = {"Content-Type": body.content_type}
+        return self.transport.request("POST", resource, data=body, headers=headers)
+
     def test_upload_file(self, *, file: File) -> Dict:
-        url = "{}/{}".format(self.url, "_document?debug=true&simulate=true&id=_auto_")
-        filemap = {
-            "file": file.file
-        }
-        res = self.session.post(url, files=filemap)
+        resource = "_document?debug=true&simulate=true&id=_auto_"
+        res = self.post_multipart(resource, self.multipart_body(file=file))
         return json.loads(res.content)
 
-    def __upload_file(self, *, file: File) -> Dict:
+    def __upload_file(self, *, file: File, tags: dict | None = None) -> Dict:
         """
         Carga un archivo a elasticsearch utilizando el servicio de FsCrawler 
         para usar el OCR de Tika.
+        Los tags son campos extra que FsCrawler agrega al documento indexado.
         """
         assert file
-        url = "{}/{}".format(self.url, "_document?id=_auto_")
-        filemap = {
-            "file": file.file
-        }
-        res = self.session.post(url, files=filemap)
+        res = self.post_multipart("_document?id=_auto_", self.multipart_body(file=file, tags=tags))
         return json.loads(res.content)
 
-    def upload_file(self, *, file: File) -> str:
+    def upload_file(self, *, file: File, tags: dict | None = None) -> str:
         assert file
         try:
-            fsc_res = self.__upload_file(file=file)
+            fsc_res = self.__upload_file(file=file, tags=tags)
             if not fsc_res.get("ok"):
                 err = "Couldn't upload {doc} document to Elasticsearch through FsCrawler"
                 err.format(doc=file.name)
@@ -141,4 +290,75 @@ class FsCrawlerService:
             self.logger.warning(err.strerror)
             return ""
 
-fscrawler_service = FsCrawlerService()
+
+class ServiceRegistry:
+    """
+    Crea cada servicio recien al primer uso, asi importar este modulo (y
+    las vistas) no arma sesiones HTTP ni lee su configuracion. Con
+    USE_FAKE_SERVICES se usan los servicios en memoria de core/fakes.py,
+    y override permite reemplazar uno en las pruebas.
+    """
+
+    def __init__(self):
+        self.factories: dict[str, Callable[[], Any]] = {}
+        self.fake_factories: dict[str, Callable[[], Any]] = {}
+        self.instances: dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], *, fake: Callable[[], Any]):
+        self.factories[name] = factory
+        self.fake_factories[name] = fake
+
+    def get(self, name: str) -> Any:
+        instance = self.instances.get(name)
+        if instance is None:
+            with self.lock:
+                instance = self.instances.get(name)
+                if instance is None:
+                    factories = self.fake_factories if settings.USE_FAKE_SERVICES else self.factories
+                    instance = factories[name]()
+                    self.instances[name] = instance
+        return instance
+
+    @contextmanager
+    def override(self, name: str, instance: Any) -> Iterator[Any]:
+        previous = self.instances.get(name)
+        self.instances[name] = instance
+        try:
+            yield instance
+        finally:
+            if previous is None:
+                self.instances.pop(name, None)
+            else:
+                self.instances[name] = previous
+
+    def reset(self):
+        self.instances.clear()
+
+
+class LazyService:
+    """
+    Referencia a un servicio del registro. Se importa como antes
+    (from .service import elastic_service) y cada atributo se resuelve
+    contra la instancia actual.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(registry.get(self._name), attr)
+
+
+def fake(path: str) -> Callable[[], Any]:
+    def factory():
+        return import_string(path)()
+    return factory
+
+
+registry = ServiceRegistry()
+registry.register("elasticsearch", ElasticSearchService, fake=fake("core.fakes.FakeElasticSearchService"))
+registry.register("fscrawler", FsCrawlerService, fake=fake("core.fakes.FakeFsCrawlerService"))
+
+elastic_service = cast(ElasticSearchService, LazyService("elasticsearch"))
+fscrawler_service = cast(FsCrawlerService, LazyService("fscrawler"))
@@ -0,0 +1,147 @@
+"""
+Invalidacion de las caches que dependen de los permisos, de los grupos
+y del contenido de cada subarbol de secciones.
+Tambien actualiza los permisos indexados con los documentos de
+Elasticsearch (ver ArchiveQuerySet.grantee_tags), libera los blobs de
+los archivos borrados (incluso en cascada al borrar una seccion) y
+completa los caminos de las secciones luego de migrate.
+"""
+from functools import partial
+
+from django.contrib.auth.models import Group
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .blobs import release_blob, sync_grantees
+from .caching import bump_versions
+from .models import (
+    Archive,
+    GroupArchivePermission,
+    GroupSectionPermission,
+    PermissionHolder,
+    Section,
+    User,
+    UserArchivePermission,
+    UserSectionPermission,
+)
+
+SECTION_PERMISSION_MODELS = (UserSectionPermission, GroupSectionPermission)
+ARCHIVE_PERMISSION_MODELS = (UserArchivePermission, GroupArchivePermission)
+
+
+def bump_permission_rows(model, rows):
+    if model in SECTION_PERMISSION_MODELS:
+        names = {PermissionHolder.permission_version("section", r.section_id) for r in rows}
+    else:
+        archive_ids = {r.archive_id for r in rows}
+        names = {PermissionHolder.permission_version("archive", i) for i in archive_ids}
+        # Los documentos indexan los permisos directos de sus archivos
+        transaction.on_commit(partial(sync_grantees, archive_ids))
+    bump_versions(*names, PermissionHolder.acl_version())
+
+
+def bump_memberships(user_ids):
+    names = {PermissionHolder.membership_version(uid) for uid in user_ids}
+    bump_versions(*names, PermissionHolder.acl_version())
+
+
+@receiver(post_save, sender=UserSectionPermission)
+@receiver(post_save, sender=GroupSectionPermission)
+@receiver(post_save, sender=UserArchivePermission)
+@receiver(post_save, sender=GroupArchivePermission)
+@receiver(post_delete, sender=UserSectionPermission)
+@receiver(post_delete, sender=GroupSectionPermission)
+@receiver(post_delete, sender=UserArchivePermission)
+@receiver(post_delete, sender=GroupArchivePermission)
+def permission_row_changed(sender, instance, **kwargs):
+    bump_permission_rows(sender, [instance])
+
+
+def permissions_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Cambios en el ManyToMany 'permissions' de las entidades de permisos.
+    Si reverse es verdadero, instance es un Permission y pk_set contiene
+    ids de las filas de permisos.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            bump_permission_rows(type(instance), [instance])
+        return
+    if action in ("post_add", "post_remove"):
+        bump_permission_rows(model, model.objects.filter(pk__in=pk_set))
+    elif action == "pre_clear":
+        bump_permission_rows(model, model.objects.filter(permissions=instance))
+
+
+for perm_model in SECTION_PERMISSION_MODELS + ARCHIVE_PERMISSION_MODELS:
+    m2m_changed.connect(
+        permissions_changed,
+        sender=perm_model.permissions.through,
+        dispatch_uid="permissions_changed_{}".format(perm_model.__name__)
+    )
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Altas y bajas de usuarios en grupos. Si reverse es verdadero,
+    instance es un Group y pk_set contiene ids de usuarios.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            bump_memberships([instance.pk])
+        return
+    if action in ("post_add", "post_remove"):
+        bump_memberships(pk_set)
+    elif action == "pre_clear":
+        bump_memberships(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    bump_memberships(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def section_changed(sender, instance, **kwargs):
+    # Al crearse, el camino todavia no fue guardado (ver Section.save)
+    path = instance.path or Section.build_path(instance.parent, instance.pk)[0]
+    Section.bump_subtrees(path)
+
+
+@receiver(post_save, sender=Archive)
+@receiver(post_delete, sender=Archive)
+def archive_changed(sender, instance, **kwargs):
+    if Archive.section.is_cached(instance):
+        path = instance.section.path
+    else:
+        path = Section.objects \
+            .filter(pk=instance.section_id) \
+            .values_list("path", flat=True) \
+            .first()
+    if path:
+        Section.bump_subtrees(path)
+
+
+@receiver(post_delete, sender=Archive)
+def archive_deleted(sender, instance, **kwargs):
+    if instance.blob_id:
+        # Fuera de la transaccion: puede borrar archivos y llamar a Elasticsearch
+        transaction.on_commit(partial(release_blob, instance.blob_id))
+
+
+def fill_section_paths(sender, using, verbosity=1, **kwargs):
+    """
+    Receptor de post_migrate (ver apps.py): las secciones creadas antes del
+    camino materializado tienen path vacio, y all_children/children_map lo
+    necesitan. Con todos los caminos completos solo cuesta una consulta.
+    """
+    if Section._meta.db_table not in connections[using].introspection.table_names():
+        return
+    if Section.objects.using(using).filter(path="").exists():
+        with transaction.atomic(using=using):
+            updated, total = Section.rebuild_paths()
+        if verbosity:
+            print("Filled the path of {} of {} sections".format(updated, total))
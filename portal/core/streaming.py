@@ -0,0 +1,161 @@
+"""
+Utilidades para enviar y servir archivos por partes, sin cargarlos
+completos en memoria.
+"""
+import os
+from typing import IO, Iterator
+from uuid import uuid4
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_size(fileobj: IO) -> int:
+    """
+    Tamano restante (desde la posicion actual) de un archivo abierto.
+    """
+    size = getattr(fileobj, "size", None)
+    if size is not None:
+        return size - fileobj.tell()
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, OSError):
+        pos = fileobj.tell()
+        end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(pos)
+        return end - pos
+
+
+class MultipartEncoder:
+    """
+    Cuerpo multipart/form-data que se lee por partes.
+    Los archivos se leen de a CHUNK_SIZE recien al enviarse, por lo que la
+    memoria usada no depende de su tamano. Como el largo total se conoce
+    de antemano, requests envia un Content-Length en lugar de usar
+    transfer-encoding chunked.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.boundary = uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts: list[bytes | tuple[IO, int]] = []
+        self.length = len(self.closing())
+        self.chunks: Iterator[bytes] | None = None
+        self.pending = b""
+
+    @property
+    def content_type(self) -> str:
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def header(self, name: str, filename: str, content_type: str) -> bytes:
+        header = (
+            "--{boundary}\r\n"
+            "Content-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+            "Content-Type: {content_type}\r\n\r\n"
+        )
+        return header.format(
+            boundary=self.boundary,
+            name=name,
+            filename=filename.replace("\"", "%22"),
+            content_type=content_type
+        ).encode("utf-8")
+
+    def closing(self) -> bytes:
+        return "--{}--\r\n".format(self.boundary).encode("utf-8")
+
+    def add_bytes(self, name: str, filename: str, content: bytes,
+                  content_type: str = "application/octet-stream"):
+        part = self.header(name, filename, content_type) + content + b"\r\n"
+        self.parts.append(part)
+        self.length += len(part)
+
+    def add_file(self, name: str, filename: str, fileobj: IO,
+                 content_type: str = "application/octet-stream"):
+        size = file_size(fileobj)
+        header = self.header(name, filename, content_type)
+        self.parts += [header, (fileobj, size), b"\r\n"]
+        self.length += len(header) + size + 2
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            fileobj, remaining = part
+            while remaining > 0:
+                chunk = fileobj.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError("File ended before its expected size")
+                remaining -= len(chunk)
+                yield chunk
+        yield self.closing()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Interfaz de archivo usada por urllib3 para enviar el cuerpo.
+        Devuelve a lo sumo un bloque por llamada (o todo si size < 0).
+        """
+        if self.chunks is None:
+            self.chunks = iter(self)
+        if size is None or size < 0:
+            data = self.pending + b"".join(self.chunks)
+            self.pending = b""
+            return data
+        while len(self.pending) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Interpreta un header Range de un solo rango ("bytes=0-99", "bytes=100-",
+    "bytes=-100") y devuelve (inicio, largo). Devuelve None si el header no
+    se entiende o pide varios rangos, en cuyo caso se responde el archivo
+    completo (tambien si el ultimo byte es menor al primero, que para la
+    RFC 9110 es un rango invalido y no uno insatisfacible). Lanza ValueError
+    si el rango no se puede satisfacer.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first + last).isdigit():
+        return None
+    if not first:
+        # Sufijo: los ultimos N bytes
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return (size - length, length)
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    end = min(int(last), size - 1) if last else size - 1
+    return (start, end - start + 1)
+
+
+def iter_range(fileobj: IO, start: int, length: int,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Lee 'length' bytes desde 'start' de a chunk_size y cierra el archivo
+    al terminar (o si el cliente corta la descarga).
+    """
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fileobj.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
@@ -0,0 +1,18 @@
+"""
+Runner de manage.py test (TEST_RUNNER): ademas de lo habitual activa
+QUERY_BUDGET_STRICT, para que una vista que supera su query_budget haga
+fallar el test (ver core/metrics.py).
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.strict_budget = override_settings(QUERY_BUDGET_STRICT=True)
+        self.strict_budget.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.strict_budget.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1025 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.core.files import File
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
+from django.http import HttpResponse
+from django.db.models import Count
+from django.test.signals import template_rendered
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import ResolverMatch, reverse
+
+from core import indexing
+from core.blobs import index_tags
+from core.fake_server import FakeBackends, search_extra
+from core.models import (
+    Archive,
+    ArchiveNameTrigram,
+    Blob,
+    GroupArchivePermission,
+    GroupSectionPermission,
+    IndexingJob,
+    IndexStatus,
+    Section,
+    User,
+    UserArchivePermission,
+    UserSectionPermission,
+)
+from core.metrics import MetricsMiddleware, QueryBudgetExceeded, current_metrics, record_http, view_metrics
+from core.preview import read_window
+from core.search import CachedPage
+from core.fakes import FakeElasticSearchService, FakeFsCrawlerService
+from core.service import ElasticSearchService, FsCrawlerService, ServiceRegistry, elastic_service, registry
+from core.streaming import MultipartEncoder, iter_range, parse_range
+from core.transport import AsyncTransport, CircuitOpenError, Transport
+from core.utils import normalize_name, trigrams
+from core.views import AsyncArchiveView, AsyncSearchArchiveListView
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Servidor HTTP minimo para probar los servicios sin Elasticsearch ni
+    FsCrawler. Consume el cuerpo por partes y responde como FsCrawler.
+    """
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        received = 0
+        first = b""
+        while received < length:
+            chunk = self.rfile.read(min(1024 * 1024, length - received))
+            if not chunk:
+                break
+            if not first:
+                first = chunk
+            received += len(chunk)
+        self.server.requests.append({
+            "path": self.path,
+            "length": length,
+            "received": received,
+            "content_type": self.headers["Content-Type"],
+            "start": first[:512],
+        })
+        body = json.dumps({"ok": True, "url": "http://stub/idx/_doc/stub-id"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServerTestCase(SimpleTestCase):
+    handler = StubHandler
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), cls.handler)
+        cls.server.requests = []
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+
+
+def grant(row, *codenames):
+    row.permissions.set(Permission.objects.filter(codename__in=codenames))
+    return row
+
+
+def make_archive(section: Section, fullname: str, **fields) -> Archive:
+    """
+    Archivo sin contenido, con el nombre normalizado y sus trigramas como
+    los deja create_child_archive.
+    """
+    name, extension = os.path.splitext(fullname)
+    arch = Archive.objects.create(
+        section=section,
+        fullname=fullname,
+        name=name,
+        extension=extension,
+        file=fullname,
+        search_name=normalize_name(fullname),
+        **fields
+    )
+    ArchiveNameTrigram.objects.bulk_create(ArchiveNameTrigram.build([arch]))
+    return arch
+
+
+class CacheTestCase(TestCase):
+    """
+    Las caches guardan versiones y resultados por id, y los ids se repiten
+    entre tests: se vacian antes de cada uno.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["local"].clear()
+
+
+class PermissionCacheTest(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="reader")
+        self.root = Section.objects.create(name="root")
+        self.arch = Archive.objects.create(section=self.root, fullname="a.txt", name="a", file="a.txt")
+
+    def test_grants_are_cached_until_they_change(self):
+        row = grant(UserArchivePermission.objects.create(user=self.user, archive=self.arch), "view_archive")
+        self.assertTrue(self.arch.find_permission(self.user, "view_archive"))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.arch.find_permission(self.user, "view_archive"))
+        row.permissions.clear()
+        self.assertFalse(self.arch.find_permission(self.user, "view_archive"))
+        grant(row, "view_archive")
+        row.delete()
+        self.assertFalse(self.arch.find_permission(self.user, "view_archive"))
+
+    def test_group_membership_changes(self):
+        group = Group.objects.create(name="readers")
+        grant(GroupArchivePermission.objects.create(group=group, archive=self.arch), "view_archive")
+        self.assertFalse(self.arch.find_permission(self.user, "view_archive"))
+        self.user.groups.add(group)
+        self.assertTrue(self.arch.find_permission(self.user, "view_archive"))
+        group.user_set.remove(self.user)
+        self.assertFalse(self.arch.find_permission(self.user, "view_archive"))
+
+
+class InheritedPermissionTest(CacheTestCase):
+    """
+    find_permission (un objeto) y permitted (masivo) aplican la misma regla.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="reader")
+        self.group = Group.objects.create(name="readers")
+        self.user.groups.add(self.group)
+        self.root = Section.objects.create(name="root")
+        self.child = Section.objects.create(name="child", parent=self.root)
+        self.leaf = Section.objects.create(name="leaf", parent=self.child)
+        self.other = Section.objects.create(name="other")
+        self.arch = Archive.objects.create(section=self.leaf, fullname="a.txt", name="a", file="a.txt")
+        self.grant = grant(
+            GroupSectionPermission.objects.create(group=self.group, section=self.root),
+            "view_archive"
+        )
+
+    def assertPermitted(self, expected: bool):
+        arch = Archive.objects.select_related("section").get(pk=self.arch.pk)
+        self.assertEqual(arch.find_permission(self.user, "view_archive"), expected)
+        permitted = Archive.permitted_ids(self.user, "view_archive", [arch.pk])
+        self.assertEqual(arch.pk in permitted, expected)
+
+    def test_grant_on_an_ancestor_section(self):
+        self.assertPermitted(True)
+
+    def test_moving_out_of_the_granted_subtree(self):
+        self.assertPermitted(True)
+        child = Section.objects.get(pk=self.child.pk)
+        child.parent = self.other
+        child.save()
+        self.assertPermitted(False)
+
+    def test_revoking_the_ancestor_grant(self):
+        self.assertPermitted(True)
+        self.grant.permissions.clear()
+        self.assertPermitted(False)
+
+
+class PermittedSearchTest(CacheTestCase):
+    """
+    La busqueda filtra por view_archive en SQL: permisos propios del
+    archivo y permisos heredados de una seccion ancestro.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.root = Section.objects.create(name="root")
+        self.user = User.objects.create(username="reader", main_section=self.root)
+        granted = Section.objects.create(name="granted", parent=self.root)
+        leaf = Section.objects.create(name="leaf", parent=granted)
+        hidden = Section.objects.create(name="hidden", parent=self.root)
+        grant(UserSectionPermission.objects.create(user=self.user, section=granted), "view_archive")
+        self.direct = make_archive(hidden, "report direct.pdf")
+        grant(UserArchivePermission.objects.create(user=self.user, archive=self.direct), "view_archive")
+        self.inherited = make_archive(leaf, "report inherited.pdf")
+        self.denied = make_archive(hidden, "report denied.pdf")
+        self.client.force_login(self.user)
+
+    def test_permitted_queryset(self):
+        found = Archive.objects.permitted(self.user, "view_archive").matching_name("report")
+        self.assertEqual(set(found), {self.direct, self.inherited})
+
+    def test_search_by_name(self):
+        response = self.client.get(reverse("core:search-list"), {"name": "report"})
+        self.assertEqual(response.status_code, 200)
+        found = {arch.pk for arch in response.context["object_list"]}
+        self.assertEqual(found, {self.direct.pk, self.inherited.pk})
+
+
+class AsyncContentSearchTest(CacheTestCase):
+    """
+    La busqueda async filtra los permisos en Elasticsearch y pagina y
+    guarda en cache como SearchArchiveListView.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeElasticSearchService()
+        self.enterContext(registry.override("elasticsearch", self.fake))
+        root = Section.objects.create(name="root")
+        self.user = User.objects.create(username="reader", main_section=root)
+        granted = Section.objects.create(name="granted", parent=root)
+        hidden = Section.objects.create(name="hidden", parent=root)
+        grant(UserSectionPermission.objects.create(user=self.user, section=granted), "view_archive")
+        self.visible = [self.indexed(granted, "budget {:02}.pdf".format(i)) for i in range(12)]
+        self.direct = self.indexed(hidden, "budget direct.txt")
+        # El permiso directo se agrega al documento ya indexado
+        with self.captureOnCommitCallbacks(execute=True):
+            grant(UserArchivePermission.objects.create(user=self.user, archive=self.direct), "view_archive")
+        self.denied = self.indexed(hidden, "budget denied.pdf")
+
+    def indexed(self, section: Section, fullname: str) -> Archive:
+        doc_id = self.fake.index_document(
+            content="annual budget",
+            tags={"external": {"section_id": [section.pk], "section_path": [section.path]}},
+            extension=os.path.splitext(fullname)[1]
+        )
+        return make_archive(section, fullname, uuid=doc_id)
+
+    def search(self, **params) -> tuple[set[int], int]:
+        request = RequestFactory().get(reverse("core:search-list"), {"name": "budget", "by_content": "on", **params})
+
+        async def auser():
+            return self.user
+
+        request.user = self.user
+        request.auser = auser
+        contexts = []
+        template_rendered.connect(
+            lambda sender, context, **kwargs: contexts.append(context),
+            dispatch_uid="async-search-test",
+            weak=False
+        )
+        try:
+            response = async_to_sync(AsyncSearchArchiveListView.as_view())(request)
+        finally:
+            template_rendered.disconnect(dispatch_uid="async-search-test")
+        self.assertEqual(response.status_code, 200)
+        ctx = contexts[0]
+        # Las paginas en cache tienen dicts en lugar de Archive (CachedPage)
+        ids = {obj["id"] if isinstance(obj, dict) else obj.id for obj in ctx["object_list"]}
+        return ids, ctx["page_obj"].paginator.count
+
+    def test_permissions_filters_and_pages(self):
+        first, total = self.search()
+        second, _ = self.search(page=2)
+        self.assertEqual(total, 13)
+        self.assertEqual(first | second, {arch.pk for arch in self.visible + [self.direct]})
+        self.assertEqual(len(first), 10)
+        pdfs, total = self.search(extension=".pdf")
+        self.assertEqual(total, 12)
+        self.assertEqual(pdfs, {arch.pk for arch in self.visible[:10]})
+
+    def test_revoked_grants_are_removed_from_the_document(self):
+        self.assertEqual(self.fake.documents[self.direct.uuid]["external"]["user_id"], [self.user.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            UserArchivePermission.objects.filter(archive=self.direct).delete()
+        self.assertEqual(self.fake.documents[self.direct.uuid]["external"]["user_id"], [])
+        found, total = self.search()
+        self.assertEqual(total, 12)
+        self.assertNotIn(self.direct.pk, found)
+
+    def test_pages_are_cached(self):
+        first, _ = self.search()
+        self.fake.documents.clear()
+        self.assertEqual(self.search(), (first, 13))
+
+
+class AsyncArchiveViewTest(CacheTestCase):
+    def test_content_is_not_read_without_permission(self):
+        user = User.objects.create(username="reader")
+        # Sin archivo en el storage: leerlo fallaria
+        arch = make_archive(Section.objects.create(name="root"), "missing.txt")
+        request = RequestFactory().get(reverse("core:archive", args=[arch.pk]))
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        response = async_to_sync(AsyncArchiveView.as_view())(request, archive_id=arch.pk)
+        self.assertEqual(response.status_code, 401)
+
+
+class AutocompleteTest(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = Section.objects.create(name="root")
+        self.user = User.objects.create(username="reader", main_section=self.root)
+        granted = Section.objects.create(name="granted", parent=self.root)
+        grant(UserSectionPermission.objects.create(user=self.user, section=granted), "view_archive")
+        self.visible = make_archive(granted, "report visible.pdf")
+        self.hidden = make_archive(self.root, "report hidden.pdf")
+        self.client.force_login(self.user)
+
+    def suggestions(self) -> set[int]:
+        response = self.client.get(reverse("core:search_autocomplete"), {"name": "rep"})
+        self.assertEqual(response.status_code, 200)
+        return {row["id"] for row in response.context["object_list"]}
+
+    def test_only_permitted_archives(self):
+        self.assertEqual(self.suggestions(), {self.visible.pk})
+        grant(UserArchivePermission.objects.create(user=self.user, archive=self.hidden), "view_archive")
+        self.assertEqual(self.suggestions(), {self.visible.pk, self.hidden.pk})
+
+    def test_new_archives_are_suggested(self):
+        self.assertEqual(self.suggestions(), {self.visible.pk})
+        added = make_archive(Section.objects.get(name="granted"), "report added.pdf")
+        self.assertEqual(self.suggestions(), {self.visible.pk, added.pk})
+
+
+class ArchiveIndexStatusTest(CacheTestCase):
+    def test_requires_view_archive(self):
+        user = User.objects.create(username="reader")
+        arch = make_archive(Section.objects.create(name="root"), "a.txt")
+        url = reverse("core:archive_status", args=[arch.pk])
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 401)
+        grant(UserArchivePermission.objects.create(user=user, archive=arch), "view_archive")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class NameSearchTest(TestCase):
+    def setUp(self):
+        self.root = Section.objects.create(name="root")
+        self.names = ["Informe Anual.pdf", "informe.pdf", "Otro informe.pdf", "Presupuesto Año 2024.xlsx"]
+        for fullname in self.names:
+            make_archive(self.root, fullname)
+
+    def search(self, term: str) -> list[str]:
+        return list(Archive.objects.matching_name(term).values_list("fullname", flat=True))
+
+    def test_ranking_and_normalization(self):
+        self.assertEqual(self.search("INFORME.PDF"), ["informe.pdf", "Otro informe.pdf"])
+        self.assertEqual(self.search("inform"), ["informe.pdf", "Informe Anual.pdf", "Otro informe.pdf"])
+        self.assertEqual(self.search("ano 20"), ["Presupuesto Año 2024.xlsx"])
+        self.assertEqual(self.search("nual"), ["Informe Anual.pdf"])
+        self.assertEqual(self.search("zz"), [])
+
+    def test_rebuild_name_index(self):
+        old = Archive.objects.create(section=self.root, fullname="Acta.doc", name="Acta", file="Acta.doc")
+        self.assertEqual(self.search("acta"), [])
+        call_command("rebuild_name_index", batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.search("acta"), ["Acta.doc"])
+        self.assertEqual(old.name_trigrams.count(), len(trigrams("acta.doc")))
+        self.assertEqual(len(self.search("informe")), 3)
+
+
+class BlobRefcountTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.fake = FakeElasticSearchService()
+        self.enterContext(registry.override("elasticsearch", self.fake))
+        self.user = User.objects.create(username="uploader")
+        root = Section.objects.create(name="root")
+        self.first = Section.objects.create(name="first", parent=root)
+        self.second = Section.objects.create(name="second", parent=root)
+
+    def upload(self, section: Section, name: str, content: bytes) -> Archive:
+        return section.create_child_archive(
+            file=ContentFile(content, name=name),
+            user=self.user,
+            perms=["view_archive"],
+            fields={}
+        )
+
+    def test_shared_content_is_released_with_the_last_archive(self):
+        first = self.upload(self.first, "a.txt", b"same content")
+        second = self.upload(self.second, "b.txt", b"same content")
+        self.upload(self.second, "c.txt", b"other content")
+        blob = Blob.objects.get(pk=first.blob_id)
+        self.assertEqual(second.blob_id, blob.pk)
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(Blob.objects.count(), 2)
+
+        doc_id = self.fake.index_document(content="same content", tags=index_tags(blob))
+        Blob.objects.filter(pk=blob.pk).update(uuid=doc_id)
+        self.assertEqual(self.fake.documents[doc_id]["external"]["section_id"], [self.first.pk, self.second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+        self.assertEqual(self.fake.documents[doc_id]["external"]["section_id"], [self.second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+        self.assertNotIn(doc_id, self.fake.documents)
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+
+class ArchiveFileTest(CacheTestCase):
+    def test_accel_redirect_quotes_the_name(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, FILE_ACCEL_REDIRECT="/protected/"))
+        name = default_storage.save("uploads/informe año #1.pdf", ContentFile(b"%PDF"))
+        user = User.objects.create(username="reader")
+        arch = make_archive(Section.objects.create(name="root"), "informe año #1.pdf")
+        Archive.objects.filter(pk=arch.pk).update(file=name)
+        grant(UserArchivePermission.objects.create(user=user, archive=arch), "view_archive")
+        self.client.force_login(user)
+        response = self.client.get(reverse("core:archive_file", args=[arch.pk]))
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/uploads/informe%20a%C3%B1o%20%231.pdf")
+
+    def test_invalid_range_serves_the_whole_file(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, FILE_ACCEL_REDIRECT=""))
+        name = default_storage.save("uploads/notes.txt", ContentFile(b"hello world"))
+        user = User.objects.create(username="reader")
+        arch = make_archive(Section.objects.create(name="root"), "notes.txt")
+        Archive.objects.filter(pk=arch.pk).update(file=name)
+        grant(UserArchivePermission.objects.create(user=user, archive=arch), "view_archive")
+        self.client.force_login(user)
+        url = reverse("core:archive_file", args=[arch.pk])
+        response = self.client.get(url, headers={"Range": "bytes=5-1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"hello world")
+        response = self.client.get(url, headers={"Range": "bytes=11-"})
+        self.assertEqual(response.status_code, 416)
+
+
+class IndexedSearchTest(TransactionTestCase):
+    """
+    Un archivo recien indexado aparece en las busquedas aunque la pagina
+    ya estuviera en cache. El worker de indexado usa sus propias conexiones.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["local"].clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        fake = FakeElasticSearchService()
+        self.enterContext(registry.override("elasticsearch", fake))
+        self.enterContext(registry.override("fscrawler", FakeFsCrawlerService()))
+        self.root = Section.objects.create(name="root")
+        self.user = User.objects.create(username="reader", main_section=self.root)
+        grant(UserSectionPermission.objects.create(user=self.user, section=self.root), "view_archive")
+        self.client.force_login(self.user)
+
+    def search(self) -> set[int]:
+        response = self.client.get(reverse("core:search-list"), {"name": "budget", "by_content": "on"})
+        return {obj["id"] if isinstance(obj, dict) else obj.id for obj in response.context["object_list"]}
+
+    def test_new_archive_appears_after_indexing(self):
+        arch = self.root.create_child_archive(
+            file=ContentFile(b"annual budget", name="budget.txt"),
+            user=self.user,
+            perms=["view_archive"],
+            fields={"index_status": IndexStatus.PENDING}
+        )
+        indexing.enqueue(arch)
+        self.assertEqual(self.search(), set())
+        indexing.run_worker(workers=1, batch_size=10, poll_interval=0, drain=True)
+        self.assertEqual(self.search(), {arch.pk})
+
+
+class QueryBudgetTest(CacheTestCase):
+    """
+    Los query_budget alcanzan con la cache vacia (QUERY_BUDGET_STRICT
+    esta activo en los tests, ver core/test_runner.py).
+    """
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.root = Section.objects.create(name="root")
+        self.user = User.objects.create(username="reader", main_section=self.root)
+        group = Group.objects.create(name="readers")
+        self.user.groups.add(group)
+        child = Section.objects.create(name="child", parent=self.root)
+        grant(GroupSectionPermission.objects.create(group=group, section=self.root), "view_section", "view_archive")
+        self.arch = child.create_child_archive(
+            file=ContentFile(b"line\n" * 10000, name="notes.txt"),
+            user=self.user,
+            perms=["delete_archive"],
+            fields={}
+        )
+        self.client.force_login(self.user)
+
+    def get(self, url: str):
+        caches["default"].clear()
+        caches["local"].clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cold_cache(self):
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+        self.get(reverse("core:section_children", args=[self.root.pk]))
+        self.get(reverse("core:archive", args=[self.arch.pk]))
+        self.get(reverse("core:archive_preview", args=[self.arch.pk]) + "?offset=5")
+        self.get(reverse("core:references", args=[self.arch.pk]))
+        caches["default"].clear()
+        caches["local"].clear()
+        response = self.client.delete(reverse("core:archive", args=[self.arch.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Archive.objects.filter(pk=self.arch.pk).exists())
+
+
+class ImportTreeTest(TransactionTestCase):
+    """
+    Los hilos de import_tree usan sus propias conexiones, por eso no
+    corre dentro de una transaccion.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(source.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.source = source.name
+        os.mkdir(os.path.join(self.source, "docs"))
+        for name, content in [("a.txt", "same"), ("b.txt", "same"), ("docs/c.txt", "other")]:
+            with open(os.path.join(self.source, name), "w") as f:
+                f.write(content)
+        self.root = Section.objects.create(name="root")
+        User.objects.create(username="importer")
+
+    def run_import(self):
+        call_command(
+            "import_tree", self.source, section=self.root.pk, user="importer",
+            workers=2, stdout=io.StringIO()
+        )
+
+    def assertRefcounts(self):
+        for blob in Blob.objects.annotate(n=Count("archives")):
+            self.assertEqual(blob.refcount, blob.n)
+
+    def test_interrupted_import_is_resumed(self):
+        with mock.patch.object(IndexingJob.objects, "bulk_create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.run_import()
+        self.assertFalse(Archive.objects.exists())
+        self.assertRefcounts()
+
+        self.run_import()
+        self.run_import()
+        self.assertEqual(Archive.objects.count(), 3)
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertRefcounts()
+
+
+class TreeFragmentCacheTest(CacheTestCase):
+    """
+    section_item.html guarda cada seccion renderizada hasta que cambia
+    su subarbol (Section.subtree_version).
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.root = Section.objects.create(name="root")
+        self.child = Section.objects.create(name="child", parent=self.root)
+        self.leaf = Section.objects.create(name="leaf", parent=self.child)
+        self.arch = make_archive(self.child, "pending.txt", index_status=IndexStatus.PENDING)
+        user = User.objects.create(username="reader", main_section=self.root)
+        self.client.force_login(user)
+
+    def tree(self) -> str:
+        url = reverse("core:section_children", args=[self.root.pk])
+        response = self.client.get(url, {"depth": 2})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_fragments_are_cached_until_the_subtree_changes(self):
+        self.assertIn("leaf", self.tree())
+        # Sin las senales el fragmento en cache no cambia
+        Section.objects.filter(pk=self.leaf.pk).update(name="renamed")
+        self.assertNotIn("renamed", self.tree())
+        Section.bump_subtrees(self.leaf.path)
+        self.assertIn("renamed", self.tree())
+
+    def test_changes_below_a_section_are_shown(self):
+        self.assertIn("Indexing archive", self.tree())
+        Archive.objects.filter(pk=self.arch.pk).update(index_status=IndexStatus.INDEXED)
+        Section.bump_subtrees(self.child.path)
+        self.assertNotIn("Indexing archive", self.tree())
+
+        make_archive(self.child, "added.txt")
+        Section.objects.create(name="sibling", parent=self.child)
+        leaf = Section.objects.get(pk=self.leaf.pk)
+        leaf.name = "saved"
+        leaf.save()
+        tree = self.tree()
+        for name in ["added.txt", "sibling", "saved"]:
+            self.assertIn(name, tree)
+
+
+class SectionPathTest(TestCase):
+    def test_parent_change_rewrites_the_subtree(self):
+        root = Section.objects.create(name="root")
+        a = Section.objects.create(name="a", parent=root)
+        b = Section.objects.create(name="b", parent=a)
+        other = Section.objects.create(name="other", parent=root)
+
+        a = Section.objects.get(pk=a.pk)
+        a.parent = other
+        a.save()
+        b.refresh_from_db()
+        self.assertEqual(b.path, "/{}/{}/{}/{}/".format(root.pk, other.pk, a.pk, b.pk))
+        self.assertEqual(b.depth, 3)
+
+        root.refresh_from_db()
+        root.parent = b
+        with self.assertRaises(ValueError):
+            root.save()
+
+    def test_path_length_limits_the_depth(self):
+        parent = Section.objects.create(name="root")
+        parent.path = "/1" * 379 + "/"
+        with self.assertRaises(ValueError):
+            Section.objects.create(name="deep", parent=parent)
+        self.assertFalse(Section.objects.filter(name="deep").exists())
+
+
+class MultipartEncoderTest(SimpleTestCase):
+    def test_body_matches_declared_length(self):
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(b"hello world")
+            tmp.seek(0)
+            body = MultipartEncoder(chunk_size=4)
+            body.add_file("file", "a.txt", tmp)
+            body.add_bytes("tags", "tags.json", b"{}", "application/json")
+            data = b""
+            while chunk := body.read(3):
+                data += chunk
+
+        self.assertEqual(len(data), len(body))
+        self.assertIn(b"\r\n\r\nhello world\r\n", data)
+        self.assertIn(b"name=\"tags\"; filename=\"tags.json\"", data)
+        self.assertTrue(data.endswith("--{}--\r\n".format(body.boundary).encode()))
+
+
+class RangeTest(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-4", 11), (0, 5))
+        self.assertEqual(parse_range("bytes=6-", 11), (6, 5))
+        self.assertEqual(parse_range("bytes=-5", 11), (6, 5))
+        self.assertEqual(parse_range("bytes=8-100", 11), (8, 3))
+        # Varios rangos o unidades desconocidas: se envia el archivo completo
+        self.assertIsNone(parse_range("bytes=0-1,3-4", 11))
+        self.assertIsNone(parse_range("items=0-4", 11))
+        self.assertIsNone(parse_range("bytes=a-b", 11))
+        # Ultimo byte menor al primero: rango invalido, no insatisfacible
+        self.assertIsNone(parse_range("bytes=5-1", 11))
+        self.assertIsNone(parse_range("bytes=500-100", 11))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=11-", 11)
+        with self.assertRaises(ValueError):
+            parse_range("bytes=-0", 11)
+
+    def test_iter_range_closes_file(self):
+        tmp = tempfile.TemporaryFile()
+        tmp.write(b"hello world")
+        data = b"".join(iter_range(tmp, 6, 5, chunk_size=2))
+        self.assertEqual(data, b"world")
+        self.assertTrue(tmp.closed)
+
+
+class PreviewWindowTest(SimpleTestCase):
+    def read_all(self, data: bytes, size: int) -> tuple[str, str]:
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(data)
+            offset, encoding, parts = 0, None, []
+            while offset is not None:
+                window = read_window(tmp, offset, size, encoding)
+                parts.append(window.content)
+                offset, encoding = window.next_offset, window.encoding
+        return ("".join(parts), encoding)
+
+    def test_windows_do_not_split_characters(self):
+        text = "".join("línea {} ñandú €\n".format(i) for i in range(200))
+        for encoding in ("utf-8", "utf-16", "cp1252"):
+            content, _ = self.read_all(text.encode(encoding), 37)
+            self.assertEqual(content, text, encoding)
+
+    def test_binary_files_have_no_preview(self):
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(bytes(range(256)))
+            window = read_window(tmp, 0, 1024)
+        self.assertTrue(window.binary)
+        self.assertIsNone(window.next_offset)
+
+
+class ServiceRegistryTest(SimpleTestCase):
+    def test_services_are_created_on_first_use(self):
+        created = []
+        services = ServiceRegistry()
+        services.register("stub", lambda: created.append(1) or object(), fake=object)
+        self.assertEqual(created, [])
+        first = services.get("stub")
+        self.assertIs(services.get("stub"), first)
+        self.assertEqual(created, [1])
+
+    def test_override_with_fake(self):
+        fake = FakeElasticSearchService()
+        doc_id = fake.index_document(
+            content="Presupuesto anual",
+            tags={"external": {"section_path": ["/1/5/"]}}
+        )
+        with registry.override("elasticsearch", fake):
+            res = elastic_service.search_by_content(
+                index="idx",
+                content="presupuesto",
+                extra={"acl": {"section_paths": ["/1/"], "user_id": 1, "group_ids": []}}
+            )
+        self.assertEqual([hit["_id"] for hit in res["hits"]["hits"]], [doc_id])
+        self.assertNotIn("elasticsearch", registry.instances)
+
+    def test_fake_matches_shared_documents(self):
+        fake = FakeElasticSearchService()
+        shared = fake.index_document(content="acta", tags={"external": {"section_id": [3, 7]}})
+        single = fake.index_document(content="acta", tags={"external": {"section_id": 4}})
+        for section_ids, expected in [([7], [shared]), ([4], [single]), ([5], [])]:
+            res = fake.search_by_content(index="idx", content="acta", extra={"section_ids": section_ids})
+            self.assertEqual([hit["_id"] for hit in res["hits"]["hits"]], expected)
+
+
+class SearchBodyTest(SimpleTestCase):
+    def test_filters_and_pagination(self):
+        body = ElasticSearchService().search_body(
+            content="presupuesto",
+            extra={
+                "extension": "pdf",
+                "section_ids": [5],
+                "modified_after": date(2024, 1, 1),
+                "from": 20,
+                "size": 10,
+                "source": False,
+                "highlight": True
+            }
+        )
+        filters = body["query"]["bool"]["filter"]
+        self.assertIn({"term": {"file.extension": "pdf"}}, filters)
+        self.assertIn({"terms": {"external.section_id": [5]}}, filters)
+        self.assertIn({"range": {"file.last_modified": {"gte": "2024-01-01"}}}, filters)
+        self.assertEqual((body["from"], body["size"], body["_source"]), (20, 10, False))
+        self.assertEqual(body["highlight"]["encoder"], "html")
+
+
+    def test_acl_filter(self):
+        acl = {"section_paths": ["/1/", "/4/9/"], "user_id": 7, "group_ids": [2, 3]}
+        body = ElasticSearchService().search_body(content="presupuesto", extra={"acl": acl})
+        should = body["query"]["bool"]["filter"][0]["bool"]["should"]
+        self.assertIn({"term": {"external.user_id": 7}}, should)
+        self.assertIn({"terms": {"external.group_id": [2, 3]}}, should)
+        self.assertEqual(search_extra(body)[1]["acl"], acl)
+
+
+class CachedPageTest(SimpleTestCase):
+    def test_paginator_rebuilds_the_cached_page(self):
+        archives = [SimpleNamespace(id=i, fullname="f{}".format(i)) for i in range(25)]
+        page = Paginator(archives, 10).page(3)
+        cached = CachedPage.from_page(page)
+        again = Paginator(cached, 10).page(3)
+        self.assertEqual([obj["id"] for obj in again.object_list], list(range(20, 25)))
+        self.assertEqual(again.paginator.num_pages, 3)
+        self.assertFalse(again.has_next())
+
+
+class FakeBackendsTest(SimpleTestCase):
+    def test_services_against_fake_servers(self):
+        backends = FakeBackends()
+        backends.start()
+        self.addCleanup(backends.stop)
+        with self.settings(
+            ELASTIC_URL="http://127.0.0.1:{}".format(backends.elastic_port),
+            FSCRAWLER_URL="http://127.0.0.1:{}".format(backends.fscrawler_port),
+            ELASTIC_KEY="",
+            FSCRAWLER_KEY=""
+        ):
+            elastic, fscrawler = ElasticSearchService(), FsCrawlerService()
+
+        doc_id = fscrawler.upload_file(
+            file=ContentFile(b"Presupuesto anual", name="plan.txt"),
+            tags={"external": {"section_path": ["/1/5/"]}}
+        )
+        res = elastic.search_by_content(
+            index="idx",
+            content="presupuesto",
+            extra={"acl": {"section_paths": ["/1/"], "user_id": 1, "group_ids": []}, "extension": "txt", "source": False}
+        )
+        self.assertEqual([hit["_id"] for hit in res["hits"]["hits"]], [doc_id])
+        self.assertNotIn("_source", res["hits"]["hits"][0])
+
+        elastic.delete_document(index="idx", doc_id=doc_id)
+        self.assertEqual(backends.store.documents, {})
+
+
+class MetricsMiddlewareTest(SimpleTestCase):
+    def request(self, budget):
+        view = SimpleNamespace(query_budget=budget)
+        request = RequestFactory().get("/wiki/section")
+        request.resolver_match = ResolverMatch(view, (), {}, url_name="children",
+                                               app_names=["core"], namespaces=["core"])
+        return request
+
+    def view(self, request):
+        current_metrics.get().queries += 3
+        record_http(0.02)
+        return HttpResponse("ok")
+
+    def test_server_timing_metrics_and_budget(self):
+        view_metrics.reset()
+        middleware = MetricsMiddleware(self.view)
+        with self.settings(SERVER_TIMING=True, METRICS_ENABLED=True, QUERY_BUDGET_STRICT=False):
+            response = middleware(self.request({"GET": 2}))
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+        text = view_metrics.render()
+        self.assertIn('wiki_requests_total{view="core:children",method="GET",status="200"} 1', text)
+        self.assertIn('wiki_db_queries_total{view="core:children"} 3', text)
+        self.assertIn('wiki_external_requests_total{view="core:children"} 1', text)
+        self.assertIn('wiki_query_budget_exceeded_total{view="core:children"} 1', text)
+
+        with self.settings(QUERY_BUDGET_STRICT=True):
+            middleware(self.request(3))
+            with self.assertRaises(QueryBudgetExceeded):
+                middleware(self.request(2))
+
+    def test_async_views_count_queries_in_threads(self):
+        async def view(request):
+            return await sync_to_async(self.view)(request)
+
+        middleware = MetricsMiddleware(view)
+        with self.settings(SERVER_TIMING=True, QUERY_BUDGET_STRICT=False):
+            response = asyncio.run(middleware(self.request(None)))
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+        self.assertIn('desc="1 external calls"', response["Server-Timing"])
+
+
+class FsCrawlerUploadTest(StubServerTestCase):
+    size = 300 * 1024 * 1024
+
+    def test_large_upload_is_streamed(self):
+        with self.settings(FSCRAWLER_URL=self.url, FSCRAWLER_KEY=""):
+            service = FsCrawlerService()
+        with tempfile.NamedTemporaryFile() as tmp:
+            tmp.truncate(self.size)
+            tracemalloc.start()
+            try:
+                doc_id = service.upload_file(file=File(tmp), tags={"external": {}})
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(doc_id, "stub-id")
+        request = self.server.requests[0]
+        self.assertEqual(request["received"], request["length"])
+        self.assertGreater(request["length"], self.size)
+        self.assertTrue(request["content_type"].startswith("multipart/form-data"))
+        self.assertLess(peak, 16 * 1024 * 1024)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Responde 503 mientras queden fallas en server.failures y demora
+    server.delay segundos cada respuesta.
+    """
+    def respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        self.server.requests.append({"method": self.command, "path": self.path})
+        time.sleep(self.server.delay)
+        status = 200
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            status = 503
+        body = json.dumps({"status": status}).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except ConnectionError:
+            # El cliente corto por timeout
+            pass
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TransportTest(StubServerTestCase):
+    handler = FlakyHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.failures = 0
+        self.server.delay = 0
+
+    def transport(self, **kwargs) -> Transport:
+        options = {
+            "pool_size": 2,
+            "connect_timeout": 1,
+            "read_timeout": 1,
+            "max_retries": 2,
+            "backoff": 0.01,
+            "breaker_threshold": 3,
+            "breaker_reset_seconds": 60,
+        }
+        options.update(kwargs)
+        return Transport("stub", base_url=self.url, **options)
+
+    def test_idempotent_calls_are_retried(self):
+        self.server.failures = 2
+        res = self.transport().request("GET", "idx/_search")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_post_is_not_retried(self):
+        self.server.failures = 1
+        res = self.transport().request("POST", "_document", data=b"{}")
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_read_timeout(self):
+        self.server.delay = 0.5
+        start = time.monotonic()
+        # Con Retry, requests informa el timeout como ConnectionError
+        with self.assertRaises(requests.RequestException):
+            self.transport(max_retries=0).request("GET", "idx/_search", timeout=(1, 0.1))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_circuit_opens_and_recovers(self):
+        transport = self.transport(max_retries=0, breaker_threshold=2, breaker_reset_seconds=0.2)
+        self.server.failures = 2
+        for _ in range(2):
+            transport.request("GET", "idx/_search")
+        self.assertTrue(transport.degraded)
+
+        with self.assertRaises(CircuitOpenError):
+            transport.request("GET", "idx/_search")
+        self.assertEqual(len(self.server.requests), 2)
+
+        time.sleep(0.25)
+        res = transport.request("GET", "idx/_search")
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(transport.degraded)
+
+    def test_async_transport_shares_retries_and_breaker(self):
+        transport = self.transport(max_retries=1, breaker_threshold=1)
+        atransport = AsyncTransport(transport)
+        self.server.failures = 1
+        res = asyncio.run(atransport.request("GET", "idx/_search"))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.server.failures = 2
+        res = asyncio.run(atransport.request("GET", "idx/_search"))
+        self.assertEqual(res.status_code, 503)
+        with self.assertRaises(requests.HTTPError):
+            AsyncTransport.raise_for_status(res)
+        with self.assertRaises(CircuitOpenError):
+            transport.request("GET", "idx/_search")
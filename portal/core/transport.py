@@ -0,0 +1,277 @@
+"""
+Cliente HTTP compartido por los servicios externos (Elasticsearch y
+FsCrawler): pool de conexiones acotado, timeouts en cada llamada,
+reintentos con espera exponencial y jitter para los metodos idempotentes,
+y un circuit breaker que corta las llamadas a un servicio caido para no
+dejar a los workers esperando timeouts.
+AsyncTransport ofrece lo mismo sobre httpx para las vistas async.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import record_http
+
+if TYPE_CHECKING:
+    # httpx se importa recien al crear el primer cliente asincronico,
+    # los workers WSGI no lo cargan
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+RETRY_STATUS = (502, 503, 504)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    El servicio fallo repetidamente y no se lo llama hasta que pase
+    CIRCUIT_BREAKER_RESET_SECONDS. Hereda de RequestException para que
+    los manejos de errores existentes la traten como un servicio caido.
+    """
+
+
+class CircuitBreaker:
+    """
+    Cerrado: las llamadas pasan. Tras 'threshold' fallas seguidas se abre
+    y las llamadas fallan al instante. Cada 'reset_seconds' deja pasar una
+    llamada de prueba: si funciona se cierra, si falla sigue abierto.
+    """
+
+    def __init__(self, name: str, *, threshold: int, reset_seconds: float):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError("{} circuit is open".format(self.name))
+            # Llamada de prueba: las demas siguen fallando al instante
+            self.opened_at = now
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("{} circuit closed".format(self.name))
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return
+            if self.opened_at is None:
+                msg = "{} circuit opened after {} failures"
+                logger.warning(msg.format(self.name, self.failures))
+            self.opened_at = time.monotonic()
+
+
+class Transport:
+    """
+    Session de requests con su pool, timeouts por defecto, reintentos y
+    circuit breaker. Los parametros no indicados se toman de settings.
+    """
+
+    def __init__(self, name: str, *, base_url: str, pool_size: int,
+                 connect_timeout: float, read_timeout: float,
+                 max_retries: int | None = None,
+                 backoff: float | None = None,
+                 breaker_threshold: int | None = None,
+                 breaker_reset_seconds: float | None = None):
+        if max_retries is None:
+            max_retries = settings.HTTP_MAX_RETRIES
+        if backoff is None:
+            backoff = settings.HTTP_RETRY_BACKOFF
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            # Las fallas de lectura y los 5xx solo se reintentan en metodos
+            # idempotentes; un POST pudo haberse procesado
+            allowed_methods=IDEMPOTENT_METHODS,
+            status_forcelist=RETRY_STATUS,
+            backoff_factor=backoff,
+            backoff_jitter=backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.trust_env = False # False - no proxy; True - use proxy
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.session = session
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(
+            name,
+            threshold=breaker_threshold or settings.CIRCUIT_BREAKER_THRESHOLD,
+            reset_seconds=breaker_reset_seconds or settings.CIRCUIT_BREAKER_RESET_SECONDS,
+        )
+
+    @property
+    def degraded(self) -> bool:
+        return self.breaker.is_open
+
+    def url(self, resource: str) -> str:
+        return "{}/{}".format(self.base_url, resource.lstrip("/"))
+
+    def request(self, method: str, resource: str, *,
+                timeout: float | tuple[float, float] | None = None,
+                **kwargs) -> requests.Response:
+        """
+        Lanza CircuitOpenError sin llamar al servicio si el circuito esta
+        abierto. Los errores de conexion, timeouts y respuestas 5xx cuentan
+        como fallas del servicio; los 4xx no.
+        """
+        self.breaker.before_request()
+        start = time.perf_counter()
+        try:
+            res = self.session.request(
+                method,
+                self.url(resource),
+                timeout=timeout or self.timeout,
+                **kwargs
+            )
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        finally:
+            record_http(time.perf_counter() - start)
+        if res.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return res
+
+
+class AsyncTransport:
+    """
+    Version asincronica de Transport sobre httpx, para las vistas async.
+    Usa la configuracion, los headers de autenticacion y el circuit breaker
+    del Transport del mismo servicio. Los errores se informan con las
+    excepciones de requests, asi los manejos de errores son los mismos.
+    """
+
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        # Un AsyncClient no puede usarse desde otro event loop
+        self.clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self.transport.breaker
+
+    def client(self) -> "httpx.AsyncClient":
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            session = self.transport.session
+            connect_timeout, read_timeout = self.transport.timeout
+            headers = {}
+            if "Authorization" in session.headers:
+                headers["Authorization"] = session.headers["Authorization"]
+            client = httpx.AsyncClient(
+                base_url=self.transport.base_url,
+                headers=headers,
+                auth=session.auth,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.transport.pool_size,
+                    max_keepalive_connections=self.transport.pool_size
+                ),
+                trust_env=False,
+            )
+            self.clients[loop] = client
+        return client
+
+    def retry_delay(self, attempt: int) -> float:
+        # La misma espera que urllib3.Retry: backoff * 2^(n-1) + jitter
+        backoff = self.transport.backoff
+        return backoff * (2 ** (attempt - 1)) + random.uniform(0, backoff)
+
+    async def request(self, method: str, resource: str, *,
+                      timeout: float | tuple[float, float] | None = None,
+                      **kwargs) -> "httpx.Response":
+        import httpx
+
+        self.breaker.before_request()
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        options = {"timeout": timeout} if timeout is not None else {}
+        retries = self.transport.max_retries if method in IDEMPOTENT_METHODS else 0
+        start = time.perf_counter()
+        try:
+            return await self.send(method, resource, retries, options, kwargs)
+        finally:
+            record_http(time.perf_counter() - start)
+
+    async def send(self, method: str, resource: str, retries: int,
+                   options: dict, kwargs: dict) -> "httpx.Response":
+        import httpx
+
+        attempt = 0
+        while True:
+            try:
+                res = await self.client().request(
+                    method,
+                    "/" + resource.lstrip("/"),
+                    **options,
+                    **kwargs
+                )
+            except httpx.TransportError as exc:
+                if attempt < retries:
+                    attempt += 1
+                    await asyncio.sleep(self.retry_delay(attempt))
+                    continue
+                self.breaker.record_failure()
+                if isinstance(exc, httpx.TimeoutException):
+                    raise requests.Timeout(str(exc)) from exc
+                raise requests.ConnectionError(str(exc)) from exc
+            if res.status_code in RETRY_STATUS and attempt < retries:
+                attempt += 1
+                await asyncio.sleep(self.retry_delay(attempt))
+                continue
+            if res.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return res
+
+    @staticmethod
+    def raise_for_status(res: "httpx.Response"):
+        if res.is_error:
+            err = "{} error for url {}".format(res.status_code, res.url)
+            raise requests.HTTPError(err)
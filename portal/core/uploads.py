@@ -0,0 +1,39 @@
+"""
+Manejadores de subida que calculan el SHA-256 de cada archivo mientras
+se recibe, para deduplicar el contenido (core/blobs.py) sin volver a
+leerlo. El hash queda en el atributo sha256 del archivo subido.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class HashingMixin:
+    def new_file(self, *args, **kwargs):
+        # Antes de super(): el manejador en memoria corta la cadena con una excepcion
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        # Si el manejador devuelve los datos, los guarda el siguiente
+        if data is None:
+            self.sha256.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, TemporaryFileUploadHandler):
+    pass
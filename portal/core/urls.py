@@ -1,21 +1,37 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 # from django.views.generic import RedirectView
 
 app_name = "core"
 
+# Con ASYNC_VIEWS, las vistas que esperan a Elasticsearch no ocupan un
+# hilo mientras esperan (servidas por wiki/asgi.py)
+if settings.ASYNC_VIEWS:
+    archive_view = views.AsyncArchiveView.as_view()
+    search_list_view = views.AsyncSearchArchiveListView.as_view()
+else:
+    archive_view = views.ArchiveView.as_view()
+    search_list_view = views.SearchArchiveListView.as_view()
+
 urlpatterns = [
     path("", views.WikiView.as_view(), name="wiki_read"),
     path("section", views.ChildrenView.as_view(), name="children"),
     path("section/<int:root_section_id>", views.SectionView.as_view(), name="section"), 
+    path("section/<int:root_id>/children", views.SectionChildrenView.as_view(), name="section_children"), 
     path("section/", views.CreateSectionView.as_view(), name="create_section"), 
     path("section/<int:root_id>/modal", views.ModalSectionView.as_view(), name="modal_section"), 
     path("archive/<int:root_id>/modal", views.ModalArchiveView.as_view(), name="modal_archive"), 
-    path("archive/<int:archive_id>", views.ArchiveView.as_view(), name="archive"), 
+    path("archive/<int:archive_id>", archive_view, name="archive"), 
+    path("archive/<int:archive_id>/file", views.ArchiveFileView.as_view(), name="archive_file"), 
+    path("archive/<int:archive_id>/preview", views.ArchivePreviewView.as_view(), name="archive_preview"), 
+    path("archive/<int:archive_id>/status", views.ArchiveIndexStatusView.as_view(), name="archive_status"), 
     path("archive/", views.CreateArchiveView.as_view(), name="create_archive"), 
     path("text/markdown", views.MarkdownView.as_view(), name="markdown_text"),
     path("search/", views.SearchArchiveView.as_view(), name="search"), 
-    path("search-list/", views.SearchArchiveListView.as_view(), name="search-list"), 
+    path("search-list/", search_list_view, name="search-list"), 
+    path("search/autocomplete", views.AutocompleteView.as_view(), name="search_autocomplete"), 
     path("search-list/references", views.SearchArchiveListReferencesView.as_view(), name="search_list_references"), 
     path("references/<int:archive_id>", views.ReferencesView.as_view(), name="references"), 
+    path("metrics", views.MetricsView.as_view(), name="metrics"),
 ]
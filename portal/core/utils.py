@@ -1,4 +1,5 @@
 from itertools import chain
+import unicodedata
 import markdown as markdown_tool
 
 def flatten_perms(perms_qs):
@@ -7,3 +8,15 @@ def flatten_perms(perms_qs):
 
 def markdown_to_html(content) -> str:
     return markdown_tool.markdown(content.decode("utf-8"))
+
+def normalize_name(name: str) -> str:
+    """
+    Forma normalizada de un nombre para las busquedas: sin acentos y
+    sin distinguir mayusculas.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.casefold()
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -1,7 +1,19 @@
 # pyright: reportUnknownVariableType=false
+import asyncio
+import mimetypes
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import Permission
-from django.http import HttpRequest, HttpResponse
-from django.views.generic.base import TemplateView
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import Paginator
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from urllib.parse import quote, urlencode
+from django.views.generic.base import TemplateView, View
 from django.views.generic.list import ListView
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import render, get_object_or_404
@@ -13,14 +25,79 @@ from typing import cast, final
 from django.core.files.base import ContentFile
 from django.views.decorators.clickjacking import xframe_options_sameorigin
 from django.views.generic.edit import CreateView
-from .models import Section, Archive, User
-from .service import elastic_service, fscrawler_service
-
-import markdown as markdown_tool
+from .models import IndexStatus, Section, Archive, User
+from .service import elastic_service
+from . import indexing
+from .autocomplete import get_index
+from .preview import read_window, valid_encoding
+from .rendering import rendered_html, store_rendered
+from .caching import get_cached, get_versions, set_cached
+from .metrics import view_metrics
+from .search import CachedPage, ElasticResults, results_key
+from .streaming import iter_range, parse_range
+
+class SectionLevelMixin:
+    """
+    Renderiza un nivel del arbol de secciones (secciones y archivos hijos),
+    paginado, con una precarga opcional de niveles mas profundos.
+    Los parametros GET son 'page' y 'depth'.
+    """
+    template_name = "core/section_view.html"
+    # Paginas siguientes: solo las filas, ver section_page.html
+    page_template = "core/section_page.html"
+    # Consultas por request, ver core/metrics.py
+    query_budget = 8
+
+    def get_int_param(self, request: HttpRequest, name: str, default: int) -> int:
+        try:
+            return max(1, int(request.GET.get(name, default)))
+        except ValueError:
+            return default
+
+    def render_level(self, request: HttpRequest, section: Section):
+        user = cast(User, request.user)
+        page_size = settings.SECTION_TREE_PAGE_SIZE
+        page = self.get_int_param(request, "page", 1)
+        depth = self.get_int_param(
+            request,
+            "depth",
+            settings.SECTION_TREE_PREFETCH_DEPTH
+        )
+        depth = min(depth, settings.SECTION_TREE_MAX_DEPTH)
+        secmap, archmap, has_more = section.children_map(
+            user,
+            depth=depth,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+        next_url = ""
+        if has_more:
+            next_url = "{url}?page={page}&depth={depth}".format(
+                url=reverse("core:section_children", args=[section.id]),
+                page=page + 1,
+                depth=depth
+            )
+        # section_item.html guarda cada seccion renderizada en cache hasta
+        # que cambie su subarbol
+        sections = [sec for children in secmap.values() for sec in children]
+        versions = get_versions(*(Section.subtree_version(sec.id) for sec in sections))
+        return render(
+                request,
+                self.template_name if page == 1 else self.page_template,
+                {
+                    "archmap": archmap,
+                    "secmap": secmap,
+                    "root_id": section.id,
+                    "next_url": next_url,
+                    "subtree_versions": {
+                        sec.id: versions[Section.subtree_version(sec.id)] for sec in sections
+                    },
+                    "tree_cache_timeout": settings.SECTION_TREE_CACHE_TIMEOUT
+                }
+            )
 
 @final
-class ChildrenView(mixins.LoginRequiredMixin, TemplateView):
-    template_name = "core/section_view.html"
+class ChildrenView(mixins.LoginRequiredMixin, SectionLevelMixin, TemplateView):
     login_url = reverse_lazy("wikiapp:login")
     redirect_field_name = "login"
 
@@ -30,16 +107,26 @@ class ChildrenView(mixins.LoginRequiredMixin, TemplateView):
         ms = cast(Section, user.main_section)
         if not ms:
             return HttpResponse("Main section not assigned", status = 404)
-        a,b = ms.all_children_map(user)
-        return render(
-                request,
-                self.template_name,
-                {
-                    "archmap": b,
-                    "secmap": a,
-                    "root_id": ms.id
-                }
-            )
+        return self.render_level(request, ms)
+
+@final
+class SectionChildrenView(mixins.LoginRequiredMixin, SectionLevelMixin, TemplateView):
+    login_url = reverse_lazy("wikiapp:login")
+    redirect_field_name = "login"
+
+    def get(self, request: HttpRequest, root_id: int):
+        assert self.template_name
+        user = cast(User,request.user)
+        ms = user.main_section
+        if not ms:
+            return HttpResponse("Main section not assigned", status = 404)
+        section = get_object_or_404(
+            Section.objects.only("id", "path", "depth"),
+            pk=root_id
+        )
+        if not section.is_descendant_of(ms):
+            return HttpResponse("Unauthorized", status=401)
+        return self.render_level(request, section)
 
 @final
 class ModalSectionView(mixins.LoginRequiredMixin, TemplateView):
@@ -89,6 +176,7 @@ class WikiView(mixins.LoginRequiredMixin, TemplateView):
 @final
 class ArchiveView(mixins.LoginRequiredMixin, TemplateView):
     template_name = "core/archive_view.html"
+    query_budget = {"GET": 8, "DELETE": 20}
     markdown_template = "core/markdown_view.html"
     default_template = "core/archive_view_default.html"
     login_url = reverse_lazy("wikiapp:login")
@@ -98,16 +186,15 @@ class ArchiveView(mixins.LoginRequiredMixin, TemplateView):
     @method_decorator(xframe_options_sameorigin)
     def get(self, request: HttpRequest, archive_id: int):
         assert self.template_name
-        arch = get_object_or_404(Archive, pk=int(archive_id))
+        arch = get_object_or_404(Archive.objects.select_related("blob", "section"), pk=int(archive_id))
         user = cast(User, request.user)
         can_view_archive = arch.find_permission(user, 'view_archive')
         if not can_view_archive:
             return HttpResponse("Unauthorized", status=401)
         if ".md" == arch.extension :
-            text = arch.file.read()
             ctx = {
                 "archive": arch,
-                "file": markdown_tool.markdown(text.decode('utf-8'))
+                "file": rendered_html(arch)
             }
             return render(request,self.markdown_template,ctx)
 
@@ -115,55 +202,236 @@ class ArchiveView(mixins.LoginRequiredMixin, TemplateView):
             ctx = {
                 "archive": arch,
                 "file": arch.file,
-                "date_str": arch.first_time_upload.strftime("%Y/%m/%d")
             } 
             return render(request, self.template_name, ctx)
 
-        ctx = { "content":arch.file.read().decode("utf-8") }
+        ctx = preview_context(arch, offset=0, encoding=None)
 
         return render(request, self.default_template, ctx)
 
     def delete(self, request: HttpRequest, archive_id: int):
         user = cast(User, request.user)
-        archive = get_object_or_404(Archive, pk=archive_id)
+        archive = get_object_or_404(Archive.objects.select_related("section"), pk=archive_id)
 
         if not archive.find_permission(user, "delete_archive"):
             return HttpResponse("Unauthorized", status=401)
 
-        elastic_service.delete_document(
-            index="idx",
-            doc_id=archive.uuid
-        )
-        archive.file.delete()
+        if not archive.blob_id:
+            elastic_service.delete_document(
+                index="idx",
+                doc_id=archive.uuid
+            )
+            archive.file.delete()
+        # Con blob, el contenido se borra al liberar la ultima referencia
+        # (ver signals.archive_deleted)
         archive.delete()
         response = HttpResponse("")
         # agregamos header
         response["HX-Trigger"] = "clearMainSection"
         return response
 
+@final
+class AsyncArchiveView(View):
+    """
+    Version async de ArchiveView (ASYNC_VIEWS): el contenido se lee en
+    un hilo aparte, solo despues de confirmar el permiso.
+    """
+    login_url = reverse_lazy("wikiapp:login")
+    redirect_field_name = "login"
+    query_budget = ArchiveView.query_budget
+
+    async def get(self, request: HttpRequest, archive_id: int):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.login_url, self.redirect_field_name)
+        arch = await Archive.objects.select_related("blob", "section").filter(pk=int(archive_id)).afirst()
+        if arch is None:
+            raise Http404("No Archive matches the given query.")
+
+        if not await sync_to_async(arch.find_permission)(user, "view_archive"):
+            return HttpResponse("Unauthorized", status=401)
+        # La lectura del archivo no usa la base de datos: corre en otro hilo
+        template_name, ctx = await sync_to_async(self.load_content, thread_sensitive=False)(arch)
+        response = await sync_to_async(render)(request, template_name, ctx)
+        # Como xframe_options_sameorigin en ArchiveView, que no se puede
+        # aplicar con method_decorator a un metodo async
+        response["X-Frame-Options"] = "SAMEORIGIN"
+        return response
+
+    def load_content(self, arch: Archive) -> tuple[str, dict]:
+        if ".md" == arch.extension:
+            return ArchiveView.markdown_template, {
+                "archive": arch,
+                "file": rendered_html(arch)
+            }
+        if arch.extension in ArchiveView.iframe_render:
+            return ArchiveView.template_name, {
+                "archive": arch,
+                "file": arch.file,
+            }
+        return ArchiveView.default_template, preview_context(arch, offset=0, encoding=None)
+
+    async def delete(self, request: HttpRequest, archive_id: int):
+        return await sync_to_async(ArchiveView.as_view())(request, archive_id=archive_id)
+
+def preview_context(arch: Archive, *, offset: int, encoding: str | None) -> dict:
+    """
+    Contexto de una ventana de la vista previa de texto, ver core/preview.py.
+    """
+    with arch.file.open("rb") as file:
+        window = read_window(file, offset, settings.TEXT_PREVIEW_SIZE, encoding)
+    next_url = ""
+    if window.next_offset is not None:
+        params = urlencode({"offset": window.next_offset, "encoding": window.encoding})
+        next_url = reverse("core:archive_preview", args=[arch.id]) + "?" + params
+    return {
+        "archive": arch,
+        "content": window.content,
+        "binary": window.binary,
+        "next_url": next_url,
+    }
+
+@final
+class ArchivePreviewView(mixins.LoginRequiredMixin, TemplateView):
+    """
+    Siguientes ventanas de la vista previa de texto, pedidas por el boton
+    "cargar mas" de archive_preview.html.
+    """
+    template_name = "core/archive_preview.html"
+    query_budget = 6
+
+    def get(self, request: HttpRequest, archive_id: int):
+        assert self.template_name
+        arch = get_object_or_404(Archive.objects.select_related("section"), pk=int(archive_id))
+        user = cast(User, request.user)
+        if not arch.find_permission(user, "view_archive"):
+            return HttpResponse("Unauthorized", status=401)
+        try:
+            offset = max(0, int(request.GET.get("offset", 0)))
+        except ValueError:
+            return HttpResponse("Invalid offset", status=400)
+        encoding = valid_encoding(request.GET.get("encoding", ""))
+        ctx = preview_context(arch, offset=offset, encoding=encoding)
+        return render(request, self.template_name, ctx)
+
+@final
+class ArchiveFileView(mixins.LoginRequiredMixin, TemplateView):
+    """
+    Contenido de un archivo, por partes. Soporta Range (el visor de PDF
+    del iframe pide solo las paginas que muestra) y pedidos condicionales
+    (ETag/Last-Modified). Con FILE_ACCEL_REDIRECT el envio lo hace el
+    servidor http (X-Accel-Redirect de NGINX) y el worker queda libre.
+    """
+
+    @method_decorator(xframe_options_sameorigin)
+    def get(self, request: HttpRequest, archive_id: int):
+        arch = get_object_or_404(Archive.objects.select_related("blob", "section"), pk=int(archive_id))
+        user = cast(User, request.user)
+        if not arch.find_permission(user, "view_archive"):
+            return HttpResponse("Unauthorized", status=401)
+
+        name = arch.file.name
+        if not default_storage.exists(name):
+            return HttpResponse("Not found", status=404)
+        size = default_storage.size(name)
+        modified = int(default_storage.get_modified_time(name).timestamp())
+        # El contenido de un blob no cambia, su hash sirve de ETag
+        etag = quote_etag(arch.blob.sha256 if arch.blob else "{}-{}".format(size, modified))
+
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = self.file_response(request, arch, size, etag)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(modified)
+        response["Accept-Ranges"] = "bytes"
+        # Los permisos pueden cambiar: se revalida siempre
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def file_response(self, request: HttpRequest, arch: Archive, size: int, etag: str):
+        content_type = mimetypes.guess_type(arch.fullname)[0] or "application/octet-stream"
+        if settings.FILE_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            # NGINX decodifica la URI: los archivos anteriores a los blobs
+            # conservan el nombre subido, con espacios o acentos
+            response["X-Accel-Redirect"] = settings.FILE_ACCEL_REDIRECT + quote(arch.file.name)
+            response["Content-Disposition"] = content_disposition_header(False, arch.fullname)
+            return response
+
+        byte_range = None
+        header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if header and (not if_range or if_range == etag):
+            try:
+                byte_range = parse_range(header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = "bytes */{}".format(size)
+                return response
+
+        file = default_storage.open(arch.file.name, "rb")
+        if byte_range is None:
+            return FileResponse(file, content_type=content_type, filename=arch.fullname)
+
+        start, length = byte_range
+        response = StreamingHttpResponse(
+            iter_range(file, start, length),
+            status=206,
+            content_type=content_type
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = "bytes {}-{}/{}".format(start, start + length - 1, size)
+        response["Content-Disposition"] = content_disposition_header(False, arch.fullname)
+        return response
+
+@final
+class ArchiveIndexStatusView(mixins.LoginRequiredMixin, TemplateView):
+    """
+    Consultado periodicamente por archive_item.html mientras el archivo
+    esta pendiente de indexar. Al terminar responde 286 para que HTMX
+    deje de consultar y dispara el evento archiveIndexed.
+    """
+    template_name = "core/archive_index_status.html"
+
+    def get(self, request: HttpRequest, archive_id: int):
+        assert self.template_name
+        arch = get_object_or_404(
+            Archive.objects
+                .select_related("section")
+                .only("id", "index_status", "section__path"),
+            pk=archive_id
+        )
+        user = cast(User, request.user)
+        if not arch.find_permission(user, "view_archive"):
+            return HttpResponse("Unauthorized", status=401)
+        response = render(request, self.template_name, {"arch": arch})
+        if arch.index_status != IndexStatus.PENDING:
+            response.status_code = 286
+            response["HX-Trigger"] = "archiveIndexed"
+        return response
+
 class SearchArchiveListView(mixins.LoginRequiredMixin,ListView):
     template_name="core/archive_list.html"
     paginate_by = 10
+    query_budget = 8
     model = Archive
     login_url = reverse_lazy("wikiapp:login")
+    degraded = False
+    results_key = ""
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["degraded"] = self.degraded
+        return ctx
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        # Sin guardar los resultados de una busqueda fallida
+        if self.results_key and not self.degraded and not isinstance(queryset, CachedPage):
+            set_cached(self.results_key, CachedPage.from_page(page), settings.SEARCH_CACHE_TIMEOUT)
+        return paginator, page, object_list, is_paginated
 
     def get_queryset(self):
-        raw_qs_str = """
-        WITH RECURSIVE ancestors AS (
-            SELECT *
-            FROM core_section s 
-            WHERE s.id = %s
-            UNION ALL
-            SELECT cs.*
-            FROM core_section cs, ancestors a 
-            WHERE cs.parent_id = a.id
-        ) SELECT 
-                arch.id, 
-                arch.fullname
-        FROM ancestors
-        INNER JOIN core_archive arch
-        ON ancestors.id = arch.section_id
-        """
         form = SearchForm(self.request.GET)
         if not form.is_valid():
             return []
@@ -172,34 +440,186 @@ class SearchArchiveListView(mixins.LoginRequiredMixin,ListView):
         if len(search_content) <= 2 :
             return []
 
-        qs = super().get_queryset()
         user = cast(User, self.request.user)
         main_section = user.main_section
 
-        by_content = form.cleaned_data["by_content"]
-        if not by_content:
-            like_archive_name = "%{content}%".format(content=search_content)
-            cond = "WHERE arch.fullname LIKE %s"
-            raw_qs_str += cond
-            qs = qs.raw(raw_qs_str,[main_section.id, like_archive_name])
-            return qs
-
-        res = elastic_service.search_by_content(
-            index="idx",
-            content=search_content,
-            extra={}
+        # La pagina puede estar guardada por esta vista o por
+        # SearchArchiveListReferencesView, ver core/search.py
+        self.results_key = results_key(
+            user,
+            main_section,
+            form.cleaned_data,
+            str(self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1)
         )
+        cached = get_cached(self.results_key)
+        if cached is not None:
+            return cached
+
+        results = archive_search(user, main_section, form.cleaned_data)
+        if isinstance(results, ElasticResults):
+            try:
+                results.prefetch(self.get_page_number(), self.paginate_by)
+            except requests.RequestException:
+                # Elasticsearch caido o lento (o circuito abierto, ver
+                # core/transport.py): se avisa en lugar de fallar
+                self.degraded = True
+                return []
+        return results
+
+    def get_page_number(self) -> int:
+        return requested_page(self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg))
+
+def requested_page(page) -> int:
+    try:
+        return max(1, int(page or 1))
+    except ValueError:
+        # "last" y valores invalidos los resuelve el paginador
+        return 1
+
+def subtree_archives(main_section: Section):
+    return Archive.objects \
+        .filter(section__path__startswith=main_section.path)
+
+def search_acl(user: User, main_section: Section) -> dict:
+    return subtree_archives(main_section).acl(user, "view_archive")
+
+def archive_search(user: User, main_section: Section, params: dict,
+                   acl: dict | None = None):
+    """
+    Busqueda de SearchArchiveListView y AsyncSearchArchiveListView:
+    por nombre, un queryset; por contenido, un ElasticResults que filtra
+    los permisos en Elasticsearch (todavia sin buscar). El acl se puede
+    pasar ya calculado (ver search_acl).
+    """
+    qs = subtree_archives(main_section) \
+        .permitted(user, "view_archive") \
+        .only("id", "fullname") \
+        .order_by("fullname", "id")
+
+    if not params["by_content"]:
+        return qs.matching_name(params["name"])
+
+    if acl is None:
+        acl = search_acl(user, main_section)
+    return ElasticResults(
+        qs.only("id", "fullname", "uuid"),
+        content=params["name"],
+        extra={
+            "section_path": main_section.path,
+            "acl": acl,
+            # FsCrawler indexa la extension sin el punto
+            "extension": params["extension"].lstrip("."),
+            "modified_after": params["modified_after"],
+            "modified_before": params["modified_before"]
+        }
+    )
 
-        hits = res["hits"]["hits"]
-        if not hits:
-            return []
+@final
+class AsyncSearchArchiveListView(View):
+    """
+    Version async de SearchArchiveListView (ASYNC_VIEWS), con la misma
+    busqueda (archive_search) y la misma cache de paginas. Mientras
+    espera a Elasticsearch no ocupa un hilo del worker.
+    """
+    template_name = "core/archive_list.html"
+    paginate_by = 10
+    query_budget = 8
+    login_url = reverse_lazy("wikiapp:login")
+
+    async def get(self, request: HttpRequest):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.login_url)
+
+        form = SearchForm(request.GET)
+        if not form.is_valid() or len(form.cleaned_data["name"]) <= 2:
+            return await sync_to_async(self.render_page)(request, [], "", False)
+
+        main_section = await Section.objects.filter(pk=user.main_section_id).afirst()
+        if main_section is None:
+            return await sync_to_async(self.render_page)(request, [], "", False)
+
+        page = request.GET.get("page")
+        key = await sync_to_async(results_key)(user, main_section, form.cleaned_data, str(page or 1))
+        acl = None
+        if form.cleaned_data["by_content"]:
+            # La cache no usa la base de datos: se consulta desde otro hilo
+            # mientras el de la base de datos calcula el acl, que se descarta
+            # si la pagina estaba en cache
+            object_list, acl = await asyncio.gather(
+                sync_to_async(get_cached, thread_sensitive=False)(key),
+                sync_to_async(search_acl)(cast(User, user), main_section)
+            )
+        else:
+            object_list = await sync_to_async(get_cached)(key)
+        degraded = False
+        if object_list is None:
+            object_list = await sync_to_async(archive_search)(
+                cast(User, user),
+                main_section,
+                form.cleaned_data,
+                acl
+            )
+            if isinstance(object_list, ElasticResults):
+                try:
+                    await object_list.aprefetch(requested_page(page), self.paginate_by)
+                except requests.RequestException:
+                    # Ver SearchArchiveListView
+                    object_list, degraded = [], True
+
+        # Paginar y renderizar en un solo paso por el hilo de la base de
+        # datos: con muchos pedidos en curso cada paso espera su turno
+        return await sync_to_async(self.render_page)(request, object_list, key, degraded)
+
+    def render_page(self, request: HttpRequest, object_list, key: str, degraded: bool) -> HttpResponse:
+        paginator = Paginator(object_list, self.paginate_by)
+        page_obj = paginator.get_page(request.GET.get("page"))
+        # Como SearchArchiveListView.paginate_queryset
+        if key and not degraded and not isinstance(object_list, CachedPage):
+            set_cached(key, CachedPage.from_page(page_obj), settings.SEARCH_CACHE_TIMEOUT)
+        ctx = {
+            "object_list": page_obj.object_list,
+            "page_obj": page_obj,
+            "is_paginated": page_obj.has_other_pages(),
+            "degraded": degraded,
+        }
+        return render(request, self.template_name, ctx)
+
+@final
+class AutocompleteView(mixins.LoginRequiredMixin, TemplateView):
+    """
+    Autocompletado por nombre de archivo desde el indice en memoria
+    (ver core/autocomplete.py). La busqueda por contenido sigue yendo
+    a SearchArchiveListView.
+    """
+    template_name = "core/archive_list.html"
+    login_url = reverse_lazy("wikiapp:login")
+
+    def get(self, request: HttpRequest):
+        assert self.template_name
+        form = SearchForm(request.GET)
+        if not form.is_valid() or form.cleaned_data["by_content"]:
+            return HttpResponse(status=204)
+        user = cast(User, request.user)
+        main_section = user.main_section
+        if not main_section:
+            return HttpResponse("Main section not assigned", status = 404)
+
+        limit = settings.AUTOCOMPLETE_LIMIT
+        # Se piden candidatos de mas para completar los resultados
+        # luego de descartar los archivos sin permiso
+        candidates = get_index(main_section).search(
+            form.cleaned_data["name"],
+            limit * 4
+        )
+        allowed = Archive.permitted_ids(
+            user,
+            "view_archive",
+            [c["id"] for c in candidates]
+        )
+        results = [c for c in candidates if c["id"] in allowed][:limit]
+        return render(request, self.template_name, {"object_list": results})
 
-        uuids = [h["_id"] for h in hits]
-        cond = "WHERE arch.uuid in %s"
-        raw_qs_str += cond
-        qs = qs.raw(raw_qs_str,[main_section.id, tuple(uuids)])
-        return qs
-        
 @final
 class SearchArchiveListReferencesView(SearchArchiveListView):
     template_name="core/archive_references_list.html"
@@ -207,6 +627,7 @@ class SearchArchiveListReferencesView(SearchArchiveListView):
 @final
 class ReferencesView(mixins.LoginRequiredMixin, TemplateView):
     template_name="core/reference_view.html"
+    query_budget = 8
 
     def get(self, request: HttpRequest, archive_id: int):
         assert self.template_name
@@ -248,6 +669,25 @@ class SearchArchiveView(mixins.LoginRequiredMixin,TemplateView):
     login_url = reverse_lazy("wikiapp:login")
     extra_context = {"form": SearchForm()}
 
+@final
+class MetricsView(View):
+    """
+    Metricas por vista en el formato de texto de Prometheus, ver
+    core/metrics.py. Solo con METRICS_ENABLED.
+    """
+
+    def get(self, request: HttpRequest):
+        if not settings.METRICS_ENABLED:
+            raise Http404("Metrics are disabled.")
+        if settings.METRICS_TOKEN:
+            expected = "Bearer {}".format(settings.METRICS_TOKEN)
+            allowed = constant_time_compare(request.headers.get("Authorization", ""), expected)
+        else:
+            allowed = request.user.is_staff
+        if not allowed:
+            return HttpResponse("Unauthorized", status=401)
+        return HttpResponse(view_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @final
 class ChildrenViewTest(mixins.LoginRequiredMixin,ListView):
     template_name = "core/section_view.html"
@@ -277,19 +717,19 @@ class MarkdownView(mixins.LoginRequiredMixin,TemplateView):
 
         str_text_file = cd["file"]
         filename = cd["name"] + ".md"
-        with ContentFile(str_text_file, name=filename) as content_file:
+        with ContentFile(str_text_file.encode("utf-8"), name=filename) as content_file:
             user = cast(User, request.user)
-            archive_uuid = fscrawler_service.upload_file(file=content_file)
             created_archive = root_section.create_child_archive(
                 file=content_file,
                 user=user,
                 perms=["view_archive","delete_archive"],
-                fields={"uuid": archive_uuid},
+                fields={},
             )
+            indexing.enqueue(created_archive)
             target = "#sec_{root_id} > div > .children-archives"
             oob_target = target.format(root_id=root_id)
             ctx = { 
-                "file": markdown_tool.markdown(str_text_file),
+                "file": store_rendered(created_archive, str_text_file),
                 "archive": created_archive,
                 "oob_target": oob_target,
             }
@@ -298,6 +738,7 @@ class MarkdownView(mixins.LoginRequiredMixin,TemplateView):
 class CreateArchiveView(mixins.LoginRequiredMixin, CreateView):
     http_method_names = ['post']
     template_name = "core/archive_item.html"
+    query_budget = 30
 
     def post(self, request: HttpRequest):
         """
@@ -317,13 +758,14 @@ class CreateArchiveView(mixins.LoginRequiredMixin, CreateView):
             return HttpResponse("Unauthorized", status=401)
 
         file = form.cleaned_data["file"]
-        archive_uuid = fscrawler_service.upload_file(file=file)
+        # El indexado (OCR de Tika) se hace en segundo plano, ver core/indexing.py
         new_archive = root_section.create_child_archive(
             file=file,
             user=user,
             perms=["delete_archive", "view_archive"],
-            fields={"uuid": archive_uuid}
+            fields={}
         )
+        indexing.enqueue(new_archive)
         ctx = { "arch": new_archive }
         response = render(request, self.template_name, ctx)
         response["HX-Trigger"] = "clearMainSection"
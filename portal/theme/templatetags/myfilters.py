@@ -13,6 +13,12 @@ def hash_or_empty(h, key):
         return h[key]
     return []
 
+@register.filter
+def lookup(h, key):
+    if h and key in h:
+        return h[key]
+    return None
+
 @register.simple_tag
 def btn_get(url, target, trigger, params=""):
     attrs= """
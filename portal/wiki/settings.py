@@ -58,6 +58,7 @@ TAILWIND_APP_NAME="theme"
 
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,7 +75,8 @@ ROOT_URLCONF = 'wiki.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que mide el renderizado, ver core/metrics.py
+        'BACKEND': 'core.metrics.TimedTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -155,6 +157,17 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'portal/media')
 
 MEDIA_URL = "media/"
 
+# Prefijo de una location "internal" de NGINX que sirve MEDIA_ROOT. Si se
+# define, core:archive_file responde con X-Accel-Redirect en lugar de
+# enviar el archivo desde Django.
+FILE_ACCEL_REDIRECT = env("FILE_ACCEL_REDIRECT", default="")
+
+# Calculan el SHA-256 de las subidas para deduplicarlas, ver core/uploads.py
+FILE_UPLOAD_HANDLERS = [
+    "core.uploads.HashingMemoryFileUploadHandler",
+    "core.uploads.HashingTemporaryFileUploadHandler",
+]
+
 X_FRAME_OPTIONS = "SAMEORIGIN"
 
 ELASTIC_KEY = env("ELASTIC_KEY", default="")
@@ -172,3 +185,112 @@ fscrawler_port = env("FSCRAWLER_PORT")
 fscrawler_host = env("FSCRAWLER_HOST")
 
 FSCRAWLER_URL = "http://{}:{}".format(fscrawler_host, fscrawler_port)
+
+# Servicios en memoria en lugar de Elasticsearch y FsCrawler, ver
+# core/fakes.py. Los documentos viven en la memoria de cada proceso.
+USE_FAKE_SERVICES = env.bool("USE_FAKE_SERVICES", default=False)
+
+# Cliente HTTP de Elasticsearch y FsCrawler (segundos), ver core/transport.py
+ELASTIC_POOL_SIZE = env.int("ELASTIC_POOL_SIZE", default=10)
+
+ELASTIC_CONNECT_TIMEOUT = env.float("ELASTIC_CONNECT_TIMEOUT", default=3)
+
+ELASTIC_READ_TIMEOUT = env.float("ELASTIC_READ_TIMEOUT", default=10)
+
+FSCRAWLER_POOL_SIZE = env.int("FSCRAWLER_POOL_SIZE", default=4)
+
+FSCRAWLER_CONNECT_TIMEOUT = env.float("FSCRAWLER_CONNECT_TIMEOUT", default=3)
+
+FSCRAWLER_READ_TIMEOUT = env.float("FSCRAWLER_READ_TIMEOUT", default=300)
+
+HTTP_MAX_RETRIES = env.int("HTTP_MAX_RETRIES", default=2)
+
+HTTP_RETRY_BACKOFF = env.float("HTTP_RETRY_BACKOFF", default=0.5)
+
+CIRCUIT_BREAKER_THRESHOLD = env.int("CIRCUIT_BREAKER_THRESHOLD", default=5)
+
+CIRCUIT_BREAKER_RESET_SECONDS = env.int("CIRCUIT_BREAKER_RESET_SECONDS", default=30)
+
+# Vistas async de busqueda y de archivos, para servir con wiki/asgi.py
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
+# Busqueda por contenido paginada, ver core/search.py. El maximo no puede
+# superar index.max_result_window del indice
+SEARCH_MAX_RESULTS = env.int("SEARCH_MAX_RESULTS", default=10000)
+
+# Largo en caracteres del fragmento resaltado de cada resultado
+SEARCH_HIGHLIGHT_SIZE = env.int("SEARCH_HIGHLIGHT_SIZE", default=150)
+
+# Paginas de resultados en cache, invalidadas al cambiar el subarbol o
+# los permisos (ver core/search.py)
+SEARCH_CACHE_TIMEOUT = env.int("SEARCH_CACHE_TIMEOUT", default=300)
+
+# Carga por niveles del arbol de secciones (ver SectionLevelMixin)
+SECTION_TREE_PAGE_SIZE = env.int("SECTION_TREE_PAGE_SIZE", default=50)
+
+SECTION_TREE_PREFETCH_DEPTH = env.int("SECTION_TREE_PREFETCH_DEPTH", default=1)
+
+SECTION_TREE_MAX_DEPTH = env.int("SECTION_TREE_MAX_DEPTH", default=5)
+
+# Segundos que cada seccion renderizada del arbol queda en la cache local
+# (ver section_item.html); 0 la desactiva
+SECTION_TREE_CACHE_TIMEOUT = env.int("SECTION_TREE_CACHE_TIMEOUT", default=300)
+
+# Cache compartida entre workers ("default") y cache local a cada proceso
+# ("local"), ver core/caching.py
+CACHES = {
+    "default": env.cache_url("DJANGO_CACHE_URL", default="locmemcache://wiki-shared"),
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "wiki-local",
+        "TIMEOUT": env.int("LOCAL_CACHE_TIMEOUT", default=60),
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    },
+}
+
+CACHE_DEFAULT_TIMEOUT = env.int("CACHE_DEFAULT_TIMEOUT", default=300)
+
+PERMISSION_CACHE_TIMEOUT = env.int("PERMISSION_CACHE_TIMEOUT", default=3600)
+
+AUTOCOMPLETE_LIMIT = env.int("AUTOCOMPLETE_LIMIT", default=10)
+
+# Cola de indexado, ver core/indexing.py
+INDEXING_MAX_ATTEMPTS = env.int("INDEXING_MAX_ATTEMPTS", default=5)
+
+INDEXING_RETRY_BASE_SECONDS = env.int("INDEXING_RETRY_BASE_SECONDS", default=10)
+
+INDEXING_LEASE_SECONDS = env.int("INDEXING_LEASE_SECONDS", default=300)
+
+# Renderizado de archivos markdown, ver core/rendering.py. Al cambiar las
+# extensiones correr el comando rerender_markdown.
+MARKDOWN_EXTENSIONS = env.list("MARKDOWN_EXTENSIONS", default=[])
+
+MARKDOWN_EXTENSION_CONFIGS = {}
+
+MARKDOWN_LOCAL_CACHE_MAX_SIZE = env.int("MARKDOWN_LOCAL_CACHE_MAX_SIZE", default=256 * 1024)
+
+# Bytes por ventana de la vista previa de archivos de texto, ver core/preview.py
+TEXT_PREVIEW_SIZE = env.int("TEXT_PREVIEW_SIZE", default=64 * 1024)
+
+# Codificaciones candidatas cuando el archivo no es UTF-8 (vacio: todas)
+TEXT_PREVIEW_ENCODINGS = env.list("TEXT_PREVIEW_ENCODINGS", default=["cp1252", "latin_1"])
+
+# Metricas por vista, ver core/metrics.py. SERVER_TIMING agrega el header
+# Server-Timing a las respuestas. METRICS_ENABLED acumula las metricas y
+# las expone en core:metrics, para quien envie METRICS_TOKEN como Bearer
+# token (sin token, solo para usuarios staff)
+SERVER_TIMING = env.bool("SERVER_TIMING", default=DEBUG)
+
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=False)
+
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+
+# Una vista que supera su query_budget lanza QueryBudgetExceeded en lugar
+# de registrar un warning. No conviene en produccion: la excepcion llega
+# cuando la vista ya termino, despues de un DELETE por ejemplo. El runner
+# de los tests (TEST_RUNNER) lo activa siempre
+QUERY_BUDGET_STRICT = env.bool("QUERY_BUDGET_STRICT", default=False)
+
+TEST_RUNNER = "core.test_runner.TestRunner"
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class WikiappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'wikiapp'
\ No newline at end of file
+    name = 'wikiapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,11 +1,34 @@
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+from core.caching import get_or_compute, get_versions, versioned_key
+from core.models import PermissionHolder, User
 from wikiapp.models import Menu
 
 
+def menus_for(user: User) -> list[dict]:
+    """
+    Menues de los grupos del usuario, en cache hasta que cambien sus
+    grupos (PermissionHolder.membership_version) o los menues (Menu.version).
+    """
+    user_version = PermissionHolder.membership_version(user.pk)
+    versions = get_versions(user_version, Menu.version())
+    key = versioned_key("menus", user.pk, versions[user_version], versions[Menu.version()])
+    menus = Menu.objects \
+        .filter(groups__user=user) \
+        .distinct() \
+        .order_by("id") \
+        .values("name", "reverse_view_url")
+    return get_or_compute(key, lambda: list(menus))
+
+
 def available_menus(request: HttpRequest):
+    # Los fragmentos HTMX no muestran la navbar; los de hx-boost reemplazan
+    # la pagina entera
+    htmx = getattr(request, "htmx", None)
+    if htmx and not htmx.boosted:
+        return {}
     user = request.user
-    if user :
-        available_menus = Menu.objects.filter(groups__user__id=user.id)
-        return {"available_menus": available_menus}
-
-    return {}
+    if not user.is_authenticated:
+        return {}
+    # Solo se buscan si el template los usa
+    return {"available_menus": SimpleLazyObject(lambda: menus_for(user))}
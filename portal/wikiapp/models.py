@@ -9,3 +9,10 @@ class Menu(models.Model):
     reverse_view_url = models.CharField(max_length=200, default="wikiapp:home")
     groups = models.ManyToManyField(Group)
 
+    @staticmethod
+    def version() -> str:
+        """
+        Contador de version de los menues y sus grupos, ver
+        wikiapp/signals.py y core/caching.py.
+        """
+        return "menus"
@@ -0,0 +1,21 @@
+"""
+Invalidacion de los menues en cache (ver context_processors.py). Los
+cambios de grupos de cada usuario los invalida core/signals.py.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.caching import bump_versions
+from .models import Menu
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def menus_changed(sender, **kwargs):
+    bump_versions(Menu.version())
+
+
+@receiver(m2m_changed, sender=Menu.groups.through)
+def menu_groups_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_versions(Menu.version())
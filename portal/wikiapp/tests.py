@@ -1,3 +1,55 @@
-from django.test import TestCase
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase
+
+from core.models import User
+from wikiapp.context_processors import available_menus, menus_for
+from wikiapp.models import Menu
+
+
+class MenuCacheTest(TestCase):
+    def setUp(self):
+        # Los ids se repiten entre tests, igual que las claves de la cache
+        caches["default"].clear()
+        caches["local"].clear()
+        self.user = User.objects.create(username="reader")
+        self.readers = Group.objects.create(name="readers")
+        self.editors = Group.objects.create(name="editors")
+        self.user.groups.add(self.readers, self.editors)
+        self.menu = Menu.objects.create(name="Wiki")
+        self.menu.groups.add(self.readers, self.editors)
+
+    def names(self) -> list[str]:
+        return [menu["name"] for menu in menus_for(self.user)]
+
+    def test_menus_are_listed_once_and_cached(self):
+        self.assertEqual(self.names(), ["Wiki"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ["Wiki"])
+
+    def test_changes_invalidate_the_cache(self):
+        self.assertEqual(self.names(), ["Wiki"])
+        users = Menu.objects.create(name="Users")
+        self.assertEqual(self.names(), ["Wiki"])
+        users.groups.add(self.editors)
+        self.assertEqual(self.names(), ["Wiki", "Users"])
+        users.name = "Accounts"
+        users.save()
+        self.assertEqual(self.names(), ["Wiki", "Accounts"])
+        self.editors.user_set.remove(self.user)
+        self.assertEqual(self.names(), ["Wiki"])
+        self.menu.delete()
+        self.assertEqual(self.names(), [])
+
+    def test_fragments_and_anonymous_users_get_no_menus(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        request.htmx = SimpleNamespace(boosted=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(available_menus(request), {})
+        request.htmx = SimpleNamespace(boosted=True)
+        self.assertEqual([m["name"] for m in available_menus(request)["available_menus"]], ["Wiki"])
+        request.user = AnonymousUser()
+        self.assertEqual(available_menus(request), {})